@@ -325,6 +325,82 @@ FILES_REST_PERMISSION_FACTORY = \
 FILES_REST_STORAGE_FACTORY = \
     'b2share.modules.files.storage.b2share_storage_factory'
 
+#: Let the web server send the local files after the permission checks:
+#: 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache mod_xsendfile,
+#: lighttpd). None sends the files from the application.
+B2SHARE_FILES_SEND_OFFLOAD = None
+
+#: Internal nginx location of each local files directory, used with
+#: 'x-accel-redirect'. Files in other directories are sent by the application.
+#: Example: {'/usr/var/b2share-instance/files': '/_protected_files'}
+B2SHARE_FILES_SEND_OFFLOAD_LOCATIONS = {}
+
+#: Checksums computed in addition to MD5 while the files are written:
+#: 'sha256' and/or 'adler32'. They are stored in the object tags
+#: 'checksum:<algo>' and added to the file PIDs.
+B2SHARE_FILES_EXTRA_CHECKSUMS = []
+
+#: Checksum verification budget of the storage locations without their own
+#: budget: bytes and read operations per second, number of concurrent Celery
+#: tasks sharing it and, optionally, the Celery queue of the workers having
+#: access to the location.
+B2SHARE_FILES_CHECKSUM_DEFAULT_BUDGET = dict(
+    bytes_per_second=100 * 1024 * 1024,
+    iops=100,
+    workers=2,
+    queue=None,
+)
+
+#: Checksum verification budget of each location name, overriding
+#: B2SHARE_FILES_CHECKSUM_DEFAULT_BUDGET.
+#: Example: {'archive': {'bytes_per_second': 20 * 1024 * 1024, 'workers': 1}}
+B2SHARE_FILES_CHECKSUM_BUDGETS = {}
+
+#: Size of the sequential reads of the checksum verification.
+B2SHARE_FILES_CHECKSUM_BUFFER_SIZE = 8 * 1024 * 1024
+
+#: Number of seconds the results of a verification run are kept.
+B2SHARE_FILES_CHECKSUM_RUN_TTL = 7 * 24 * 60 * 60
+
+#: Number of seconds during which an unfinished verification run prevents the
+#: planning of the next run of the same kind.
+B2SHARE_FILES_CHECKSUM_PENDING_TTL = 24 * 60 * 60
+
+#: Merge each uploaded file with an older file having the same checksum and
+#: size in the same location. The existing duplicates are merged with
+#: ``b2share files dedup``.
+B2SHARE_FILES_DEDUPLICATION = False
+
+#: Compare the data of the files before merging them, not only their
+#: checksums.
+B2SHARE_FILES_DEDUPLICATION_VERIFY = True
+
+#: Age of the unused buckets, file instances and files deleted by the
+#: garbage collector.
+B2SHARE_FILES_GC_GRACE_PERIOD = timedelta(days=7)
+
+#: Number of rows or files handled per query by the garbage collector.
+B2SHARE_FILES_GC_BATCH_SIZE = 1000
+
+#: Maximum number of files deleted per second by the garbage collector.
+B2SHARE_FILES_GC_DELETE_RATE = 50
+
+#: Policies moving files between locations, applied daily. Each policy moves
+#: the files of the location 'source' to the location 'destination':
+#: - 'min_age': only the files created before (timedelta arguments),
+#: - 'idle': only the files not downloaded during this period (timedelta
+#:   arguments), according to the file download statistics,
+#: - 'max_files': maximum number of files moved per day,
+#: - 'bytes_per_second': read bandwidth shared by the 'workers' Celery tasks,
+#: - 'queue': optional Celery queue of the workers having access to both
+#:   locations.
+#: The source files are deleted after B2SHARE_FILES_GC_GRACE_PERIOD.
+#: Example: [{'source': 'ssd', 'destination': 'archive',
+#:            'min_age': {'days': 365}, 'idle': {'days': 365},
+#:            'max_files': 10000, 'bytes_per_second': 50 * 1024 * 1024,
+#:            'workers': 2}]
+B2SHARE_FILES_MIGRATION_POLICIES = []
+
 FILES_REST_STORAGE_CLASS_LIST = dict(
     B='B2SafePid',
     S='Standard',
@@ -432,19 +508,27 @@ ACCOUNTS_REST_ACCOUNT_LOADERS = dict(
 # OAI-PMH
 OAISERVER_RECORD_INDEX = 'records'
 OAISERVER_ID_PREFIX = 'oai:b2share.eudat.eu:b2rec/'
-OAISERVER_PAGE_SIZE = 25
+# Records are served from their precomputed renditions, see
+# B2SHARE_OAISERVER_RENDITIONS, thus a page is cheap to build.
+OAISERVER_PAGE_SIZE = 100
 OAISERVER_ADMIN_EMAILS = [SUPPORT_EMAIL]
 OAISERVER_REGISTER_RECORD_SIGNALS = False
 OAISERVER_METADATA_FORMATS = {
     'oai_dc': {
         'namespace': 'http://www.openarchives.org/OAI/2.0/oai_dc/',
         'schema': 'http://www.openarchives.org/OAI/2.0/oai_dc.xsd',
-        'serializer': 'b2share.modules.records.serializers.oaipmh_oai_dc',
+        'serializer': (
+            'b2share.modules.oaiserver.renditions.rendition_dumper',
+            {'metadata_prefix': 'oai_dc'}
+        ),
     },
     'marcxml': {
         'namespace': 'http://www.loc.gov/MARC21/slim',
         'schema': 'http://www.loc.gov/standards/marcxml/schema/MARC21slim.xsd',
-        'serializer': 'b2share.modules.records.serializers.oaipmh_marc21_v1',
+        'serializer': (
+            'b2share.modules.oaiserver.renditions.rendition_dumper',
+            {'metadata_prefix': 'marcxml'}
+        ),
     },
 }
 
@@ -480,18 +564,31 @@ CELERY_BEAT_SCHEDULE = {
         'schedule': timedelta(minutes=15),
         'args': [['file-download-agg']]
     },
-    # Check file checksums
+    # Check file checksums, within the budget of each location
+    # (see B2SHARE_FILES_CHECKSUM_BUDGETS)
     'file-checks': {
-        'task': 'invenio_files_rest.tasks.schedule_checksum_verification',
+        'task': 'b2share.modules.files.tasks.schedule_checksum_verification',
         'schedule': timedelta(hours=1),
         'kwargs': {
-            # Manually check and calculate checksums of files biannually
+            # Check again the files checked more than 180 days ago
             'frequency': {'days': 180},
             'batch_interval': {'hours': 1},
-            # Split batches based on max number of files
+            # Split batches based on max number of files per location
             'max_count': 0,
-            # Split batches based on total files size
-            'max_size': 0,
+        },
+    },
+    # Move files between locations, see B2SHARE_FILES_MIGRATION_POLICIES
+    'files-migration-policies': {
+        'task': 'b2share.modules.files.tasks.apply_migration_policies',
+        'schedule': crontab(minute=0, hour=1),
+    },
+    # Report the unused buckets, file instances and files. Set dry_run to
+    # False to delete them.
+    'files-garbage-collection': {
+        'task': 'b2share.modules.files.tasks.collect_files_garbage',
+        'schedule': crontab(minute=0, hour=3, day_of_week='sunday'),
+        'kwargs': {
+            'dry_run': True,
         },
     },
     # Check file checksums which have previously failed the scan
@@ -499,13 +596,11 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'b2share.modules.files.tasks.schedule_failed_checksum_files',
         'schedule': timedelta(hours=1),
         'kwargs': {
-            # Manually check and calculate checksums of files biannually
+            # Check again the failed files checked more than 7 days ago
             'frequency': {'days': 7},
             'batch_interval': {'hours': 1},
-            # Split batches based on max number of files
+            # Split batches based on max number of files per location
             'max_count': 0,
-            # Split batches based on total files size
-            'max_size': 0,
         },
     },
 }
@@ -591,6 +686,14 @@ FILES_REST_DEFAULT_QUOTA_SIZE = 20 * 1024 * 1024 * 1024 # 20 GB per record
 # and also returned by the REST API when querying http://<HOSTNAME>/api
 SITE_FUNCTION = 'demo' # set to "production" on production instances
 
+# create the REST API application mounted under /api on its first request;
+# only for the web server processes, as the API extensions connect the
+# record and file signal receivers used by the CLI and the Celery workers.
+# It is enabled by b2share.wsgi_ui:ui, the application of the UI web servers
+# (docker/uwsgi/uwsgi_ui.ini and b2share/wsgi_ui.ini). The API web servers
+# (b2share.wsgi_api:api), the CLI and the Celery workers create it eagerly.
+B2SHARE_LAZY_API_MOUNT = False
+
 # if the TRAINING_SITE_LINK parameter is not empty, a message will show up
 # on the front page redirecting the testers to this link
 TRAINING_SITE_LINK = ""
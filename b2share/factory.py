@@ -12,18 +12,20 @@ from __future__ import absolute_import, print_function
 
 import os
 import sys
+import threading
 
 import pkg_resources
 
 from flask import current_app
 
 from invenio_base.app import create_app_factory
-from invenio_base.wsgi import create_wsgi_factory, wsgi_proxyfix
+from invenio_base.wsgi import wsgi_proxyfix
 from invenio_base.signals import app_created, app_loaded
 from invenio_cache import BytecodeCache
 from invenio_config import create_config_loader
 
 from jinja2 import ChoiceLoader, FileSystemLoader
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
 
 from . import config
 
@@ -131,6 +133,60 @@ def app_class():
     return Flask
 
 
+class LazyWSGIApplication(object):
+    """WSGI application created by its factory on the first request.
+
+    Web server processes which never serve a request under the mount point
+    don't pay for loading its extensions and blueprints.
+    """
+
+    def __init__(self, factory, **kwargs):
+        """Initialize the lazy application."""
+        self.factory = factory
+        self.kwargs = kwargs
+        self._app = None
+        self._lock = threading.Lock()
+
+    @property
+    def app(self):
+        """Return the application, creating it if needed."""
+        if self._app is None:
+            with self._lock:
+                if self._app is None:
+                    self._app = self.factory(**self.kwargs)
+        return self._app
+
+    def __call__(self, environ, start_response):
+        """Dispatch the request to the application."""
+        return self.app(environ, start_response)
+
+
+def create_lazy_wsgi_factory(mounts_factories):
+    """Create a WSGI factory mounting lazily created applications.
+
+    Same as :func:`invenio_base.wsgi.create_wsgi_factory` except that the
+    mounted applications are created on their first request when
+    ``B2SHARE_LAZY_API_MOUNT`` is enabled. Only the UI web server
+    processes, which load :mod:`b2share.wsgi_ui`, enable it. The extensions
+    of the API application connect the record and file signal receivers
+    (indexing, integrity checks), thus the CLI commands and the Celery
+    workers always create it.
+    """
+    def create_wsgi(app, **kwargs):
+        if app.config.get('B2SHARE_LAZY_API_MOUNT'):
+            mounts = {
+                mount: LazyWSGIApplication(factory, **kwargs)
+                for mount, factory in mounts_factories.items()
+            }
+        else:
+            mounts = {
+                mount: factory(**kwargs)
+                for mount, factory in mounts_factories.items()
+            }
+        return DispatcherMiddleware(app.wsgi_app, mounts)
+    return create_wsgi
+
+
 create_api = create_app_factory(
     'invenio',
     config_loader=config_loader,
@@ -163,7 +219,8 @@ create_app = create_app_factory(
     blueprint_entry_points=['invenio_base.blueprints'],
     extension_entry_points=['invenio_base.apps'],
     converter_entry_points=['invenio_base.converters'],
-    wsgi_factory=wsgi_proxyfix(create_wsgi_factory({'/api': create_api})),
+    wsgi_factory=wsgi_proxyfix(
+        create_lazy_wsgi_factory({'/api': create_api})),
     instance_path=instance_path,
     static_folder=static_folder,
     static_url_path=static_url_path(),
@@ -35,6 +35,7 @@ from flask import current_app
 from invenio_db import db
 from invenio_files_rest.models import Location
 
+from .generator import generate_data
 from .helpers import load_demo_data
 from . import config as demo_config
 
@@ -92,3 +93,49 @@ def load_config(verbose, force):
     if verbose > 0:
         click.secho('Configuration file "{}" created.'.format(
             instance_config_path), fg='green')
+
+
+@demo.command()
+@with_appcontext
+@click.option('-c', '--communities', default=10, show_default=True,
+              help='Number of communities to create.')
+@click.option('-r', '--records', default=1000, show_default=True,
+              help='Number of records (version chains) to create.')
+@click.option('-k', '--versions-per-record', default=1, show_default=True,
+              help='Number of published versions of each record.')
+@click.option('-f', '--files-per-record', default=1, show_default=True,
+              help='Number of files in each record version.')
+@click.option('--file-size', default=1024, show_default=True,
+              help='Size in bytes of each file. 0 writes no file content.')
+@click.option('-b', '--batch-size', default=500, show_default=True,
+              help='Number of records inserted per transaction.')
+@click.option('--owner', default=None,
+              help='Email of the owner of the generated records.')
+@click.option('--seed', default=None, type=int,
+              help='Seed of the random generator.')
+@click.option('--index/--no-index', default=True,
+              help='Bulk index the generated records.')
+@click.option('-v', '--verbose', count=True)
+def generate(communities, records, versions_per_record, files_per_record,
+             file_size, batch_size, owner, seed, index, verbose):
+    """Generate a large synthetic repository for scale testing.
+
+    Records are inserted in bulk, bypassing PID minting, handle allocation,
+    validation and per record indexing. Do not run this on a real instance.
+    """
+    if communities < 1:
+        raise click.BadParameter('At least one community is required.',
+                                 param_hint='--communities')
+    nb_documents = generate_data(
+        nb_communities=communities,
+        nb_records=records,
+        versions_per_record=versions_per_record,
+        files_per_record=files_per_record,
+        file_size=file_size,
+        batch_size=batch_size,
+        owner_email=owner,
+        index=index,
+        seed=seed,
+        verbose=verbose)
+    click.secho('Generated {} records and deposits.'.format(nb_documents),
+                fg='green')
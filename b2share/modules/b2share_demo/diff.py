@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2017 CERN, SurfsSara
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Comparison of a B2SHARE v1 site with the v2 site it was migrated to.
+
+1. The v2 records are read from the change feed of the v2 site, or from the
+   database of the current site. The compared fields and the files of each
+   record are stored in an SQLite index keyed by the ``B2SHARE_V1_ID``
+   alternate identifier.
+2. Meanwhile the pages of the v1 records are fetched concurrently and spooled
+   to a temporary file.
+3. The v1 records are converted and compared with the index by a pool of
+   worker processes.
+
+Each difference is written as one JSON line in the report.
+"""
+
+from __future__ import absolute_import, print_function
+
+import json
+import multiprocessing
+import sqlite3
+import tempfile
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import requests
+from flask import current_app
+from invenio_db import db
+from requests.adapters import HTTPAdapter
+
+from .migration import _process_record, api_list_v2_record_ids, \
+    directly_list_v2_record_ids, records_endpoint
+
+COMPARED_FIELDS = (
+    'community', 'community_specific', 'contact_email', 'contributors',
+    'creators', 'descriptions', 'keywords', 'language', 'license',
+    'open_access', 'publication_date', 'publisher', 'resource_types',
+    'titles',
+)
+"""Metadata fields compared between the converted v1 and the v2 records."""
+
+MISSING_RECORD = 'missing_record'
+DUPLICATE_V1_ID = 'duplicate_v1_id'
+NO_DOMAIN = 'no_domain'
+METADATA = 'metadata'
+ORDER = 'order'
+FILE_WITHOUT_NAME = 'file_without_name'
+MISSING_FILE = 'missing_file'
+EXTRA_FILE = 'extra_file'
+FILE_SIZE = 'file_size'
+ERROR = 'error'
+
+
+def create_session(pool_size, verify=False):
+    """Create an HTTP session keeping up to ``pool_size`` connections."""
+    session = requests.Session()
+    session.verify = verify
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetch_pages(fetch_page, first_page, executor, window):
+    """Iterate over the items of consecutive pages, fetched concurrently.
+
+    Up to ``window`` pages are requested in advance. The iteration stops at
+    the first empty page.
+
+    :param fetch_page: function returning the list of items of a page.
+    """
+    futures = deque(executor.submit(fetch_page, first_page + i)
+                    for i in range(window))
+    next_page = first_page + window
+    while futures:
+        items = futures.popleft().result()
+        if not items:
+            for future in futures:
+                future.cancel()
+            return
+        for item in items:
+            yield item
+        futures.append(executor.submit(fetch_page, next_page))
+        next_page += 1
+
+
+def v1_page_fetcher(session, api_url, access_token, page_size=100):
+    """Return a function fetching a page of v1 records."""
+    def fetch_page(page):
+        response = session.get(records_endpoint(api_url), params=dict(
+            page_offset=page, page_size=page_size,
+            access_token=access_token))
+        response.raise_for_status()
+        return response.json().get('records')
+    return fetch_page
+
+
+class V2Index(object):
+    """SQLite index of the v2 records keyed by their v1 id."""
+
+    def __init__(self, path, readonly=False):
+        """Create an empty index, or open an existing one read only."""
+        self.path = path
+        if readonly:
+            self.connection = sqlite3.connect(
+                'file:{}?mode=ro'.format(path), uri=True)
+        else:
+            self.connection = sqlite3.connect(path)
+            self.connection.execute('DROP TABLE IF EXISTS records')
+            self.connection.execute(
+                'CREATE TABLE records ('
+                'v1_id TEXT PRIMARY KEY, v2_id TEXT NOT NULL, '
+                'metadata TEXT NOT NULL, files TEXT NOT NULL'
+                ') WITHOUT ROWID')
+
+    @staticmethod
+    def entry(record):
+        """Extract the ``(v1_id, v2_id, metadata, files)`` of a v2 record.
+
+        :param record: v2 record as listed by
+            :func:`~.migration.api_list_v2_record_ids` or
+            :func:`~.migration.directly_list_v2_record_ids`.
+        """
+        metadata = record.get('metadata') or record.get('_source')
+        v1_ids = [
+            x.get('alternate_identifier')
+            for x in metadata.get('alternate_identifiers', [])
+            if x.get('alternate_identifier_type') == 'B2SHARE_V1_ID'
+        ]
+        files = record.get('files') or metadata.get('_files') or []
+        return (
+            str(v1_ids[0]) if v1_ids else None,
+            record.get('id') or record.get('_id'),
+            {key: metadata.get(key) for key in COMPARED_FIELDS},
+            [[f.get('key'), f.get('size')] for f in files],
+        )
+
+    def build(self, records):
+        """Add v2 records to the index.
+
+        Returns:
+            tuple: number of indexed records and list of differences for the
+            v1 ids found in several records.
+        """
+        count = 0
+        duplicates = []
+        with self.connection:
+            for record in records:
+                v1_id, v2_id, metadata, files = self.entry(record)
+                if v1_id is None:
+                    continue
+                try:
+                    self.connection.execute(
+                        'INSERT INTO records VALUES (?, ?, ?, ?)',
+                        (v1_id, v2_id,
+                         json.dumps(metadata, separators=(',', ':')),
+                         json.dumps(files, separators=(',', ':'))))
+                    count += 1
+                except sqlite3.IntegrityError:
+                    duplicates.append(dict(v1_id=v1_id, v2_id=v2_id,
+                                           kind=DUPLICATE_V1_ID))
+        return count, duplicates
+
+    def get(self, v1_id):
+        """Return the ``(v2_id, metadata, files)`` of a v1 id, or None."""
+        row = self.connection.execute(
+            'SELECT v2_id, metadata, files FROM records WHERE v1_id = ?',
+            (v1_id,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), json.loads(row[2])
+
+    def close(self):
+        """Close the index."""
+        self.connection.close()
+
+
+def _same_items(old, new):
+    """Check if two lists have the same items in a different order."""
+    if not isinstance(old, list) or not isinstance(new, list):
+        return False
+    return sorted(json.dumps(x, sort_keys=True) for x in old) == \
+        sorted(json.dumps(x, sort_keys=True) for x in new)
+
+
+def compare_record(old_record, entry):
+    """Compare a v1 record with the index entry of its v2 record.
+
+    Returns:
+        list: the differences, as dicts.
+    """
+    v1_id = str(old_record.get('record_id'))
+    if entry is None:
+        return [dict(v1_id=v1_id, kind=MISSING_RECORD)]
+    v2_id, new_metadata, new_files = entry
+    if not old_record.get('domain'):
+        return [dict(v1_id=v1_id, v2_id=v2_id, kind=NO_DOMAIN)]
+
+    diffs = []
+
+    def add(kind, **kwargs):
+        diffs.append(dict(v1_id=v1_id, v2_id=v2_id, kind=kind, **kwargs))
+
+    converted = _process_record(old_record)
+    for key in COMPARED_FIELDS:
+        old, new = converted.get(key), new_metadata.get(key)
+        if old != new:
+            add(ORDER if _same_items(old, new) else METADATA, field=key,
+                v1=old, v2=new)
+
+    new_sizes = dict((key, size) for key, size in new_files)
+    old_sizes = {}
+    for old_file in old_record.get('files', []):
+        name = old_file.get('name')
+        if not name:
+            add(FILE_WITHOUT_NAME, url=old_file.get('url'))
+            continue
+        old_sizes[name] = old_file.get('size')
+        if name not in new_sizes:
+            add(MISSING_FILE, file=name,
+                private=not converted.get('open_access'))
+        elif int(new_sizes[name]) != int(old_file.get('size')):
+            add(FILE_SIZE, file=name, v1=old_file.get('size'),
+                v2=new_sizes[name])
+    for key in new_sizes:
+        if key not in old_sizes:
+            add(EXTRA_FILE, file=key)
+    return diffs
+
+
+_worker = {}
+
+
+def _init_worker(app, index_path):
+    """Initialize a comparison process."""
+    _worker['app_context'] = app.app_context()
+    _worker['app_context'].push()
+    # The parent's connections must not be used by the children.
+    db.engine.dispose()
+    _worker['index'] = V2Index(index_path, readonly=True)
+
+
+def _compare_chunk(records):
+    index = _worker['index']
+    diffs = []
+    for record in records:
+        v1_id = str(record.get('record_id'))
+        try:
+            diffs.extend(compare_record(record, index.get(v1_id)))
+        except Exception as e:
+            diffs.append(dict(v1_id=v1_id, kind=ERROR, error=str(e)))
+    db.session.remove()
+    return len(records), diffs
+
+
+def _spool_records(records, spool, errors):
+    """Write records to a file, one JSON line each."""
+    try:
+        for record in records:
+            spool.write(json.dumps(record) + '\n')
+    except Exception as e:
+        errors.append(e)
+    finally:
+        spool.flush()
+
+
+def _read_chunks(spool, chunk_size):
+    spool.seek(0)
+    lines = iter(spool)
+    while True:
+        chunk = [json.loads(line) for line in islice(lines, chunk_size)]
+        if not chunk:
+            return
+        yield chunk
+
+
+def diff_sites(v1_api_url, v1_access_token, v2_api_url, v2_access_token,
+               report, index_path, workers=4, fetch_workers=8,
+               page_size=100, chunk_size=100, verify=False):
+    """Compare a v1 site with a v2 site.
+
+    :param v2_api_url: URL of the v2 site. The records of the current site
+        are read from the database if it is None.
+    :param report: file receiving one JSON line per difference.
+    :param index_path: path of the SQLite file of the v2 index.
+    :param workers: number of comparison processes.
+    :param fetch_workers: number of v1 pages fetched concurrently.
+    :returns: :class:`collections.Counter` of the number of records compared,
+        of v2 records indexed and of differences of each kind.
+    """
+    summary = Counter()
+
+    def write(diffs):
+        for diff in diffs:
+            summary[diff['kind']] += 1
+            report.write(json.dumps(diff, sort_keys=True) + '\n')
+
+    session = create_session(fetch_workers + 1, verify=verify)
+    index = V2Index(index_path)
+    spool_errors = []
+    with ThreadPoolExecutor(max_workers=fetch_workers) as executor, \
+            tempfile.TemporaryFile('w+') as spool:
+        v1_records = fetch_pages(
+            v1_page_fetcher(session, v1_api_url, v1_access_token, page_size),
+            0, executor, fetch_workers)
+        spool_thread = threading.Thread(
+            target=_spool_records, args=(v1_records, spool, spool_errors))
+        spool_thread.start()
+
+        if v2_api_url:
+            v2_records = api_list_v2_record_ids(
+                v2_api_url, v2_access_token, session=session,
+                page_size=page_size)
+        else:
+            v2_records = directly_list_v2_record_ids()
+        summary['v2_indexed'], duplicates = index.build(v2_records)
+        write(duplicates)
+        index.close()
+
+        spool_thread.join()
+        if spool_errors:
+            raise spool_errors[0]
+        executor.shutdown()
+
+        app = current_app._get_current_object()
+        # The parent's connections must not be used by the children.
+        db.session.remove()
+        db.engine.dispose()
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(workers, initializer=_init_worker,
+                      initargs=(app, index_path)) as pool:
+            for count, diffs in pool.imap_unordered(
+                    _compare_chunk, _read_chunks(spool, chunk_size)):
+                summary['v1_compared'] += count
+                write(diffs)
+    return summary
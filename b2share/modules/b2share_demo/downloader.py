@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2017 CERN, SurfsSara
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Concurrent and resumable download of B2SHARE v1 records.
+
+The downloaded data has the layout expected by
+:func:`b2share.modules.b2share_demo.migration.process_v1_record`: one
+directory per record containing ``___record___.json`` and the files
+``file_0``, ``file_1``...
+
+Files are first written to a ``.part`` file. An interrupted download is
+resumed with an HTTP Range request. The size and, when the v1 metadata
+provides it, the checksum of each file are verified while it is written. Every
+completed file and record is appended to ``manifest.jsonl`` so that a new run
+skips them.
+
+This module does not depend on the Flask application.
+"""
+
+from __future__ import absolute_import, print_function
+
+import hashlib
+import json
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+MANIFEST_FILE = 'manifest.jsonl'
+RECORD_FILE = '___record___.json'
+CHUNK_SIZE = 1024 * 1024
+
+
+class DownloadError(Exception):
+    """Raised when a downloaded file does not match its v1 metadata."""
+
+
+def v1_file_url(url, v1_url_base):
+    """Rewrite a file URL of the v1 metadata to the v1 server to use."""
+    url = url.replace('https://b2share.eudat.eu/', v1_url_base)
+    return url.replace('/api/record/', '/record/')
+
+
+def parse_checksum(file_dict):
+    """Return the ``(algorithm, hexdigest)`` of a v1 file, or None.
+
+    Checksums without algorithm prefix are MD5 digests.
+    """
+    checksum = file_dict.get('checksum')
+    if not checksum:
+        return None
+    algorithm, _, value = checksum.rpartition(':')
+    return (algorithm or 'md5').lower(), value.lower()
+
+
+def new_digest(checksum):
+    """Return a hash object for a parsed checksum, or None.
+
+    None is also returned for an algorithm which :mod:`hashlib` does not
+    provide, the file is then not verified.
+    """
+    if not checksum:
+        return None
+    try:
+        return hashlib.new(checksum[0])
+    except ValueError:
+        return None
+
+
+class Manifest(object):
+    """Append-only, thread-safe list of the completed downloads."""
+
+    def __init__(self, path):
+        """Load the manifest if it exists."""
+        self.path = path
+        self.completed = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        self.completed.add(self.key(**json.loads(line)))
+
+    @staticmethod
+    def key(record, file=None, **kwargs):
+        """Identifier of a record, or of a file of a record."""
+        return (str(record), file)
+
+    def __contains__(self, key):
+        return key in self.completed
+
+    def is_complete(self, record):
+        """Check if a record and all its files were downloaded."""
+        return self.key(record) in self.completed
+
+    def add(self, record, file=None, **info):
+        """Mark a record or file as downloaded."""
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(dict(record=str(record), file=file,
+                                        **info)) + '\n')
+            self.completed.add(self.key(record, file))
+
+
+class V1Downloader(object):
+    """Download the records of a B2SHARE v1 instance with a thread pool."""
+
+    def __init__(self, v1_url_base, token, target_dir, workers=8,
+                 page_size=100, chunk_size=CHUNK_SIZE, verify=False,
+                 logfile=None, echo=print):
+        """Initialize the downloader.
+
+        :param v1_url_base: v1 server URL, ending with a slash.
+        :param token: v1 access token.
+        :param target_dir: directory receiving the records.
+        :param workers: maximum number of concurrent file downloads.
+        :param verify: verify the TLS certificate of the v1 server.
+        """
+        self.v1_url_base = v1_url_base
+        self.token = token
+        self.target_dir = target_dir
+        self.workers = workers
+        self.page_size = page_size
+        self.chunk_size = chunk_size
+        self.logfile = logfile
+        self.echo = echo
+        self.manifest = Manifest(os.path.join(target_dir, MANIFEST_FILE))
+        self.session = requests.Session()
+        self.session.verify = verify
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.errors = []
+        self._errors_lock = threading.Lock()
+
+    def _log_error(self, message):
+        with self._errors_lock:
+            self.errors.append(message)
+            if self.logfile:
+                self.logfile.write('\n********************')
+                self.logfile.write('\nERROR: {}\n'.format(message))
+                self.logfile.write('\n********************')
+
+    def list_records(self, limit=None):
+        """Iterate over the records of the v1 API.
+
+        :param limit: stop after the record with this id.
+        """
+        url = urljoin(self.v1_url_base, 'records')
+        page = 0
+        while True:
+            response = self.session.get(url, params=dict(
+                access_token=self.token, page_size=self.page_size,
+                page_offset=page))
+            response.raise_for_status()
+            records = response.json()['records']
+            if not records:
+                return
+            for record in records:
+                yield record
+                if limit is not None and \
+                        int(record.get('record_id')) >= limit:
+                    return
+            page += 1
+
+    def download(self, limit=None):
+        """Download every record and file which is not yet in the manifest.
+
+        Returns:
+            list: error messages.
+        """
+        # Bound the number of pending tasks so that listing the records
+        # doesn't run far ahead of the downloads.
+        slots = threading.BoundedSemaphore(self.workers * 4)
+
+        def run(function, *args):
+            try:
+                function(*args)
+            except Exception:
+                self._log_error(traceback.format_exc())
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for record in self.list_records(limit=limit):
+                slots.acquire()
+                executor.submit(run, self.download_record, record, executor,
+                                slots)
+        return self.errors
+
+    def download_record(self, record, executor=None, slots=None):
+        """Download a record's metadata and schedule its files."""
+        recid = str(record.get('record_id'))
+        if self.manifest.key(recid) in self.manifest:
+            return
+        self.echo('Download record {} "{}"'.format(recid,
+                                                   record.get('title')))
+        directory = os.path.join(self.target_dir, recid)
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = os.path.join(directory, RECORD_FILE + '.part')
+        with open(tmp_path, 'w') as f:
+            json.dump(record, f)
+        os.replace(tmp_path, os.path.join(directory, RECORD_FILE))
+
+        files = record.get('files', [])
+        pending = [len(files)]
+        pending_lock = threading.Lock()
+
+        def file_done():
+            with pending_lock:
+                pending[0] -= 1
+                last = pending[0] == 0
+            if last:
+                self.manifest.add(recid, files=len(files))
+
+        if not files:
+            self.manifest.add(recid, files=0)
+        for index, file_dict in enumerate(files):
+            if executor is None:
+                self._download_file_task(recid, index, file_dict, file_done)
+                continue
+            # The file tasks take slots as well. The record task holds one,
+            # thus blocking here would deadlock with a single slot left.
+            if slots is not None and not slots.acquire(blocking=False):
+                self._download_file_task(recid, index, file_dict, file_done)
+                continue
+
+            def run(*args):
+                try:
+                    self._download_file_task(*args)
+                finally:
+                    if slots is not None:
+                        slots.release()
+            executor.submit(run, recid, index, file_dict, file_done)
+
+    def _download_file_task(self, recid, index, file_dict, done):
+        try:
+            self.download_file(recid, index, file_dict)
+        except Exception as e:
+            self._log_error('record {} file {} "{}": {}'.format(
+                recid, index, file_dict.get('name'), e))
+        else:
+            done()
+
+    def download_file(self, recid, index, file_dict):
+        """Download one file, resuming a partial download if any.
+
+        :raises DownloadError: if the size or checksum does not match.
+        """
+        if self.manifest.key(recid, index) in self.manifest:
+            return
+        path = os.path.join(self.target_dir, recid, 'file_{}'.format(index))
+        part_path = path + '.part'
+        expected_size = int(file_dict.get('size'))
+        checksum = parse_checksum(file_dict)
+        digest = new_digest(checksum)
+        if checksum and digest is None:
+            self.echo('    Unknown checksum algorithm {}, the file "{}" is '
+                      'not verified'.format(checksum[0],
+                                            file_dict.get('name')))
+            checksum = None
+
+        offset = os.path.getsize(part_path) \
+            if os.path.exists(part_path) else 0
+        if offset > expected_size:
+            offset = 0
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+        url = v1_file_url(file_dict['url'], self.v1_url_base)
+        self.echo('    Download file "{}"{}'.format(
+            file_dict.get('name'),
+            ' from byte {}'.format(offset) if offset else ''))
+        with self.session.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 416 and offset == expected_size:
+                # the partial file is complete
+                pass
+            else:
+                response.raise_for_status()
+                if offset and response.status_code != 206:
+                    # the server ignored the range
+                    offset = 0
+                if offset and digest:
+                    with open(part_path, 'rb') as f:
+                        for chunk in iter(lambda: f.read(self.chunk_size),
+                                          b''):
+                            digest.update(chunk)
+                with open(part_path, 'ab' if offset else 'wb') as f:
+                    for chunk in response.iter_content(self.chunk_size):
+                        f.write(chunk)
+                        if digest:
+                            digest.update(chunk)
+        if response.status_code == 416 and digest:
+            with open(part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                    digest.update(chunk)
+
+        size = os.path.getsize(part_path)
+        if size != expected_size:
+            if size > expected_size:
+                os.remove(part_path)
+            raise DownloadError('size {} instead of {}'.format(
+                size, expected_size))
+        if digest and digest.hexdigest() != checksum[1]:
+            os.remove(part_path)
+            raise DownloadError('{} checksum {} instead of {}'.format(
+                checksum[0], digest.hexdigest(), checksum[1]))
+        os.replace(part_path, path)
+        self.manifest.add(recid, index, size=size, checksum=(
+            '{}:{}'.format(checksum[0], checksum[1]) if checksum else None))
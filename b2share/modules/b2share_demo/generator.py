@@ -0,0 +1,483 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2016 CERN.
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""B2Share synthetic repository generator.
+
+The generator creates communities, block schemas, records with version chains,
+buckets and file instances directly with bulk inserts. PID minting, handle
+allocation, JSON Schema validation and per record indexing are skipped, which
+makes it possible to create millions of records on a laptop in order to
+profile B2Share under a production-like load.
+
+WARNING - the generated data is not meant to be used on real instances. No
+handles or DOIs are allocated and no record history is stored.
+"""
+
+from __future__ import absolute_import, print_function
+
+import hashlib
+import json
+import os
+import random
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime
+from urllib.parse import urlparse, urlunsplit
+
+import click
+from flask import current_app
+
+from invenio_accounts.models import User
+from invenio_db import db
+from invenio_files_rest.helpers import make_path
+from invenio_files_rest.models import Bucket, FileInstance, Location, \
+    ObjectVersion
+from invenio_indexer.api import RecordIndexer
+from invenio_oaiserver.utils import datetime_to_datestamp
+from invenio_pidrelations.models import PIDRelation
+from invenio_pidrelations.utils import resolve_relation_type_config
+from invenio_pidstore.models import PersistentIdentifier, PIDStatus, Redirect
+from invenio_records.models import RecordMetadata
+from invenio_records_files.models import RecordsBuckets
+
+from b2share.modules.communities.api import Community
+from b2share.modules.schemas.api import BlockSchema, CommunitySchema
+from b2share.modules.schemas.helpers import resolve_schemas_ref
+from b2share.modules.schemas.serializers import \
+    community_schema_json_schema_link, \
+    community_schema_draft_json_schema_link
+from b2share.modules.records.indexer import record_to_index
+
+
+GeneratedCommunity = namedtuple('GeneratedCommunity', [
+    'id', 'block_schema_id', 'record_schema', 'draft_schema'
+])
+
+
+WORDS = [
+    'climate', 'ocean', 'genome', 'protein', 'language', 'corpus', 'sensor',
+    'satellite', 'biodiversity', 'seismic', 'atmosphere', 'cohort', 'survey',
+    'simulation', 'particle', 'soil', 'river', 'glacier', 'speech', 'archive',
+    'microscopy', 'sample', 'observation', 'model', 'forest', 'isotope',
+]
+
+
+GENERATED_BLOCK_SCHEMA = {
+    '$schema': 'http://json-schema.org/draft-04/schema#',
+    'title': 'Generated community metadata',
+    'type': 'object',
+    'properties': {
+        'study_id': {'title': 'Study ID', 'type': 'string'},
+        'instrument': {'title': 'Instrument', 'type': 'string'},
+        'sample_count': {'title': 'Sample count', 'type': 'integer'},
+    },
+    'additionalProperties': False,
+}
+
+
+def generate_data(nb_communities, nb_records, versions_per_record,
+                  files_per_record, file_size=1024, batch_size=500,
+                  owner_email=None, index=True, seed=None, verbose=0):
+    """Generate a synthetic repository.
+
+    Args:
+        nb_communities (int): number of communities to create.
+        nb_records (int): number of version chains to create.
+        versions_per_record (int): number of published versions per chain.
+        files_per_record (int): number of files in each version.
+        file_size (int): size in bytes of each generated file. No content is
+            written on disk if it is 0.
+        batch_size (int): number of version chains inserted per transaction.
+        owner_email (str): email of the owner of the generated records.
+        index (bool): bulk index the generated records and deposits.
+        seed (int): seed of the random generator, for reproducible data.
+        verbose (int): verbosity level.
+
+    Returns:
+        int: the number of generated records and deposits.
+    """
+    rng = random.Random(seed)
+    base_url = urlunsplit((
+        current_app.config.get('PREFERRED_URL_SCHEME', 'http'),
+        current_app.config['JSONSCHEMAS_HOST'],
+        current_app.config.get('APPLICATION_ROOT') or '', '', ''
+    ))
+    with current_app.test_request_context('/', base_url=base_url):
+        owner = _get_or_create_owner(owner_email)
+        communities = _generate_communities(nb_communities, verbose)
+    db.session.commit()
+
+    location = Location.get_default()
+    if location is None:
+        raise click.ClickException('No default file location is defined.')
+    generator = _RecordChainGenerator(
+        communities=communities,
+        owner_id=owner.id,
+        location=location,
+        versions=versions_per_record,
+        files=files_per_record,
+        file_size=file_size,
+        rng=rng,
+    )
+
+    indexed_ids = []
+    start = time.time()
+    for batch_start in range(0, nb_records, batch_size):
+        nb_chains = min(batch_size, nb_records - batch_start)
+        rows = generator.generate_batch(nb_chains)
+        _bulk_insert(rows)
+        db.session.commit()
+        indexed_ids.extend(row['id'] for row in rows.records)
+        if verbose > 0:
+            done = batch_start + nb_chains
+            click.secho('Generated {} / {} version chains ({:.0f}/s)'.format(
+                done, nb_records, done / max(time.time() - start, 1e-6)))
+
+    if index and indexed_ids:
+        if verbose > 0:
+            click.secho('Indexing {} documents'.format(len(indexed_ids)),
+                        fg='yellow', bold=True)
+        indexer = RecordIndexer(record_to_index=record_to_index)
+        indexer.bulk_index(indexed_ids)
+        indexer.process_bulk_queue()
+    return len(indexed_ids)
+
+
+def _get_or_create_owner(email):
+    """Return the owner of the generated records, creating it if needed."""
+    email = email or 'generator@example.com'
+    user = User.query.filter(User.email == email).one_or_none()
+    if user is None:
+        accounts = current_app.extensions['invenio-accounts']
+        with db.session.begin_nested():
+            user = accounts.datastore.create_user(email=email, active=True)
+            db.session.add(user)
+    return user
+
+
+def _generate_communities(nb_communities, verbose):
+    """Create communities, each with one block schema and community schema.
+
+    Communities are few so they are created with the regular API, which also
+    creates their roles, permissions and OAI sets.
+    """
+    if verbose > 0:
+        click.secho('Creating {} communities'.format(nb_communities),
+                    fg='yellow', bold=True)
+    suffix = uuid.uuid4().hex[:8]
+    communities = []
+    with db.session.begin_nested():
+        for idx in range(nb_communities):
+            community = Community.create_community(
+                name='generated-{}-{}'.format(suffix, idx),
+                description='Generated community number {}.'.format(idx),
+                publication_workflow='direct_publish',
+            )
+            block_schema = BlockSchema.create_block_schema(
+                community.id, 'generated-{}-{}'.format(suffix, idx))
+            block_schema.create_version(GENERATED_BLOCK_SCHEMA)
+            community_schema_str = json.dumps({
+                '$schema': 'http://json-schema.org/draft-04/schema#',
+                'type': 'object',
+                'properties': {
+                    str(block_schema.id): {
+                        '$ref': '$BLOCK_SCHEMA_VERSION_URL[{}::0]'
+                                '#/json_schema'.format(block_schema.id)
+                    }
+                },
+                'additionalProperties': False,
+            })
+            community_schema = CommunitySchema.create_version(
+                community_id=community.id,
+                community_schema=json.loads(
+                    resolve_schemas_ref(community_schema_str)),
+                root_schema_version=0)
+            communities.append(GeneratedCommunity(
+                id=community.id,
+                block_schema_id=block_schema.id,
+                record_schema=community_schema_json_schema_link(
+                    community_schema, _external=True),
+                draft_schema=community_schema_draft_json_schema_link(
+                    community_schema, _external=True),
+            ))
+            if verbose > 1:
+                click.secho('Created community {}'.format(community.name))
+    return communities
+
+
+class _BatchRows(object):
+    """Rows of every table filled for one batch of version chains."""
+
+    def __init__(self):
+        self.pids = []
+        self.redirects = []
+        self.relations = []
+        self.records = []
+        self.buckets = []
+        self.files = []
+        self.objects = []
+        self.records_buckets = []
+
+
+class _RecordChainGenerator(object):
+    """Generate the database rows of record version chains."""
+
+    def __init__(self, communities, owner_id, location, versions, files,
+                 file_size, rng):
+        self.communities = communities
+        self.owner_id = owner_id
+        self.location = location
+        self.versions = max(versions, 1)
+        self.files = files
+        self.file_size = file_size
+        self.rng = rng
+        self.version_relation = resolve_relation_type_config('version').id
+        self.oai_prefix = current_app.config.get('OAISERVER_ID_PREFIX',
+                                                 'oai:')
+        self.storage_class = current_app.config[
+            'DEPOSIT_DEFAULT_STORAGE_CLASS']
+        self.path_dimensions = current_app.config[
+            'FILES_REST_STORAGE_PATH_DIMENSIONS']
+        self.path_split_length = current_app.config[
+            'FILES_REST_STORAGE_PATH_SPLIT_LENGTH']
+
+    def generate_batch(self, nb_chains):
+        """Generate the rows of ``nb_chains`` version chains."""
+        rows = _BatchRows()
+        chains = [self._generate_chain(rows) for _ in range(nb_chains)]
+        # PIDRelation and Redirect reference the integer primary keys of the
+        # PIDs, thus the PIDs are inserted first and their ids fetched back
+        # with a single query.
+        _insert_mappings(PersistentIdentifier, rows.pids)
+        rows.pids = []
+        pid_ids = dict(db.session.query(
+            PersistentIdentifier.pid_value, PersistentIdentifier.id
+        ).filter(
+            PersistentIdentifier.pid_type == 'b2rec',
+            PersistentIdentifier.pid_value.in_(
+                [pid for chain in chains for pid in chain])
+        ))
+        for chain in chains:
+            parent_id = pid_ids[chain[0]]
+            for index, child in enumerate(chain[1:]):
+                rows.relations.append(dict(
+                    parent_id=parent_id,
+                    child_id=pid_ids[child],
+                    relation_type=self.version_relation,
+                    index=index,
+                ))
+        for redirect, chain in zip(rows.redirects, chains):
+            redirect['pid_id'] = pid_ids[chain[-1]]
+        return rows
+
+    def _generate_chain(self, rows):
+        """Generate one record with its versions.
+
+        Returns:
+            list: the parent PID value followed by the version PID values.
+        """
+        community = self.rng.choice(self.communities)
+        now = datetime.utcnow()
+        parent_value = uuid.uuid4().hex
+        redirect_id = uuid.uuid4()
+        rows.pids.append(self._pid('b2rec', parent_value, None, redirect_id,
+                                   PIDStatus.REDIRECTED, now))
+        rows.redirects.append(dict(id=redirect_id, created=now, updated=now))
+
+        metadata = self._generate_metadata(community)
+        chain = [parent_value]
+        files = []
+        for version in range(self.versions):
+            # Each new version keeps the files of the previous version, like
+            # a bucket snapshot, and replaces one of them.
+            if version == 0:
+                files = [self._generate_file(rows, 'file-{}.dat'.format(i),
+                                             now)
+                         for i in range(self.files)]
+            elif files:
+                replaced = self.rng.randrange(len(files))
+                files[replaced] = self._generate_file(
+                    rows, files[replaced]['key'], now)
+            chain.append(self._generate_version(
+                rows, community, parent_value, metadata, files, version, now))
+        return chain
+
+    def _generate_version(self, rows, community, parent_value, metadata,
+                          files, version, now):
+        """Generate the published record and the deposit of one version."""
+        dep_id, rec_id = uuid.uuid4(), uuid.uuid4()
+        pid_value = dep_id.hex
+        oai_value = '{}{}'.format(self.oai_prefix, pid_value)
+        rows.pids.extend([
+            self._pid('b2dep', pid_value, 'rec', dep_id,
+                      PIDStatus.REGISTERED, now),
+            self._pid('b2rec', pid_value, 'rec', rec_id,
+                      PIDStatus.REGISTERED, now),
+            self._pid('oai', oai_value, 'rec', rec_id,
+                      PIDStatus.REGISTERED, now, provider='oai'),
+        ])
+
+        record = dict(metadata)
+        record.update({
+            'version': str(version + 1),
+            'publication_state': 'published',
+            'publication_date': now.date().isoformat(),
+            '_deposit': {
+                'id': pid_value,
+                'status': 'published',
+                'owners': [self.owner_id],
+                'created_by': self.owner_id,
+                'pid': {'type': 'b2rec', 'value': pid_value,
+                        'revision_id': 0},
+            },
+            '_pid': [
+                {'value': parent_value, 'type': 'vb2rec'},
+                {'value': pid_value, 'type': 'b2rec'},
+            ],
+            '_oai': {
+                'id': oai_value,
+                'sets': [str(community.id)],
+                'updated': datetime_to_datestamp(now),
+            },
+        })
+        for id_, schema in ((rec_id, community.record_schema),
+                            (dep_id, community.draft_schema)):
+            bucket_id = uuid.uuid4()
+            size = sum(f['size'] for f in files)
+            rows.buckets.append(dict(
+                id=bucket_id,
+                default_location=self.location.id,
+                default_storage_class=self.storage_class,
+                size=size,
+                locked=True,
+                deleted=False,
+                created=now,
+                updated=now,
+            ))
+            rows.records_buckets.append(dict(record_id=id_,
+                                             bucket_id=bucket_id))
+            dumped_files = []
+            for f in files:
+                version_id = uuid.uuid4()
+                rows.objects.append(dict(
+                    version_id=version_id,
+                    key=f['key'],
+                    bucket_id=bucket_id,
+                    file_id=f['id'],
+                    is_head=True,
+                    created=now,
+                    updated=now,
+                ))
+                dumped_files.append({
+                    'bucket': str(bucket_id),
+                    'checksum': f['checksum'],
+                    'key': f['key'],
+                    'size': f['size'],
+                    'version_id': str(version_id),
+                    'b2safe_pid': False,
+                })
+            json_ = dict(record, _files=dumped_files)
+            json_['$schema'] = schema
+            rows.records.append(dict(id=id_, json=json_, version_id=1,
+                                     created=now, updated=now))
+        return pid_value
+
+    def _generate_metadata(self, community):
+        """Generate the metadata shared by all the versions of a record."""
+        keywords = self.rng.sample(WORDS, 4)
+        return {
+            'titles': [{'title': ' '.join(
+                w.capitalize() for w in self.rng.sample(WORDS, 5))}],
+            'descriptions': [{
+                'description': ' '.join(self.rng.choice(WORDS)
+                                        for _ in range(60)),
+                'description_type': 'Abstract',
+            }],
+            'creators': [{'creator_name': 'Generator {}'.format(
+                self.rng.randrange(1000))}],
+            'keywords': keywords,
+            'open_access': self.rng.random() > 0.1,
+            'community': str(community.id),
+            'community_specific': {
+                str(community.block_schema_id): {
+                    'study_id': uuid.uuid4().hex[:12],
+                    'instrument': self.rng.choice(WORDS),
+                    'sample_count': self.rng.randrange(10000),
+                }
+            },
+        }
+
+    def _generate_file(self, rows, key, now):
+        """Generate a file instance and, if needed, write its content."""
+        file_id = uuid.uuid4()
+        uri = make_path(self.location.uri, str(file_id), 'data',
+                        self.path_dimensions, self.path_split_length)
+        checksum = hashlib.md5()
+        if self.file_size > 0:
+            content = self.rng.getrandbits(8 * self.file_size).to_bytes(
+                self.file_size, 'little')
+            checksum.update(content)
+            path = urlparse(uri).path
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as fp:
+                fp.write(content)
+        row = dict(
+            id=file_id,
+            uri=uri,
+            storage_class=self.storage_class,
+            size=self.file_size,
+            checksum='md5:{}'.format(checksum.hexdigest()),
+            readable=True,
+            writable=False,
+            created=now,
+            updated=now,
+        )
+        rows.files.append(row)
+        return dict(id=file_id, key=key, size=self.file_size,
+                    checksum=row['checksum'])
+
+    @staticmethod
+    def _pid(pid_type, pid_value, object_type, object_uuid, status, now,
+             provider=None):
+        return dict(pid_type=pid_type, pid_value=pid_value,
+                    pid_provider=provider, status=status,
+                    object_type=object_type, object_uuid=object_uuid,
+                    created=now, updated=now)
+
+
+def _insert_mappings(model, rows):
+    """Insert rows with a single executemany, skipping ORM events."""
+    if rows:
+        db.session.bulk_insert_mappings(model, rows)
+
+
+def _bulk_insert(rows):
+    """Insert the remaining rows of a batch in foreign key order."""
+    _insert_mappings(Redirect, rows.redirects)
+    _insert_mappings(PIDRelation, rows.relations)
+    _insert_mappings(RecordMetadata, rows.records)
+    _insert_mappings(Bucket, rows.buckets)
+    _insert_mappings(FileInstance, rows.files)
+    _insert_mappings(ObjectVersion, rows.objects)
+    _insert_mappings(RecordsBuckets, rows.records_buckets)
@@ -28,75 +28,40 @@ from __future__ import absolute_import, print_function
 import json
 import os
 import traceback
-import ssl
-from pprint import pprint
 from flask import current_app
 import click
 import requests
-from six import BytesIO
 from urllib.parse import urljoin
 
 from invenio_db import db
-from invenio_search.api import RecordsSearch
+from invenio_pidstore.models import PersistentIdentifier, PIDStatus
+from invenio_records.models import RecordMetadata
 from invenio_accounts.models import User
-from invenio_files_rest.models import ObjectVersion
 from b2share.modules.deposit.api import Deposit
 from b2share.modules.communities import Community
+from b2share.modules.files.ingest import COPY, import_file
+from b2share.modules.records.providers import RecordUUIDProvider
 
+from .downloader import V1Downloader, parse_checksum
 from .helpers import resolve_block_schema_id, _create_user
 
 
-MAX_PAGE = 8
-
-
-
-def download_v1_data(token, target_dir, logfile, limit=None):
+def download_v1_data(token, target_dir, logfile, limit=None, workers=8):
     """
     Download the data from B2SHARE V1 records using token in to target_dir .
+
+    Files are downloaded concurrently. Downloads which were interrupted are
+    resumed, see :mod:`b2share.modules.b2share_demo.downloader`.
     """
-    V1_URL_BASE = current_app.config.get('V1_URL_BASE')
-    url = "%srecords" % V1_URL_BASE
-    params = {}
-    params['access_token'] = token
-    params['page_size'] = 100
-    page_counter = 0
-    os.chdir(target_dir)
-    while True:
-        params['page_offset'] = page_counter
-        click.secho("Params to download: %s" % str(params))
-        r = requests.get(url, params=params, verify=False)
-        r.raise_for_status()
-        recs = json.loads(r.text)['records']
-        if len(recs) == 0:
-            return # no more records
-        for record in recs:
-            recid = str(record.get('record_id'))
-            click.secho("Download record : %s" % recid)
-            if not os.path.exists(recid):
-                os.mkdir(recid)
-            download_v1_record(recid, record, logfile)
-            if (limit is not None) and int(recid) >= limit:
-                return # limit reached
-        page_counter = page_counter + 1
-
-
-def download_v1_record(recid, record, logfile):
-    click.secho('Download record {} "{}"'.format(recid, record.get('title')))
-    directory = recid
-    target_file = os.path.join(directory, '___record___.json')
-    with open(target_file, 'w') as f:
-        f.write(json.dumps(record))
-    for index, file_dict in enumerate(record.get('files', [])):
-        click.secho('    Download file "{}"'.format(file_dict.get('name')))
-        filepath = os.path.join(directory, 'file_{}'.format(index))
-        if not os.path.exists(filepath) or int(os.path.getsize(filepath)) != int(file_dict.get('size')):
-            _save_file(logfile, file_dict['url'], filepath)
-        if int(os.path.getsize(filepath)) != int(file_dict.get('size')):
-            logfile.write("\n********************\n")
-            logfile.write("\nERROR: downloaded file size differs for file {}\n".format(filepath))
-            logfile.write("        {} instead of {}\n".format(
-                os.path.getsize(filepath), file_dict.get('size')))
-            logfile.write("\n********************\n")
+    downloader = V1Downloader(current_app.config.get('V1_URL_BASE'), token,
+                              target_dir, workers=workers, logfile=logfile,
+                              echo=click.secho)
+    errors = downloader.download(limit=limit)
+    if errors:
+        click.secho("{} download errors, see the migration log file. Run "
+                    "the download again to retry".format(len(errors)),
+                    fg='red')
+    return errors
 
 
 def get_or_create_user(email):
@@ -108,7 +73,7 @@ def get_or_create_user(email):
         result = user_info['user']
     return result
 
-def process_v1_record(directory, indexer, base_url, logfile):
+def process_v1_record(directory, indexer, base_url, logfile, link_mode=COPY):
     """
     Parse a downloaded file containing records
     """
@@ -130,7 +95,8 @@ def process_v1_record(directory, indexer, base_url, logfile):
             current_app.login_manager.reload_user(user)
             try:
                 deposit = Deposit.create(record)
-                _create_bucket(deposit, record_json, directory, logfile)
+                _create_bucket(deposit, record_json, directory, logfile,
+                               link_mode=link_mode)
                 deposit.publish()
                 _, record = deposit.fetch_published()
                 # index the record
@@ -144,7 +110,7 @@ def process_v1_record(directory, indexer, base_url, logfile):
     click.secho("Finished processing {}".format(record['titles'][0]['title']))
 
 
-def _create_bucket(deposit, record_json, directory, logfile):
+def _create_bucket(deposit, record_json, directory, logfile, link_mode=COPY):
     for index, file_dict in enumerate(record_json.get('files', [])):
         click.secho('    Load file "{}"'.format(file_dict.get('name')))
         filepath = os.path.join(directory, 'file_{}'.format(index))
@@ -154,9 +120,11 @@ def _create_bucket(deposit, record_json, directory, logfile):
                           .format(filepath, os.path.getsize(filepath), file_dict.get('size')))
             logfile.write("\n********************")
         else:
-            with open(filepath, 'r+b') as f:
-                ObjectVersion.create(deposit.files.bucket, file_dict['name'],
-                                     stream=BytesIO(f.read()))
+            checksum = parse_checksum(file_dict)
+            import_file(deposit.files.bucket, file_dict['name'], filepath,
+                        link_mode=link_mode,
+                        expected_checksum=':'.join(checksum) if checksum
+                        else None)
 
 def _process_record(rec):
     #rec is dict representing 1 record
@@ -276,41 +244,6 @@ def _match_community_specific_metadata(rec, community):
     result['community_specific'][block_schema_id] = cs_md_values_dict
     return result
 
-def _save_file(logfile, old_url, filename):
-    V1_URL_BASE = current_app.config.get('V1_URL_BASE')
-    url1 = old_url.replace('https://b2share.eudat.eu/', V1_URL_BASE)
-    url = url1.replace('/api/record/', '/record/')
-
-    CHUNK_SIZE = 16 * 1024 * 1024 #download 16MB at a time
-    current_app.logger.debug("Downloading %s" % url)
-    gcontext = ssl.SSLContext(ssl.PROTOCOL_TLSv1)
-    finished = False
-    f = open(filename, 'wb')
-    try:
-        u = urlopen(url, context=gcontext)
-    except:
-        current_app.logger.error("TIMEOUT trying to download %s" % url)
-        logfile.write("\n********************")
-        logfile.write("\nERROR: cannot open file URL for download: {}\n".format(url))
-        logfile.write(traceback.format_exc())
-        logfile.write("\n********************")
-        return
-
-    while not finished:
-        try:
-            chunk = u.read(CHUNK_SIZE)
-            if chunk:
-                f.write(chunk)
-            else:
-                finished = True
-        except:
-            logfile.write("\n********************")
-            logfile.write("\nWARN: exception while reading file: {}\n".format(url))
-            logfile.write(traceback.format_exc())
-            logfile.write("\n********************")
-            finished = True
-    f.close()
-
 
 
 def unique(lst):
@@ -335,39 +268,65 @@ def records_endpoint(x):
     return urljoin(x, '/api/records')
 
 
-def main_diff(v1_api_url, v1_access_token, v2_api_url, v2_access_token):
-    v2_index = make_v2_index(v2_api_url, v2_access_token)
-    for record in search_v1(v1_api_url, v1_access_token):
-        test_record(record, v2_index)
+def directly_list_v2_record_ids(batch_size=100):
+    """Iterate over the published records of the database.
 
+    The records are read by batches in ``id`` order. Unlike the pages of the
+    search results, which end at the ``max_result_window`` of the index, the
+    batches cover all the records.
 
-def directly_list_v2_record_ids():
-    size = 100
-    page = 1
+    :returns: iterator of the records, as search hits.
+    """
+    last_id = None
     while True:
-        search = RecordsSearch().params(version=True)
-        search = search[(page - 1) * size:page * size]
-        search_result = search.execute()
-        for record in search_result.hits.hits:
-            if record.get('_index') == 'records-records':
-                yield record
-        if size * page < search_result.hits.total:
-            page += 1
-        else:
-            break
-
-
-def api_list_v2_record_ids(v2_api_url, v2_access_token):
-    for page in range(1, MAX_PAGE):
-        click.secho('    page {}'.format(page))
-        params = {'page': page, 'size': 100}
-        if v2_access_token:
-            params['access_token'] = v2_access_token
-        r = requests.get(records_endpoint(v2_api_url), params=params, verify=False)
+        query = db.session.query(RecordMetadata).join(
+            PersistentIdentifier,
+            PersistentIdentifier.object_uuid == RecordMetadata.id,
+        ).filter(
+            PersistentIdentifier.pid_type == RecordUUIDProvider.pid_type,
+            PersistentIdentifier.object_type == 'rec',
+            PersistentIdentifier.status == PIDStatus.REGISTERED,
+        )
+        if last_id is not None:
+            query = query.filter(RecordMetadata.id > last_id)
+        batch = query.order_by(RecordMetadata.id).limit(batch_size).all()
+        if not batch:
+            return
+        for model in batch:
+            if model.json is not None:
+                yield dict(_id=str(model.id), _source=model.json)
+        last_id = batch[-1].id
+
+
+def api_list_v2_record_ids(v2_api_url, v2_access_token, session=None,
+                           page_size=100):
+    """Iterate over the published records of a v2 site.
+
+    The records are read from the change feed, cursor after cursor. Unlike
+    the pages of the search results, which end at the ``max_result_window``
+    of the index, the feed covers all the records.
+
+    :param session: :class:`requests.Session` sending the requests.
+    :returns: iterator of the records, as search hits.
+    """
+    if session is None:
+        session = requests.Session()
+        session.verify = False
+    url = records_endpoint(v2_api_url) + '/_changes'
+    params = dict(size=page_size)
+    if v2_access_token:
+        params['access_token'] = v2_access_token
+    while True:
+        r = session.get(url, params=params)
         r.raise_for_status()
-        search = json.loads(r.text)
-        for record in search.get('hits', {}).get('hits', []):
-            yield record
+        page = r.json()
+        changes = page.get('changes') or []
+        if not changes:
+            return
+        for change in changes:
+            if not change.get('deleted'):
+                yield change['record']
+        params['cursor'] = page['cursor']
 
 
 def make_v2_index(v2_api_url, v2_access_token):
@@ -393,80 +352,6 @@ def make_v2_index(v2_api_url, v2_access_token):
     return v2_index
 
 
-def search_v1(v1_api_url, v1_access_token):
-    for page in range(0, MAX_PAGE-1):
-        click.secho('Search v1 page {}'.format(page))
-        params = {'page_offset': page, 'page_size': 100, 'access_token': v1_access_token}
-        r = requests.get(records_endpoint(v1_api_url), params=params, verify=False)
-        r.raise_for_status()
-        search = json.loads(r.text).get('records')
-        if len(search) == 0:
-            return # no more records
-        for record in search:
-            yield record
-
-
-def test_record(old_record, v2_index):
-    recid = str(old_record.get('record_id'))
-
-    if not v2_index.get(recid):
-        click.secho('Record {} not migrated to v2'.format(recid), fg='red')
-        return
-
-    new_record = v2_index.get(recid)
-    new_recid = new_record.get('id') or new_record.get('_id')
-    click.secho('Diff record {} {}'.format(recid, new_recid))
-    if not old_record.get('domain'):
-        click.secho('    Record has no domain', fg='red')
-
-    new_md = new_record.get('metadata') or new_record.get('_source')
-    conv_record = _process_record(old_record)
-
-    for key in ['alternate_identifiers', 'community', 'community_specific', 'contact_email',
-                'contributors', 'creators', 'descriptions', 'keywords', 'language', 'license',
-                'open_access', 'publication_date', 'publisher', 'resource_types', 'titles']:
-        old_entry = conv_record.get(key)
-        new_entry = new_md.get(key)
-        if old_entry != new_entry and key != 'alternate_identifiers':
-            try:
-                if set(old_entry) == set(new_entry):
-                    click.secho('   "{}" items have different order'.format(key), fg='red')
-            except:
-                click.secho('   "{}" items differ or have different order'.format(key), fg='red')
-                print ("----")
-                print ("v1: ")
-                pprint(old_entry)
-                print ("v2: ")
-                pprint(new_entry)
-                print ("----")
-    open_access = conv_record.get('open_access')
-
-    for oldfile in old_record.get('files', []):
-        if not oldfile.get('name'):
-            click.secho('    File with no name "{}"'.format(oldfile.get('url')), fg='red')
-        else:
-            newfile = one_or_none([f for f in new_record.get('files', [])
-                                   if f.get('key') == oldfile.get('name')])
-            if not newfile:
-                click.secho('    File missing in new record "{}"'.format(oldfile.get('name')),
-                            fg='red')
-                if not open_access:
-                    click.secho('        [object is private]')
-            elif int(newfile.get('size')) != int(oldfile.get('size')):
-                click.secho('    Different file sizes for "{}": old={} != new={}'
-                            .format(oldfile.get('name'), oldfile.get('size'), newfile.get('size')),
-                            fg='red')
-    for newfile in new_record.get('files', []):
-        oldfile = one_or_none([f for f in old_record.get('files', [])
-                               if f.get('name') == newfile.get('key')])
-        if not oldfile:
-            click.secho('    File missing in new record "{}"'.format(oldfile.get('name')),
-                        fg='red')
-        elif int(newfile.get('size')) != int(oldfile.get('size')):
-            click.secho('    Different file sizes for "{}": old={} != new={}'
-                        .format(oldfile.get('name'), oldfile.get('size'), newfile.get('size')),
-                        fg='red')
-
 def one_or_none(lst):
     assert len(lst) <= 1
     return lst[0] if len(lst) == 1 else None
@@ -27,9 +27,12 @@ the instance hosted by CSC on https://b2share.eudat.eu .
 WARNING - Operating these commands on local instances may severely impact data
 integrity and/or lead to dysfunctional behaviour."""
 
+import json
 import logging
+import multiprocessing
 import os
 import requests
+import tempfile
 import traceback
 from urllib.parse import urlunsplit, urljoin, urlsplit
 
@@ -40,9 +43,12 @@ from invenio_db import db
 from invenio_indexer.api import RecordIndexer
 from invenio_records.api import Record
 
-from .migration import (download_v1_data, process_v1_record, main_diff,
+from .downloader import MANIFEST_FILE, Manifest
+from .diff import diff_sites as run_diff
+from .migration import (download_v1_data, process_v1_record,
                         make_v2_index, records_endpoint, directly_list_v2_record_ids)
 
+from b2share.modules.files.ingest import COPY, LINK_MODES
 from b2share.modules.records.indexer import record_to_index
 
 @click.group()
@@ -56,9 +62,16 @@ def migrate():
 @click.option('-v', '--verbose', count=True)
 @click.option('-d', '--download', is_flag=True, default=False)
 @click.option('-l', '--limit', default=None)
+@click.option('-w', '--workers', default=8, show_default=True,
+              help='Number of concurrent file downloads.')
+@click.option('--link-mode', type=click.Choice(LINK_MODES), default=COPY,
+              show_default=True,
+              help='Reflink or hard link the downloaded files into the '
+              'storage when they are on the same file system.')
 @click.argument('token')
 @click.argument('download_directory')
-def import_v1_data(verbose, download, token, download_directory,limit):
+def import_v1_data(verbose, download, token, download_directory, limit,
+                   workers, link_mode):
     click.secho("Importing data to the current instance")
     logger = logging.getLogger("sqlalchemy.engine")
     logger.setLevel(logging.ERROR)
@@ -66,6 +79,8 @@ def import_v1_data(verbose, download, token, download_directory,limit):
     logfile = open(current_app.config.get('MIGRATION_LOGFILE'), 'a')
     logfile.write("\n\n\n~~~ Starting import task download={} limit={}"
                   .format(download, limit))
+    # the downloader writes to download_directory after the chdir
+    download_directory = os.path.abspath(download_directory)
     if os.path.isdir(download_directory):
         os.chdir(download_directory)
     else:
@@ -79,16 +94,28 @@ def import_v1_data(verbose, download, token, download_directory,limit):
         filelist = os.listdir('.')
         if len(filelist) > 0:
             click.secho("!!! Downloading data into existing directory, "
-                        "overwriting previous data", fg='red')
+                        "resuming previous download", fg='red')
         click.secho("----------")
         click.secho("Downloading data into directory %s" % download_directory)
         if limit is not None:
             limit = int(limit)
             click.secho("Limiting to %d records for debug purposes" % limit)
-        download_v1_data(token, download_directory, logfile, limit)
+        download_v1_data(token, download_directory, logfile, limit,
+                         workers=workers)
     
     indexer = RecordIndexer(record_to_index=record_to_index)
-    dirlist = os.listdir('.')
+    dirlist = [d for d in os.listdir('.') if os.path.isdir(d)]
+    if os.path.exists(MANIFEST_FILE):
+        # skip the records whose download did not complete
+        manifest = Manifest(MANIFEST_FILE)
+        incomplete = [d for d in dirlist if not manifest.is_complete(d)]
+        for d in incomplete:
+            logfile.write("\nSKIPPED: record {} is not completely "
+                          "downloaded, run the download again\n".format(d))
+        if incomplete:
+            click.secho("Skipping %d incompletely downloaded records" %
+                        len(incomplete), fg='red')
+        dirlist = [d for d in dirlist if manifest.is_complete(d)]
 
     click.secho("-----------")
     click.secho("Processing %d downloaded records" % (len(dirlist)))
@@ -100,7 +127,8 @@ def import_v1_data(verbose, download, token, download_directory,limit):
     ))
     for d in dirlist:
         try:
-            process_v1_record(d, indexer, base_url, logfile)
+            process_v1_record(d, indexer, base_url, logfile,
+                              link_mode=link_mode)
         except:
             logfile.write("\n********************")
             logfile.write("\nERROR: exception while processing record /{}/___record.json___\n"
@@ -192,9 +220,29 @@ def is_same_url(url1, url2):
 @click.argument('v1_access_token')
 @click.argument('v2_api_url')
 @click.argument('v2_access_token')
+@click.option('-o', '--output', type=click.File('w'), default='-',
+              help='File receiving one JSON line per difference.')
+@click.option('--index-file', type=click.Path(dir_okay=False),
+              help='SQLite file of the v2 index. A temporary file is used '
+              'by default.')
+@click.option('-w', '--workers', default=multiprocessing.cpu_count(),
+              show_default=True, help='Number of comparison processes.')
+@click.option('--fetch-workers', default=8, show_default=True,
+              help='Number of v1 pages fetched concurrently.')
 @with_appcontext
-def diff_sites(v1_api_url, v1_access_token, v2_api_url, v2_access_token):
-    main_diff(v1_api_url, v1_access_token, v2_api_url, v2_access_token)
+def diff_sites(v1_api_url, v1_access_token, v2_api_url, v2_access_token,
+               output, index_file, workers, fetch_workers):
+    """Compare the records of a v1 site with the migrated v2 records."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        summary = run_diff(
+            v1_api_url, v1_access_token, v2_api_url, v2_access_token,
+            report=output,
+            index_path=index_file or os.path.join(tmp_dir, 'v2-index.sqlite'),
+            workers=workers, fetch_workers=fetch_workers)
+    differences = sum(count for kind, count in summary.items()
+                      if kind not in ('v1_compared', 'v2_indexed'))
+    click.secho(json.dumps(summary, sort_keys=True), err=True,
+                fg='red' if differences else 'green')
 
 
 @migrate.command()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2020 EUDAT.
+#
+# B2SHARE is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""B2SHARE main command line interface."""
+
+from __future__ import absolute_import, print_function
+
+import click
+
+from .profiling import ENTRY_POINT_GROUPS, profile_entry_points, \
+    profile_factory, profile_imports
+
+
+@click.command('profile-startup')
+@click.option('-m', '--module', 'modules', multiple=True,
+              default=['b2share.factory'], show_default=True,
+              help='Module whose imports are profiled. Can be repeated.')
+@click.option('-g', '--group', 'groups', multiple=True,
+              default=ENTRY_POINT_GROUPS, show_default=True,
+              help='Entry point group to profile. Can be repeated.')
+@click.option('-f', '--factory', 'factories', multiple=True,
+              default=['create_api', 'create_app'], show_default=True,
+              help='Application factory to time. Can be repeated.')
+@click.option('-n', '--top', default=25, show_default=True,
+              help='Number of most expensive modules to display.')
+def profile_startup(modules, groups, factories, top):
+    """Report the import and initialization cost of the applications."""
+    for factory in factories:
+        import_seconds, create_seconds = profile_factory(factory)
+        click.secho('{}: import {:.3f}s, creation {:.3f}s'.format(
+            factory, import_seconds, create_seconds), fg='green')
+
+    click.secho('\nEntry points (incremental load time)', bold=True)
+    entry_points = profile_entry_points(groups)
+    for ep in sorted(entry_points, key=lambda ep: -ep.seconds):
+        click.echo('{:>9.3f}s  {} {} = {}{}'.format(
+            ep.seconds, ep.group, ep.name, ep.target,
+            '  [{}]'.format(ep.error) if ep.error else ''))
+
+    for module in modules:
+        click.secho('\nImports of {} (self / cumulative)'.format(module),
+                    bold=True)
+        times = profile_imports(module)
+        for t in sorted(times, key=lambda t: -t.self_us)[:top]:
+            click.echo('{:>9.3f}s {:>9.3f}s  {}'.format(
+                t.self_us / 1e6, t.cumulative_us / 1e6, t.module))
+        if times:
+            click.echo('{:>9.3f}s total'.format(
+                max(t.cumulative_us for t in times) / 1e6))
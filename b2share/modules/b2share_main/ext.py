@@ -10,6 +10,7 @@
 from flask_babelex import gettext as _
 
 from . import config
+from .cli import profile_startup
 
 
 class B2SHARE_MAIN(object):
@@ -28,6 +29,7 @@ class B2SHARE_MAIN(object):
         """Flask application initialization."""
         self.init_config(app)
         app.extensions['b2share_main'] = self
+        app.cli.add_command(profile_startup)
 
     def init_config(self, app):
         """Initialize configuration."""
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2020 EUDAT.
+#
+# B2SHARE is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Startup profiling of the B2SHARE applications.
+
+Every measure runs in a fresh Python interpreter, as modules imported by the
+current process would otherwise be free to import again.
+"""
+
+from __future__ import absolute_import, print_function
+
+import json
+import subprocess
+import sys
+from collections import namedtuple
+
+ENTRY_POINT_GROUPS = (
+    'invenio_base.api_apps',
+    'invenio_base.api_blueprints',
+    'invenio_base.apps',
+    'invenio_base.blueprints',
+)
+"""Entry point groups loaded by the application factories."""
+
+ImportTime = namedtuple('ImportTime', ['module', 'self_us', 'cumulative_us'])
+"""Import cost of one module, in microseconds."""
+
+EntryPointTime = namedtuple('EntryPointTime', [
+    'group', 'name', 'target', 'seconds', 'error'
+])
+"""Load cost of one entry point, in seconds."""
+
+
+# Same output format as ``python -X importtime``, which is not available on
+# Python 3.6.
+_IMPORT_SCRIPT = '''
+import builtins, importlib.util, sys, time
+_import = builtins.__import__
+_stack = [0.0]
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    fullname = name
+    if level:
+        package = (globals or {}).get('__package__') or ''
+        try:
+            fullname = importlib.util.resolve_name('.' * level + name,
+                                                   package)
+        except (ImportError, ValueError):
+            pass
+    if fullname in sys.modules:
+        return _import(name, globals, locals, fromlist, level)
+    _stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        return _import(name, globals, locals, fromlist, level)
+    finally:
+        cumulative = time.perf_counter() - start
+        children = _stack.pop()
+        _stack[-1] += cumulative
+        sys.stderr.write('import time: {0:>10} | {1:>10} | {2}\\n'.format(
+            int((cumulative - children) * 1e6), int(cumulative * 1e6),
+            fullname))
+builtins.__import__ = _timed_import
+import %s
+'''
+
+
+_ENTRY_POINT_SCRIPT = '''
+import json, sys, time, pkg_resources
+results = []
+for group in sys.argv[1:]:
+    for ep in pkg_resources.iter_entry_points(group):
+        start = time.perf_counter()
+        error = None
+        try:
+            ep.load()
+        except Exception as e:
+            error = repr(e)
+        results.append([group, ep.name, str(ep).split('=', 1)[-1].strip(),
+                        time.perf_counter() - start, error])
+print(json.dumps(results))
+'''
+
+
+_FACTORY_SCRIPT = '''
+import json, time
+start = time.perf_counter()
+from b2share import factory
+imported = time.perf_counter()
+factory.%s()
+print(json.dumps([imported - start, time.perf_counter() - imported]))
+'''
+
+
+def parse_import_times(output):
+    """Parse the output of ``python -X importtime``.
+
+    Args:
+        output (str): the standard error of the profiled interpreter.
+
+    Returns:
+        list: :class:`ImportTime` in import completion order.
+    """
+    results = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3:
+            continue
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            # header line
+            continue
+        results.append(ImportTime(fields[2].strip(), self_us, cumulative_us))
+    return results
+
+
+def profile_imports(module, python=None):
+    """Measure the import cost of a module and of all its dependencies.
+
+    Args:
+        module (str): name of the module to import.
+        python (str): Python interpreter used for the measure.
+
+    Returns:
+        list: :class:`ImportTime` in import completion order.
+    """
+    process = subprocess.run(
+        [python or sys.executable, '-c', _IMPORT_SCRIPT % module],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    if process.returncode != 0:
+        raise RuntimeError('Importing {} failed:\n{}'.format(
+            module, process.stderr[-2000:]))
+    return parse_import_times(process.stderr)
+
+
+def profile_entry_points(groups=ENTRY_POINT_GROUPS, python=None):
+    """Measure the load cost of every entry point of the given groups.
+
+    Entry points are loaded in order in the same interpreter, thus the cost
+    of a module shared by several entry points is accounted to the first one.
+
+    Returns:
+        list: :class:`EntryPointTime` in load order.
+    """
+    output = subprocess.check_output(
+        [python or sys.executable, '-c', _ENTRY_POINT_SCRIPT] + list(groups),
+        universal_newlines=True)
+    return [EntryPointTime(*row) for row in json.loads(output)]
+
+
+def profile_factory(factory='create_api', python=None):
+    """Measure the creation time of an application.
+
+    Returns:
+        tuple: seconds spent importing :mod:`b2share.factory` and seconds
+            spent in the factory itself.
+    """
+    output = subprocess.check_output(
+        [python or sys.executable, '-c', _FACTORY_SCRIPT % factory],
+        universal_newlines=True)
+    return tuple(json.loads(output.splitlines()[-1]))
@@ -80,7 +80,9 @@ def generate_external_pids(record):
                               'ePIC_PID': f.obj.file.uri})
     return external_pids
 
-from .. records.api import B2ShareRecord
+from .. records.api import B2ShareRecord, get_validation_cache, \
+    validate_with_cache
+from .. records.indexing import DeferrableRecordIndexer
 
 class Deposit(InvenioDeposit):
     """B2Share Deposit API."""
@@ -94,6 +96,9 @@ class Deposit(InvenioDeposit):
     deposit_fetcher = staticmethod(b2share_deposit_uuid_fetcher)
     """Deposit fetcher."""
 
+    indexer = DeferrableRecordIndexer()
+    """Deposit indexer, see :func:`~.records.indexing.deferred_indexing`."""
+
     def __init__(self, *args, **kwargs):
         super(Deposit, self).__init__(*args, **kwargs)
 
@@ -284,21 +289,30 @@ class Deposit(InvenioDeposit):
             except (ValueError, KeyError) as e:
                 raise InvalidDepositError('Community ID is not a valid UUID.') \
                     from e
-            default_validator = validator_for(
-                CommunitySchema.get_community_schema(community_id).build_json_schema())
-            if 'required' not in default_validator.VALIDATORS:
-                raise NotImplementedError('B2Share does not support schemas '
-                                          'which have no "required" keyword.')
-            DraftDepositValidator = type(
-                'DraftDepositValidator',
-                (default_validator,),
-                dict(VALIDATORS=copy.deepcopy(default_validator.VALIDATORS))
-            )
-            # function ignoring the validation of the given keyword
-            ignore = lambda *args, **kwargs: None
-            DraftDepositValidator.VALIDATORS['required'] = ignore
-            DraftDepositValidator.VALIDATORS['minItems'] = ignore
+            cache = get_validation_cache()
+            cache_key = ('draft_validator', community_id)
+            if cache is not None and cache_key in cache:
+                DraftDepositValidator = cache[cache_key]
+            else:
+                default_validator = validator_for(
+                    CommunitySchema.get_community_schema(community_id).build_json_schema())
+                if 'required' not in default_validator.VALIDATORS:
+                    raise NotImplementedError('B2Share does not support schemas '
+                                              'which have no "required" keyword.')
+                DraftDepositValidator = type(
+                    'DraftDepositValidator',
+                    (default_validator,),
+                    dict(VALIDATORS=copy.deepcopy(default_validator.VALIDATORS))
+                )
+                # function ignoring the validation of the given keyword
+                ignore = lambda *args, **kwargs: None
+                DraftDepositValidator.VALIDATORS['required'] = ignore
+                DraftDepositValidator.VALIDATORS['minItems'] = ignore
+                if cache is not None:
+                    cache[cache_key] = DraftDepositValidator
             kwargs['validator'] = DraftDepositValidator
+        if validate_with_cache(self, **kwargs):
+            return
         return super(Deposit, self).validate(**kwargs)
 
     def commit(self):
@@ -311,35 +325,10 @@ class Deposit(InvenioDeposit):
         from b2share.modules.records.providers import RecordUUIDProvider
 
         if 'external_pids' in self:
-            deposit_id = self['_deposit']['id']
-            recid = PersistentIdentifier.query.filter_by(
-                pid_value=deposit_id).first()
-            assert recid.status == 'R'
-            record_bucket = RecordsBuckets.query.filter_by(
-                record_id=recid.pid_value).first()
-            bucket = Bucket.query.filter_by(id=record_bucket.bucket_id).first()
-            object_versions = ObjectVersion.query.filter_by(
-                bucket_id=bucket.id).all()
-            key_to_pid = {
-                ext_pid.get('key'): ext_pid.get('ePIC_PID')
-                for ext_pid in self['external_pids']
-            }
-            # for the existing files
-            for object_version in object_versions:
-                if object_version.file is None or \
-                        object_version.file.storage_class != 'B':
-                    continue
-                # check that they are still in the file pids list or remove
-                if object_version.key not in key_to_pid:
-                    ObjectVersion.delete(bucket,
-                                         object_version.key)
-                # check that the uri is still the same or update it
-                elif object_version.file.uri != \
-                        key_to_pid[object_version.key]:
-                    db.session.query(FileInstance).\
-                        filter(FileInstance.id == object_version.file_id).\
-                        update({"uri": key_to_pid[object_version.key]})
-            create_b2safe_file(self['external_pids'], bucket)
+            bucket = Bucket.query.join(
+                RecordsBuckets, RecordsBuckets.bucket_id == Bucket.id,
+            ).filter(RecordsBuckets.record_id == self.id).one()
+            create_b2safe_file(self['external_pids'], bucket, replace=True)
             del self['external_pids']
 
         if self.model is None or self.model.json is None:
@@ -462,6 +451,11 @@ def create_file_pids(record_metadata):
         'CFG_FAIL_ON_MISSING_FILE_PID', False)
     external_pids = record_metadata['_deposit'].get('external_pids', [])
     external_keys = { x.get('key') for x in external_pids }
+    from b2share.modules.files.storage import extra_checksums
+    # computed during the upload, the files are not read again
+    files_checksums = extra_checksums([
+        f['version_id'] for f in record_metadata.get('_files')
+        if f.get('version_id') and not f.get('ePIC_PID')])
     for f in record_metadata.get('_files'):
         if f.get('ePIC_PID') or f.get('key') in external_keys:
             continue
@@ -473,7 +467,8 @@ def create_file_pids(record_metadata):
             from b2share.modules.handle.errors import EpicPIDError
 
             file_pid = current_handle.create_handle(
-                file_url, checksum=f.get('checksum'), fixed=True
+                file_url, checksum=f.get('checksum'), fixed=True,
+                extra_checksums=files_checksums.get(f.get('version_id'))
             )
             if file_pid is None:
                 raise EpicPIDError("EPIC PID allocation for file failed")
@@ -485,8 +480,16 @@ def create_file_pids(record_metadata):
                 current_app.logger.warning(e)
 
 
-def create_b2safe_file(external_pids, bucket):
-    """Create a FileInstance which contains a PID in its uri."""
+def create_b2safe_file(external_pids, bucket, replace=False):
+    """Create FileInstances which contain a PID in their uri.
+
+    The current B2SAFE files of the bucket are compared with the external
+    PIDs in one query, then the changes are applied with bulk statements.
+
+    :param replace: also remove the B2SAFE files which are not in
+        ``external_pids`` and change the uri of the files whose PID changed,
+        instead of only adding the new ones.
+    """
     validate_schema(external_pids, {
         'type': 'array',
         'items': {
@@ -513,23 +516,91 @@ def create_b2safe_file(external_pids, bucket):
             raise InvalidDepositError(
                 [FieldError('external_pids',
                             'File key cannot start with a "/".')])
-        try:
-            # Create the file instance if it does not already exist
-            file_instance = FileInstance.get_by_uri(external_pid['ePIC_PID'])
-            if file_instance is None:
-                file_instance = FileInstance.create()
-                file_instance.set_uri(
-                    external_pid['ePIC_PID'], 1, 0, storage_class='B')
-            assert file_instance.storage_class == 'B'
-            # Add the file to the bucket if it is not already in it
-            current_version = ObjectVersion.get(bucket, external_pid['key'])
-            if not current_version or \
-                    current_version.file_id != file_instance.id:
-                ObjectVersion.create(bucket, external_pid['key'],
-                                     file_instance.id)
-        except IntegrityError as e:
-            raise InvalidDepositError(
-                [FieldError('external_pids', 'File URI already exists.')])
+    key_to_pid = {e['key']: e['ePIC_PID'] for e in external_pids}
+
+    # current files of the bucket, by key
+    current = {
+        row.key: row for row in db.session.query(
+            ObjectVersion.key, ObjectVersion.version_id,
+            ObjectVersion.file_id, FileInstance.uri,
+            FileInstance.storage_class,
+        ).outerjoin(
+            FileInstance, ObjectVersion.file_id == FileInstance.id,
+        ).filter(
+            ObjectVersion.bucket_id == bucket.id,
+            ObjectVersion.is_head.is_(True),
+        )
+    }
+    b2safe = {key: row for key, row in current.items()
+              if row.storage_class == 'B'}
+
+    try:
+        with db.session.begin_nested():
+            removed = []
+            if replace:
+                removed = [key for key in b2safe if key not in key_to_pid]
+                # change the uri of the files whose PID changed, unless the
+                # new PID already has a file
+                changed = [(row.file_id, key_to_pid[key])
+                           for key, row in b2safe.items()
+                           if key in key_to_pid and
+                           row.uri != key_to_pid[key]]
+                taken = set(uri for uri, in db.session.query(
+                    FileInstance.uri).filter(
+                        FileInstance.uri.in_([uri for _, uri in changed])
+                    )) if changed else set()
+                updates = []
+                for file_id, uri in changed:
+                    if uri not in taken:
+                        taken.add(uri)
+                        updates.append(dict(id=file_id, uri=uri))
+                db.session.bulk_update_mappings(FileInstance, updates)
+
+            # file instances of the PIDs, created if they do not exist
+            files = {}
+            uris = set(key_to_pid.values())
+            existing = db.session.query(
+                FileInstance.id, FileInstance.uri, FileInstance.storage_class,
+            ).filter(FileInstance.uri.in_(list(uris))) if uris else []
+            for file_id, uri, storage_class in existing:
+                if storage_class != 'B':
+                    raise InvalidDepositError(
+                        [FieldError('external_pids',
+                                    'File URI already exists.')])
+                files[uri] = file_id
+            new_files = [dict(id=uuid.uuid4(), uri=uri, size=1,
+                              checksum='0', readable=True, writable=False,
+                              storage_class='B')
+                         for uri in sorted(uris - set(files))]
+            db.session.bulk_insert_mappings(FileInstance, new_files)
+            files.update((f['uri'], f['id']) for f in new_files)
+
+            # new versions of the keys whose file changed
+            added = [key for key, uri in key_to_pid.items()
+                     if key not in current or
+                     current[key].file_id != files[uri]]
+            replaced = [current[key].version_id
+                        for key in added + removed if key in current]
+            if replaced:
+                ObjectVersion.query.filter(
+                    ObjectVersion.version_id.in_(replaced),
+                ).update({ObjectVersion.is_head: False},
+                         synchronize_session=False)
+            db.session.bulk_insert_mappings(ObjectVersion, [
+                dict(version_id=uuid.uuid4(), bucket_id=bucket.id, key=key,
+                     file_id=files[key_to_pid[key]] if key in key_to_pid
+                     else None, is_head=True)
+                for key in added + removed
+            ])
+            # the size of a B2SAFE file is 1
+            bucket.size += len(added)
+    except IntegrityError as e:
+        raise InvalidDepositError(
+            [FieldError('external_pids', 'File URI already exists.')])
+    # the files and objects loaded before the bulk statements are outdated
+    for instance in list(db.session.identity_map.values()):
+        if isinstance(instance, (FileInstance, ObjectVersion)):
+            db.session.expire(instance)
 
 
 def find_version_master_and_previous_record(version_of):
@@ -96,6 +96,8 @@ def records_rest_url_rules(endpoint, list_route=None, item_route=None,
         arguments to ``Blueprint.add_url_rule``.
     """
     from b2share.modules.deposit.api import Deposit
+    from b2share.modules.records.views import RecordFilesArchiveResource, \
+        RecordFilesListResource
 
     read_permission_factory = obj_or_import_string(
         read_permission_factory_imp
@@ -140,8 +142,18 @@ def records_rest_url_rules(endpoint, list_route=None, item_route=None,
         links_factory=links_factory,
         default_media_type=default_media_type)
 
+    files_archive_view = RecordFilesArchiveResource.as_view(
+        RecordFilesArchiveResource.view_name.format(endpoint),
+        resolver=resolver)
+
+    files_list_view = RecordFilesListResource.as_view(
+        RecordFilesListResource.view_name.format(endpoint),
+        resolver=resolver)
+
     return [
         dict(rule=item_route, view_func=item_view),
+        dict(rule=item_route + '/files.zip', view_func=files_archive_view),
+        dict(rule=item_route + '/files_list', view_func=files_list_view),
     ]
 
 
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2017 CERN.
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+
+"""Streaming ZIP archives of the files of a bucket.
+
+The archive is assembled on the fly from the bucket's objects. The files are
+stored without compression and every entry uses the ZIP64 format, thus the
+position of every byte of the archive is known beforehand. This makes it
+possible to send the ``Content-Length`` of the archive and to resume a
+download with a ``Range`` request, without temporary files and in constant
+memory.
+
+The only values which are not known before reading the files are their CRC-32
+checksums, which are written after the data of each file and in the central
+directory. They are computed while the files are streamed and cached, so that
+a resumed download does not need to read the files preceding the requested
+range again.
+
+Files stored in B2SAFE (storage class ``B``) are not included, they are listed
+with their location in ``B2SAFE_FILES.json``.
+"""
+
+from __future__ import absolute_import, print_function
+
+import hashlib
+import json
+import struct
+import zlib
+
+from flask import abort, current_app, request, stream_with_context
+from flask_login import current_user
+from invenio_files_rest.models import ObjectVersion
+from invenio_files_rest.proxies import current_permission_factory
+from werkzeug.http import quote_etag
+
+ARCHIVE_CHUNK_SIZE = 1024 * 1024
+
+B2SAFE_MANIFEST = 'B2SAFE_FILES.json'
+"""Name of the archive entry listing the files stored in B2SAFE."""
+
+CRC_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+"""Lifetime in seconds of the cached CRC-32 of the files."""
+
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_ZIP64_LOCAL_EXTRA = struct.Struct('<HHQQ')
+_DATA_DESCRIPTOR = struct.Struct('<IIQQ')
+_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_ZIP64_CENTRAL_EXTRA = struct.Struct('<HHQQQ')
+_ZIP64_END = struct.Struct('<IQHHIIQQQQ')
+_ZIP64_LOCATOR = struct.Struct('<IIQI')
+_END = struct.Struct('<IHHHHIIH')
+
+_ZIP64_VERSION = 45
+# data descriptor and UTF-8 names
+_FLAGS = 0x0008 | 0x0800
+_MAX_32 = 0xFFFFFFFF
+
+
+def _dos_date_time(date_time):
+    if date_time is None or date_time.year < 1980:
+        return 0, (1 << 5) | 1
+    return (
+        (date_time.hour << 11) | (date_time.minute << 5) |
+        (date_time.second // 2),
+        ((date_time.year - 1980) << 9) | (date_time.month << 5) |
+        date_time.day,
+    )
+
+
+class ArchiveEntry(object):
+    """A file of an archive."""
+
+    def __init__(self, name, size, date_time=None, open=None, data=None,
+                 crc_key=None):
+        """Initialize the entry.
+
+        :param name: path of the file in the archive.
+        :param size: size of the file.
+        :param date_time: modification :class:`datetime.datetime`.
+        :param open: function returning a binary, seekable file object.
+        :param data: content of the file, if it is not read with ``open``.
+        :param crc_key: key under which the CRC-32 of the file is cached.
+        """
+        self.name = name.encode('utf-8')
+        self.size = size
+        self.dos_time, self.dos_date = _dos_date_time(date_time)
+        self.open = open
+        self.data = data
+        self.crc_key = crc_key
+        self.crc = zlib.crc32(data) if data is not None else None
+        self.offset = None
+
+    def local_header(self):
+        return _LOCAL_HEADER.pack(
+            0x04034b50, _ZIP64_VERSION, _FLAGS, 0, self.dos_time,
+            self.dos_date, 0, _MAX_32, _MAX_32, len(self.name),
+            _ZIP64_LOCAL_EXTRA.size,
+        ) + self.name + _ZIP64_LOCAL_EXTRA.pack(
+            0x0001, 16, self.size, self.size)
+
+    def data_descriptor(self):
+        return _DATA_DESCRIPTOR.pack(0x08074b50, self.crc, self.size,
+                                     self.size)
+
+    def central_header(self):
+        return _CENTRAL_HEADER.pack(
+            0x02014b50, _ZIP64_VERSION, _ZIP64_VERSION, _FLAGS, 0,
+            self.dos_time, self.dos_date, self.crc, _MAX_32, _MAX_32,
+            len(self.name), _ZIP64_CENTRAL_EXTRA.size, 0, 0, 0, 0, _MAX_32,
+        ) + self.name + _ZIP64_CENTRAL_EXTRA.pack(
+            0x0001, 24, self.size, self.size, self.offset)
+
+
+class ZipStream(object):
+    """ZIP64 archive, in store mode, generated on the fly.
+
+    :param entries: list of :class:`ArchiveEntry`.
+    :param crc_cache: cache with Flask-Caching's ``get`` and ``set`` methods
+        storing the CRC-32 of the entries having a ``crc_key``.
+    """
+
+    def __init__(self, entries, crc_cache=None, chunk_size=ARCHIVE_CHUNK_SIZE):
+        """Compute the layout of the archive."""
+        self.entries = entries
+        self.crc_cache = crc_cache
+        self.chunk_size = chunk_size
+        # (offset, length, function returning the bytes, entry)
+        self._segments = []
+        offset = 0
+        for entry in entries:
+            entry.offset = offset
+            header = entry.local_header()
+            self._segments.append((offset, len(header),
+                                   lambda header=header: header, None))
+            offset += len(header)
+            self._segments.append((offset, entry.size, None, entry))
+            offset += entry.size
+            self._segments.append((offset, _DATA_DESCRIPTOR.size,
+                                   self._descriptor_getter(entry), None))
+            offset += _DATA_DESCRIPTOR.size
+        self._central_offset = offset
+        self._central_size = sum(
+            _CENTRAL_HEADER.size + len(entry.name) + _ZIP64_CENTRAL_EXTRA.size
+            for entry in entries)
+        self._segments.append((offset, self._central_size,
+                               self._central_directory, None))
+        offset += self._central_size
+        end = self._end_records()
+        self._segments.append((offset, len(end), lambda: end, None))
+        self.size = offset + len(end)
+
+    def _descriptor_getter(self, entry):
+        def get():
+            self._ensure_crc(entry)
+            return entry.data_descriptor()
+        return get
+
+    def _central_directory(self):
+        headers = []
+        for entry in self.entries:
+            self._ensure_crc(entry)
+            headers.append(entry.central_header())
+        return b''.join(headers)
+
+    def _end_records(self):
+        count = len(self.entries)
+        zip64_end_offset = self._central_offset + self._central_size
+        return _ZIP64_END.pack(
+            0x06064b50, _ZIP64_END.size - 12, _ZIP64_VERSION, _ZIP64_VERSION,
+            0, 0, count, count, self._central_size, self._central_offset,
+        ) + _ZIP64_LOCATOR.pack(
+            0x07064b50, 0, zip64_end_offset, 1,
+        ) + _END.pack(
+            0x06054b50, 0, 0, 0xFFFF, 0xFFFF, _MAX_32, _MAX_32, 0,
+        )
+
+    def _ensure_crc(self, entry):
+        """Get the CRC-32 of an entry from the cache or by reading it."""
+        if entry.crc is not None:
+            return
+        if self.crc_cache is not None and entry.crc_key:
+            entry.crc = self.crc_cache.get(entry.crc_key)
+            if entry.crc is not None:
+                return
+        for _ in self._read_entry(entry, 0, entry.size):
+            pass
+
+    def _read_entry(self, entry, start, end):
+        """Iterate over the bytes ``[start, end)`` of an entry's file."""
+        if entry.data is not None:
+            yield entry.data[start:end]
+            return
+        crc = 0 if start == 0 and entry.crc is None else None
+        position = start
+        with entry.open() as stream:
+            if start:
+                stream.seek(start)
+            while position < end:
+                chunk = stream.read(min(self.chunk_size, end - position))
+                if not chunk:
+                    raise IOError('File {} is truncated'.format(
+                        entry.name.decode('utf-8')))
+                position += len(chunk)
+                if crc is not None:
+                    crc = zlib.crc32(chunk, crc)
+                yield chunk
+            if crc is not None and end < entry.size:
+                # the CRC of the whole file is still needed
+                while True:
+                    chunk = stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    crc = zlib.crc32(chunk, crc)
+        if crc is not None:
+            entry.crc = crc
+            if self.crc_cache is not None and entry.crc_key:
+                self.crc_cache.set(entry.crc_key, crc,
+                                   timeout=CRC_CACHE_TIMEOUT)
+
+    def iter_bytes(self, start=0, end=None):
+        """Iterate over the bytes ``[start, end)`` of the archive."""
+        if end is None:
+            end = self.size
+        for offset, length, get, entry in self._segments:
+            if offset + length <= start:
+                continue
+            if offset >= end:
+                break
+            seg_start = max(start - offset, 0)
+            seg_end = min(end - offset, length)
+            if entry is not None:
+                for chunk in self._read_entry(entry, seg_start, seg_end):
+                    yield chunk
+            else:
+                yield get()[seg_start:seg_end]
+
+
+def bucket_archive_entries(bucket):
+    """Create the archive entries of the files of a bucket."""
+    entries = []
+    b2safe_files = []
+    for obj in ObjectVersion.get_by_bucket(bucket).order_by(
+            ObjectVersion.key):
+        if obj.file is None:
+            continue
+        if obj.file.storage_class == 'B':
+            b2safe_files.append(dict(key=obj.key, url=obj.file.uri))
+            continue
+        entries.append(ArchiveEntry(
+            obj.key, obj.file.size, date_time=obj.updated,
+            open=obj.file.storage().open,
+            crc_key='b2share_files_crc32:{}'.format(obj.file_id),
+        ))
+    if b2safe_files:
+        manifest = json.dumps(b2safe_files, indent=2).encode('utf-8')
+        entries.append(ArchiveEntry(B2SAFE_MANIFEST, len(manifest),
+                                    data=manifest))
+    return entries
+
+
+def bucket_archive_etag(bucket):
+    """Compute the entity tag of the archive of a bucket's files."""
+    digest = hashlib.sha1(str(bucket.id).encode('utf-8'))
+    for obj in ObjectVersion.get_by_bucket(bucket).order_by(
+            ObjectVersion.key):
+        digest.update(str(obj.version_id).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def bucket_archive_response(bucket, filename):
+    """Send the files of a bucket as a ZIP archive.
+
+    The ``bucket-read`` permission is required. A single byte range can be
+    requested, see :class:`ZipStream`.
+    """
+    if not current_permission_factory(bucket, 'bucket-read').can():
+        abort(403 if current_user.is_authenticated else 401)
+
+    from invenio_cache import current_cache
+    archive = ZipStream(bucket_archive_entries(bucket), crc_cache=current_cache)
+    etag = bucket_archive_etag(bucket)
+    headers = {
+        'Content-Disposition': 'attachment; filename="{}"'.format(filename),
+        'Accept-Ranges': 'bytes',
+        'ETag': quote_etag(etag),
+    }
+    start, end, status = 0, archive.size, 200
+    if request.range and (request.if_range.etag is None or
+                          request.if_range.etag == etag):
+        byte_range = request.range.range_for_length(archive.size)
+        if byte_range is None:
+            headers['Content-Range'] = 'bytes */{}'.format(archive.size)
+            return current_app.response_class(status=416, headers=headers)
+        start, end = byte_range
+        status = 206
+        headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+            start, end - 1, archive.size)
+    response = current_app.response_class(
+        stream_with_context(archive.iter_bytes(start, end)), status=status,
+        headers=headers, mimetype='application/zip', direct_passthrough=True)
+    response.content_length = end - start
+    return response
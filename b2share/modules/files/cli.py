@@ -33,7 +33,10 @@ from sqlalchemy import exists, or_
 import click
 from flask.cli import with_appcontext
 from invenio_db import db
-from invenio_files_rest.models import Location
+from invenio_files_rest.models import Bucket, Location
+
+from .ingest import COPY, IMPORT_CHUNK_SIZE, LINK_MODES, import_file, \
+    iter_import_sources
 
 
 @click.group()
@@ -96,3 +99,214 @@ def list_location():
     for location in locations:
         click.echo(json.dumps({c.name: str(getattr(location, c.name)) for c in
                     Location.__table__.columns}, sort_keys=True))
+
+
+@files.command('import')
+@with_appcontext
+@click.argument('bucket_id')
+@click.argument('paths', nargs=-1, required=True,
+                type=click.Path(exists=True, readable=True))
+@click.option('-l', '--link-mode', type=click.Choice(LINK_MODES),
+              default=COPY, show_default=True,
+              help='Reflink or hard link the files into the storage when '
+              'they are on the same file system. Hard linked source files '
+              'must not be modified afterwards.')
+@click.option('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE,
+              show_default=True, help='Size of the copied chunks in bytes.')
+def import_files(bucket_id, paths, link_mode, chunk_size):
+    """Import local files into a bucket.
+
+    The files are streamed to the storage. The content of the directories
+    given in PATHS is imported recursively, the object keys being the paths
+    relative to the directory.
+    """
+    bucket = Bucket.get(bucket_id)
+    if bucket is None:
+        raise click.BadParameter('Bucket {} does not exist.'.format(
+            bucket_id))
+    failed = 0
+    for key, path in iter_import_sources(paths):
+        try:
+            obj = import_file(bucket, key, path, link_mode=link_mode,
+                              chunk_size=chunk_size)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            failed += 1
+            click.secho('{}: {}'.format(path, e), fg='red', err=True)
+            continue
+        click.echo(json.dumps(dict(key=key, size=obj.file.size,
+                                   checksum=obj.file.checksum,
+                                   uri=obj.file.uri), sort_keys=True))
+    if failed:
+        raise click.ClickException('{} files could not be imported.'.format(
+            failed))
+
+
+@files.command('checksum-report')
+@with_appcontext
+def checksum_report():
+    """Print the summary of the last checksum verification run.
+
+    The summary contains the number of verified files and bytes and the read
+    throughput of each location.
+    """
+    from .verification import VerificationRuns
+
+    summary = VerificationRuns().last_summary()
+    if summary is None:
+        raise click.ClickException('No checksum verification run finished.')
+    click.echo(json.dumps(summary, indent=4, sort_keys=True))
+
+
+@files.command('dedup')
+@with_appcontext
+@click.option('-l', '--location', 'location_name', default=None,
+              help='Only merge the files of this location.')
+@click.option('--min-size', type=int, default=0, show_default=True,
+              help='Ignore the files smaller than this number of bytes.')
+@click.option('--verify/--no-verify', default=True, show_default=True,
+              help='Compare the data of the files, not only their checksum '
+              'and size.')
+@click.option('-n', '--dry-run', is_flag=True, default=False,
+              help='Only list the duplicates.')
+def dedup(location_name, min_size, verify, dry_run):
+    """Merge the files having the same content.
+
+    The objects of each duplicate file are moved to the oldest file with
+    the same content in the same location and the duplicate is deleted.
+    One JSON line is printed per duplicate.
+    """
+    from .dedup import DUPLICATE, MERGED, deduplicate_files
+
+    location = None
+    if location_name is not None:
+        location = Location.get_by_name(location_name)
+        if location is None:
+            raise click.BadParameter('Location {} does not exist.'.format(
+                location_name))
+    count = 0
+    reclaimed = 0
+    for original, duplicate, status in deduplicate_files(
+            min_size=min_size, location=location, verify=verify,
+            dry_run=dry_run):
+        click.echo(json.dumps(dict(
+            original=str(original.id), duplicate=str(duplicate.id),
+            uri=duplicate.uri, size=duplicate.size, status=status,
+        ), sort_keys=True))
+        if status in (MERGED, DUPLICATE):
+            count += 1
+            reclaimed += duplicate.size
+    click.secho('{} {} files, {} bytes'.format(
+        'Duplicates:' if dry_run else 'Merged', count, reclaimed),
+        fg='green', err=True)
+
+
+@files.command('gc')
+@with_appcontext
+@click.option('-n', '--dry-run', is_flag=True, default=False,
+              help='Only list the garbage.')
+@click.option('--grace-days', type=float, default=None,
+              help='Keep the garbage younger than this number of days. '
+              'Defaults to B2SHARE_FILES_GC_GRACE_PERIOD.')
+@click.option('--delete-rate', type=int, default=None,
+              help='Maximum number of files deleted per second. Defaults '
+              'to B2SHARE_FILES_GC_DELETE_RATE.')
+@click.option('--disk-files', is_flag=True, default=False,
+              help='Also delete the files of the local locations which no '
+              'file instance references.')
+@click.option('-v', '--verbose', is_flag=True, default=False,
+              help='Print one JSON line per collected item.')
+def gc(dry_run, grace_days, delete_rate, disk_files, verbose):
+    """Delete the unused buckets, file instances and files.
+
+    The buckets which are not linked to any record and the file instances
+    which no object references are deleted with their files, as well as the
+    expired multipart uploads. The stored files without file instance are
+    only deleted with --disk-files.
+    """
+    from datetime import timedelta
+
+    from .gc import collect_garbage
+
+    report = {}
+    for kind, id_, size in collect_garbage(
+            dry_run=dry_run, delete_rate=delete_rate, disk_files=disk_files,
+            grace_period=timedelta(days=grace_days)
+            if grace_days is not None else None):
+        if verbose:
+            click.echo(json.dumps(dict(kind=kind, id=id_, size=size),
+                                  sort_keys=True))
+        count, total = report.get(kind, (0, 0))
+        report[kind] = (count + 1, total + size)
+    for kind, (count, total) in sorted(report.items()):
+        click.secho('{}: {} {}, {} bytes'.format(
+            kind, 'found' if dry_run else 'deleted', count, total),
+            fg='green', err=True)
+
+
+@files.command('migrate-location')
+@with_appcontext
+@click.argument('source')
+@click.argument('destination')
+@click.option('--min-age-days', type=float, default=None,
+              help='Only move the files created this number of days ago.')
+@click.option('--idle-days', type=float, default=None,
+              help='Only move the files not downloaded during this number '
+              'of days.')
+@click.option('--limit', type=int, default=None,
+              help='Maximum number of files to move.')
+@click.option('-w', '--workers', type=int, default=1, show_default=True,
+              help='Number of files copied concurrently.')
+@click.option('--bandwidth', type=int, default=None,
+              help='Maximum number of bytes read per second, shared by the '
+              'workers.')
+@click.option('-n', '--dry-run', is_flag=True, default=False,
+              help='Only list the files to move.')
+def migrate_location(source, destination, min_age_days, idle_days, limit,
+                     workers, bandwidth, dry_run):
+    """Move the files of a location to another location.
+
+    The data is copied and verified, then the objects are linked to the
+    copy. The source files are deleted by Celery tasks once the grace period
+    of the garbage collector is over, see `b2share files gc`. An interrupted
+    migration resumes when the command is run again.
+    """
+    from datetime import timedelta
+
+    from . import migration
+
+    locations = {}
+    for name in (source, destination):
+        locations[name] = Location.get_by_name(name)
+        if locations[name] is None:
+            raise click.BadParameter('Location {} does not exist.'.format(
+                name))
+    selected = migration.select_files(
+        locations[source],
+        min_age=timedelta(days=min_age_days)
+        if min_age_days is not None else None,
+        idle=timedelta(days=idle_days) if idle_days is not None else None,
+        limit=limit)
+    if dry_run:
+        count = 0
+        total = 0
+        for file_id, size in selected:
+            click.echo(json.dumps(dict(id=file_id, size=size),
+                                  sort_keys=True))
+            count += 1
+            total += size
+        click.secho('{} files, {} bytes'.format(count, total), fg='green',
+                    err=True)
+        return
+    failed = 0
+    for file_id, status, error in migration.migrate_location(
+            (file_id for file_id, _ in selected), locations[destination],
+            workers=workers, bytes_per_second=bandwidth):
+        click.echo(json.dumps(dict(id=file_id, status=status, error=error),
+                              sort_keys=True))
+        if status == migration.FAILED:
+            failed += 1
+    if failed:
+        raise click.ClickException('{} files could not be moved.'.format(
+            failed))
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2017 CERN.
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Deduplication of the file instances having the same content.
+
+Several object versions, in any bucket, can share a file instance: this is
+how invenio-files-rest snapshots the buckets of the record versions. Two
+file instances with the same checksum and size in the same location are
+merged by pointing the object versions of the newest one to the oldest one,
+then deleting the newest one and its data.
+
+The number of object versions pointing to a file instance is its reference
+count. A file instance is deleted only when nothing references it, which the
+foreign keys of the database enforce as well.
+
+When ``B2SHARE_FILES_DEDUPLICATION`` is enabled, each uploaded file is
+deduplicated by a Celery task after the upload. The existing duplicates are
+merged by ``b2share files dedup``.
+"""
+
+from itertools import groupby
+
+from flask import current_app
+from invenio_db import db
+from invenio_files_rest.models import FileInstance, Location, \
+    MultipartObject, ObjectVersion
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from .verification import file_location
+
+COMPARE_CHUNK_SIZE = 8 * 1024 * 1024
+
+MERGED = 'merged'
+"""The duplicate was merged into the original file instance."""
+
+DUPLICATE = 'duplicate'
+"""The duplicate would be merged."""
+
+DIFFERENT = 'different'
+"""The files have the same checksum and size but not the same data."""
+
+REFERENCED = 'referenced'
+"""The duplicate cannot be deleted."""
+
+
+def file_references(file_id):
+    """Return the number of objects referencing a file instance."""
+    return ObjectVersion.query.filter_by(file_id=file_id).count() + \
+        MultipartObject.query.filter_by(file_id=file_id).count()
+
+
+def _locations():
+    """Return the locations, the most specific first."""
+    return sorted(((location.uri, location.name)
+                   for location in Location.query),
+                  key=lambda location: len(location[0]), reverse=True)
+
+
+def _location_prefix(uri, locations):
+    name = file_location(uri, locations)
+    if name is None:
+        return None
+    return dict((n, u) for u, n in locations)[name].rstrip('/') + '/'
+
+
+def _mergeable():
+    """Return the query of the file instances which can be merged."""
+    return FileInstance.query.filter(
+        FileInstance.readable.is_(True),
+        FileInstance.writable.is_(False),
+        FileInstance.checksum.isnot(None),
+        # B2SAFE files only reference data stored outside of B2SHARE
+        func.coalesce(FileInstance.storage_class, '') != 'B',
+    )
+
+
+def same_content(fileinstance, other, chunk_size=COMPARE_CHUNK_SIZE):
+    """Compare the data of two file instances byte by byte."""
+    with fileinstance.storage().open(mode='rb') as fp, \
+            other.storage().open(mode='rb') as other_fp:
+        while True:
+            data = fp.read(chunk_size)
+            if data != other_fp.read(chunk_size):
+                return False
+            if not data:
+                return True
+
+
+def find_original(fileinstance, locations=None):
+    """Return the oldest file instance with the same content, or None.
+
+    Only the file instances of the same location are considered. A file
+    instance is never merged into a newer one, thus two concurrent
+    deduplications cannot merge two file instances into each other.
+    """
+    prefix = _location_prefix(fileinstance.uri,
+                              locations if locations is not None
+                              else _locations())
+    if prefix is None:
+        return None
+    candidates = _mergeable().filter(
+        FileInstance.checksum == fileinstance.checksum,
+        FileInstance.size == fileinstance.size,
+        func.coalesce(FileInstance.storage_class, '') ==
+        (fileinstance.storage_class or ''),
+        FileInstance.uri.startswith(prefix, autoescape=True),
+        FileInstance.id != fileinstance.id,
+        (FileInstance.created < fileinstance.created) |
+        ((FileInstance.created == fileinstance.created) &
+         (FileInstance.id < fileinstance.id)),
+    ).order_by(FileInstance.created, FileInstance.id)
+    return candidates.first()
+
+
+def merge_file_instance(duplicate, original):
+    """Point the objects of ``duplicate`` to ``original`` and delete it.
+
+    The data of ``duplicate`` has to be deleted, with
+    :func:`delete_file_data`, after the transaction is committed.
+
+    :returns: False if ``duplicate`` is still referenced, for example by a
+        multipart upload, in which case nothing is changed.
+    """
+    if MultipartObject.query.filter_by(file_id=duplicate.id).count():
+        return False
+    try:
+        with db.session.begin_nested():
+            ObjectVersion.query.filter_by(file_id=duplicate.id).update(
+                {ObjectVersion.file_id: original.id},
+                synchronize_session=False)
+            duplicate.delete()
+    except IntegrityError:
+        # referenced by a new object version in the meantime
+        return False
+    return True
+
+
+def delete_file_data(fileinstance):
+    """Delete the data of a deleted file instance, logging any error."""
+    try:
+        fileinstance.storage().delete()
+    except Exception:
+        current_app.logger.exception(
+            'Could not delete the data of the deduplicated file {}'.format(
+                fileinstance.uri))
+
+
+def deduplicate_file(file_id, verify=None):
+    """Merge a file instance into an older one with the same content.
+
+    :param verify: compare the data of the files before merging them.
+        Defaults to ``B2SHARE_FILES_DEDUPLICATION_VERIFY``.
+    :returns: the file instance it was merged into, or None.
+    """
+    if verify is None:
+        verify = current_app.config['B2SHARE_FILES_DEDUPLICATION_VERIFY']
+    fileinstance = _mergeable().filter(FileInstance.id == file_id) \
+        .one_or_none()
+    if fileinstance is None:
+        return None
+    original = find_original(fileinstance)
+    if original is None or \
+            (verify and not same_content(fileinstance, original)):
+        return None
+    if not merge_file_instance(fileinstance, original):
+        return None
+    db.session.commit()
+    delete_file_data(fileinstance)
+    return original
+
+
+def iter_duplicates(min_size=0, location=None):
+    """Iterate over the groups of file instances with the same content.
+
+    :param min_size: ignore the files smaller than this number of bytes.
+    :param location: only consider this
+        :class:`~invenio_files_rest.models.Location`.
+    :returns: lists of file instances of a location, the oldest first.
+    """
+    locations = _locations()
+    query = _mergeable().filter(FileInstance.size >= min_size)
+    if location is not None:
+        query = query.filter(FileInstance.uri.startswith(
+            location.uri.rstrip('/') + '/', autoescape=True))
+    groups = query.with_entities(
+        FileInstance.checksum, FileInstance.size,
+    ).group_by(FileInstance.checksum, FileInstance.size).having(
+        func.count(FileInstance.id) > 1,
+    )
+    # the groups are listed first as every group is committed separately
+    for checksum, size in groups.all():
+        files = query.filter(
+            FileInstance.checksum == checksum, FileInstance.size == size,
+        ).order_by(FileInstance.created, FileInstance.id).all()
+        files.sort(key=lambda f: (_location_prefix(f.uri, locations) or '',
+                                  f.storage_class or ''))
+        for (prefix, _), group in groupby(
+                files, key=lambda f: (_location_prefix(f.uri, locations),
+                                      f.storage_class)):
+            group = list(group)
+            if prefix is not None and len(group) > 1:
+                yield group
+
+
+def deduplicate_files(min_size=0, location=None, verify=True, dry_run=False):
+    """Merge the existing file instances having the same content.
+
+    Every group of duplicates is merged into its oldest file instance and
+    committed separately.
+
+    :returns: iterator of ``(original, duplicate, status)`` tuples, status
+        being one of :data:`MERGED`, :data:`DIFFERENT`, :data:`REFERENCED`
+        or, with ``dry_run``, :data:`DUPLICATE`.
+    """
+    for group in iter_duplicates(min_size=min_size, location=location):
+        original = group[0]
+        deleted = []
+        results = []
+        for duplicate in group[1:]:
+            if verify and not same_content(duplicate, original):
+                status = DIFFERENT
+            elif dry_run:
+                status = DUPLICATE
+            elif merge_file_instance(duplicate, original):
+                status = MERGED
+                deleted.append(duplicate)
+            else:
+                status = REFERENCED
+            results.append((original, duplicate, status))
+        db.session.commit()
+        for fileinstance in deleted:
+            delete_file_data(fileinstance)
+        for result in results:
+            yield result
@@ -25,7 +25,11 @@
 
 from __future__ import absolute_import, print_function
 
+from invenio_files_rest.signals import file_uploaded
+
+from . import models
 from .cli import files as files_cmd
+from .tasks import deduplicate_uploaded_file, store_uploaded_checksums
 
 
 class B2ShareFiles(object):
@@ -41,6 +45,8 @@ class B2ShareFiles(object):
         self.init_config(app)
         app.cli.add_command(files_cmd)
         app.extensions['b2share-files'] = self
+        file_uploaded.connect(store_uploaded_checksums, weak=False)
+        file_uploaded.connect(deduplicate_uploaded_file, weak=False)
 
     def init_config(self, app):
         """Initialize configuration."""
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2017 CERN.
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Garbage collection of the unused buckets, file instances and files.
+
+The garbage is collected in this order, so that each step frees what the
+next one collects:
+
+1. the expired multipart uploads,
+2. the buckets which are not linked to any record or deposit, with their
+   objects,
+3. the file instances which no object or multipart upload references, with
+   their data,
+4. optionally, the files of the local locations which no file instance
+   references.
+
+Only the garbage older than a grace period (``B2SHARE_FILES_GC_GRACE_PERIOD``)
+is collected, thus the uploads and transactions in progress are not affected.
+The database rows are selected with anti-joins, by batches ordered by id, and
+the deletions of files are throttled (``B2SHARE_FILES_GC_DELETE_RATE``).
+"""
+
+import os
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app
+from invenio_db import db
+from invenio_files_rest.models import Bucket, FileInstance, Location, \
+    MultipartObject, ObjectVersion
+from invenio_records_files.models import RecordsBuckets
+from sqlalchemy import exists, or_
+
+from .ingest import local_path
+from .verification import Throttle
+
+MULTIPART = 'multipart'
+BUCKET = 'bucket'
+FILE_INSTANCE = 'file_instance'
+DISK_FILE = 'disk_file'
+
+
+def orphan_buckets_query(before):
+    """Return the query of the buckets not linked to any record."""
+    return Bucket.query.filter(
+        ~exists().where(RecordsBuckets.bucket_id == Bucket.id),
+        ~exists().where(MultipartObject.bucket_id == Bucket.id),
+        Bucket.created < before,
+        Bucket.updated < before,
+    )
+
+
+def orphan_files_query(before):
+    """Return the query of the file instances nothing references."""
+    return FileInstance.query.filter(
+        ~exists().where(ObjectVersion.file_id == FileInstance.id),
+        ~exists().where(MultipartObject.file_id == FileInstance.id),
+        FileInstance.updated < before,
+    )
+
+
+def _batches(query, key, batch_size):
+    """Iterate over the batches of a query, by increasing ``key``.
+
+    Each batch is read once the previous one is processed, the processing
+    can thus delete the rows and commit.
+    """
+    after = None
+    while True:
+        batch_query = query
+        if after is not None:
+            batch_query = batch_query.filter(key > after)
+        batch = batch_query.order_by(key).limit(batch_size).all()
+        if not batch:
+            return
+        after = getattr(batch[-1], key.key)
+        yield batch
+
+
+def _delete_data(fileinstance, throttle):
+    """Delete the data of a deleted file instance, logging any error."""
+    if fileinstance.storage_class == 'B' or not fileinstance.uri:
+        # B2SAFE files are not stored by B2SHARE
+        return
+    throttle.consume()
+    try:
+        fileinstance.storage().delete()
+    except Exception:
+        current_app.logger.exception(
+            'Could not delete the data of the file {}'.format(
+                fileinstance.uri))
+
+
+def collect_multipart_uploads(before, dry_run=False):
+    """Delete the multipart uploads created before ``before``.
+
+    Their file instances are then collected by
+    :func:`collect_file_instances`.
+    """
+    query = MultipartObject.query.filter(MultipartObject.created < before)
+    for multipart in query.all():
+        yield MULTIPART, str(multipart.upload_id), multipart.size
+        if not dry_run:
+            multipart.delete()
+    db.session.commit()
+
+
+def collect_buckets(before, batch_size, dry_run=False):
+    """Delete the buckets which are not linked to any record.
+
+    Their file instances are then collected by
+    :func:`collect_file_instances`.
+    """
+    for batch in _batches(orphan_buckets_query(before), Bucket.id,
+                          batch_size):
+        items = [(bucket.id, bucket.size or 0) for bucket in batch]
+        if not dry_run:
+            with db.session.begin_nested():
+                # the buckets linked in the meantime are kept
+                ids = set(row.id for row in orphan_buckets_query(before)
+                          .filter(Bucket.id.in_([id_ for id_, _ in items]))
+                          .with_entities(Bucket.id).with_for_update())
+                ObjectVersion.query.filter(
+                    ObjectVersion.bucket_id.in_(ids),
+                ).delete(synchronize_session=False)
+                Bucket.query.filter(Bucket.id.in_(ids)) \
+                    .delete(synchronize_session=False)
+            db.session.commit()
+            items = [item for item in items if item[0] in ids]
+        for id_, size in items:
+            yield BUCKET, str(id_), size
+
+
+def collect_file_instances(before, batch_size, throttle, dry_run=False):
+    """Delete the file instances nothing references, and their data."""
+    for batch in _batches(orphan_files_query(before), FileInstance.id,
+                          batch_size):
+        if not dry_run:
+            ids = [fileinstance.id for fileinstance in batch]
+            # the storage of the deleted rows is still needed
+            for fileinstance in batch:
+                db.session.expunge(fileinstance)
+            # the rows referenced in the meantime are kept
+            orphan_files_query(before).filter(FileInstance.id.in_(ids)) \
+                .delete(synchronize_session=False)
+            db.session.commit()
+            kept = set(row.id for row in FileInstance.query.filter(
+                FileInstance.id.in_(ids)).with_entities(FileInstance.id))
+            batch = [f for f in batch if f.id not in kept]
+        for fileinstance in batch:
+            yield FILE_INSTANCE, fileinstance.uri, fileinstance.size or 0
+            if not dry_run:
+                _delete_data(fileinstance, throttle)
+
+
+def collect_file_instance(file_id, grace_period=None):
+    """Delete a file instance and its data if nothing references it.
+
+    The file instance is kept if it was updated during the grace period.
+
+    :param grace_period: :class:`datetime.timedelta`. Defaults to
+        ``B2SHARE_FILES_GC_GRACE_PERIOD``.
+    :returns: True if the file instance was deleted.
+    """
+    if grace_period is None:
+        grace_period = current_app.config['B2SHARE_FILES_GC_GRACE_PERIOD']
+    query = orphan_files_query(datetime.utcnow() - grace_period).filter(
+        FileInstance.id == file_id)
+    fileinstance = query.one_or_none()
+    if fileinstance is None:
+        return False
+    # the storage of the deleted row is still needed
+    db.session.expunge(fileinstance)
+    # the row referenced in the meantime is kept
+    deleted = query.delete(synchronize_session=False)
+    db.session.commit()
+    if deleted:
+        _delete_data(fileinstance, Throttle())
+    return bool(deleted)
+
+
+def _storage_file_id(relative_path):
+    """Return the file instance id of a path written by the storage, or None.
+
+    The storage writes the data of a file instance under its id, split into
+    directories.
+    """
+    config = current_app.config
+    parts = relative_path.split(os.sep)
+    dimensions = config['FILES_REST_STORAGE_PATH_DIMENSIONS']
+    if len(parts) != dimensions + 2 or parts[-1] != 'data':
+        return None
+    if any(len(part) != config['FILES_REST_STORAGE_PATH_SPLIT_LENGTH']
+           for part in parts[:dimensions]):
+        return None
+    try:
+        return uuid.UUID(''.join(parts[:-1]))
+    except ValueError:
+        return None
+
+
+def _normalized_path(uri):
+    """Return the normalized local path of a storage URI, or None."""
+    path = local_path(uri)
+    return os.path.normpath(path) if path else None
+
+
+def _location_uri_prefixes(location):
+    """Return the prefixes of the URIs of the files of a local location."""
+    root = _normalized_path(location.uri)
+    return set([location.uri.rstrip('/') + '/', root + '/',
+                'file://' + root + '/'])
+
+
+def _location_files(location):
+    """Iterate over the ``(id, path)`` of the files of a local location.
+
+    The paths are normalized, the ids are the file instance ids encoded in
+    the paths.
+    """
+    root = _normalized_path(location.uri)
+    if root is None or not os.path.isdir(root):
+        return
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            file_id = _storage_file_id(os.path.relpath(path, root))
+            if file_id is not None:
+                yield file_id, path
+
+
+def _referenced_paths(location, batch):
+    """Return the paths of a batch of disk files having a file instance.
+
+    A file is referenced by the file instance having its id, or by any file
+    instance whose URI has the same normalized path.
+    """
+    root = _normalized_path(location.uri)
+    uris = set()
+    for _, path in batch:
+        relative_uri = os.path.relpath(path, root).replace(os.sep, '/')
+        uris.update(prefix + relative_uri
+                    for prefix in _location_uri_prefixes(location))
+    rows = db.session.query(FileInstance.id, FileInstance.uri).filter(or_(
+        FileInstance.id.in_([file_id for file_id, _ in batch]),
+        FileInstance.uri.in_(uris),
+    ))
+    referenced = set()
+    ids = set()
+    for file_id, uri in rows:
+        ids.add(file_id)
+        path = _normalized_path(uri) if uri else None
+        if path:
+            referenced.add(path)
+    return referenced | set(path for file_id, path in batch if file_id in ids)
+
+
+def _has_stored_files(location):
+    """Check if any file instance is stored in a location."""
+    return db.session.query(exists().where(or_(*[
+        FileInstance.uri.startswith(prefix)
+        for prefix in _location_uri_prefixes(location)
+    ]))).scalar()
+
+
+def collect_disk_files(before, batch_size, throttle, dry_run=False):
+    """Delete the files of the local locations without file instance.
+
+    Only the files having the layout of the storage are considered. The
+    files of a location where no file instance is stored are kept: the URIs
+    of the file instances do not match the URI of the location, it is thus
+    probably misconfigured.
+    """
+    before_timestamp = (before - datetime(1970, 1, 1)).total_seconds()
+    for location in Location.query.order_by(Location.id).all():
+        if local_path(location.uri) is None:
+            continue
+        if not _has_stored_files(location):
+            current_app.logger.error(
+                'No file instance is stored in the location {} ({}), its '
+                'files are not collected'.format(location.name, location.uri))
+            continue
+        files = _location_files(location)
+        while True:
+            batch = [next(files, None) for _ in range(batch_size)]
+            batch = [entry for entry in batch if entry is not None]
+            if not batch:
+                break
+            referenced = _referenced_paths(location, batch)
+            for _, path in batch:
+                if path in referenced:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                # a hard link keeps the modification time of its source
+                if max(stat.st_mtime, stat.st_ctime) >= before_timestamp:
+                    continue
+                yield DISK_FILE, path, stat.st_size
+                if not dry_run:
+                    throttle.consume()
+                    _remove_file(path)
+            db.session.commit()
+
+
+def _remove_file(path):
+    """Remove a file and its directory if it becomes empty."""
+    try:
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+    except OSError:
+        pass
+
+
+def collect_garbage(dry_run=False, grace_period=None, batch_size=None,
+                    delete_rate=None, disk_files=False):
+    """Collect the unused buckets, file instances and files.
+
+    :param dry_run: only list the garbage. The file instances of the
+        listed buckets and multipart uploads are not listed as they are
+        still referenced.
+    :param disk_files: also collect the files of the local locations which
+        no file instance references, see :func:`collect_disk_files`.
+    :param grace_period: :class:`datetime.timedelta`, younger garbage is
+        kept. Defaults to ``B2SHARE_FILES_GC_GRACE_PERIOD``.
+    :param batch_size: number of rows or files handled per query.
+    :param delete_rate: maximum number of files deleted per second.
+    :returns: iterator of the ``(kind, id, size)`` of the collected garbage,
+        kind being :data:`MULTIPART`, :data:`BUCKET`, :data:`FILE_INSTANCE`
+        or :data:`DISK_FILE`.
+    """
+    config = current_app.config
+    if grace_period is None:
+        grace_period = config['B2SHARE_FILES_GC_GRACE_PERIOD']
+    batch_size = batch_size or config['B2SHARE_FILES_GC_BATCH_SIZE']
+    delete_rate = delete_rate or config['B2SHARE_FILES_GC_DELETE_RATE']
+    now = datetime.utcnow()
+    before = now - grace_period
+    throttle = Throttle(iops=delete_rate)
+
+    for item in collect_multipart_uploads(
+            now - max(grace_period, config['FILES_REST_MULTIPART_EXPIRES']),
+            dry_run=dry_run):
+        yield item
+    for item in collect_buckets(before, batch_size, dry_run=dry_run):
+        yield item
+    for item in collect_file_instances(before, batch_size, throttle,
+                                       dry_run=dry_run):
+        yield item
+    if not disk_files:
+        return
+    for item in collect_disk_files(before, batch_size, throttle,
+                                   dry_run=dry_run):
+        yield item
+
+
+def garbage_report(items):
+    """Count the items and bytes of each kind of garbage."""
+    report = Counter()
+    for kind, _, size in items:
+        report[kind] += 1
+        report[kind + '_bytes'] += size or 0
+    return dict(report)
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2017 CERN.
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Import of local files into buckets.
+
+Files are streamed from disk to the storage in chunks, the checksum being
+computed while the data is written, thus memory usage does not depend on the
+file size.
+
+When the source file and the bucket's location are on the same file system,
+the file can instead be reflinked (copy on write clone) or hard linked into
+the storage. Only the checksum then needs to read the file. A hard linked file
+shares its data with the source file: the source must not be modified
+afterwards.
+"""
+
+from __future__ import absolute_import, print_function
+
+import errno
+import fcntl
+import os
+from urllib.parse import urlsplit
+
+from invenio_files_rest.models import FileInstance, ObjectVersion
+from invenio_files_rest.storage.base import check_sizelimit
+
+COPY = 'copy'
+"""Always copy the data."""
+
+REFLINK = 'reflink'
+"""Clone the file if the file system supports it, copy otherwise."""
+
+HARDLINK = 'hardlink'
+"""Hard link the file if possible, copy otherwise."""
+
+LINK_MODES = (COPY, REFLINK, HARDLINK)
+
+IMPORT_CHUNK_SIZE = 16 * 1024 * 1024
+
+_FICLONE = 0x40049409
+"""Linux ioctl cloning a file (``FICLONE``)."""
+
+
+class ImportChecksumError(Exception):
+    """The imported file does not have the expected checksum."""
+
+
+def local_path(uri):
+    """Return the local path of a storage URI, or None if it is remote."""
+    parts = urlsplit(uri)
+    if parts.scheme in ('', 'file'):
+        return parts.path
+    return None
+
+
+def _reflink(src, dst):
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+
+
+def link_file(src, dst, mode):
+    """Reflink or hard link ``src`` to ``dst``.
+
+    Returns:
+        bool: False if the file system does not allow it, in which case
+        ``dst`` is not created.
+    """
+    if mode not in (REFLINK, HARDLINK):
+        return False
+    dst_dir = os.path.dirname(dst)
+    if os.stat(src).st_dev != os.stat(_existing_parent(dst_dir)).st_dev:
+        return False
+    os.makedirs(dst_dir, exist_ok=True)
+    try:
+        if mode == HARDLINK:
+            os.link(src, dst)
+        else:
+            _reflink(src, dst)
+    except OSError as e:
+        if e.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK,
+                       errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL):
+            _remove_empty_dir(dst_dir)
+            return False
+        raise
+    return True
+
+
+def _remove_empty_dir(path):
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass
+
+
+def _existing_parent(path):
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def _verify_checksum(fileinstance, expected_checksum):
+    if not expected_checksum or not fileinstance.checksum:
+        return
+    algo, value = fileinstance.checksum.split(':', 1)
+    expected_algo, _, expected_value = expected_checksum.rpartition(':')
+    if (expected_algo or algo) != algo:
+        # cannot be compared without reading the file again
+        return
+    if value != expected_value.lower():
+        raise ImportChecksumError(
+            'Checksum {} instead of {}'.format(fileinstance.checksum,
+                                               expected_checksum))
+
+
+def import_file(bucket, key, path, link_mode=COPY, expected_checksum=None,
+                chunk_size=IMPORT_CHUNK_SIZE, mimetype=None):
+    """Create an object in a bucket with the content of a local file.
+
+    :param bucket: the destination :class:`~invenio_files_rest.models.Bucket`.
+    :param key: key of the created object.
+    :param path: path of the file to import.
+    :param link_mode: one of :data:`LINK_MODES`.
+    :param expected_checksum: ``algo:value`` checksum, or a plain MD5 value,
+        which the file must have.
+    :raises ImportChecksumError: if the checksum differs from
+        ``expected_checksum``. The database session then has to be rolled
+        back.
+    :returns: the created :class:`~invenio_files_rest.models.ObjectVersion`.
+    """
+    from .storage import store_extra_checksums
+    size = os.path.getsize(path)
+    check_sizelimit(bucket.size_limit, size, size)
+    obj = ObjectVersion.create(bucket, key, mimetype=mimetype)
+    fileinstance = FileInstance.create()
+    storage_kwargs = dict(
+        default_location=bucket.location.uri,
+        default_storage_class=bucket.default_storage_class,
+    )
+    storage = fileinstance.storage(**storage_kwargs)
+    dst = local_path(storage.fileurl)
+
+    if dst and link_file(path, dst, link_mode):
+        fileinstance.set_uri(
+            storage.fileurl, size, None,
+            storage_class=bucket.default_storage_class)
+        # the storage of the linked file knows its size
+        fileinstance.checksum = fileinstance.storage(
+            **storage_kwargs).checksum(chunk_size=chunk_size)
+    else:
+        with open(path, 'rb') as stream:
+            fileinstance.set_contents(
+                stream, size=size, size_limit=bucket.size_limit,
+                chunk_size=chunk_size, **storage_kwargs)
+    try:
+        _verify_checksum(fileinstance, expected_checksum)
+    except ImportChecksumError:
+        fileinstance.storage(**storage_kwargs).delete()
+        raise
+    obj.set_file(fileinstance)
+    store_extra_checksums(obj)
+    return obj
+
+
+def iter_import_sources(paths):
+    """Iterate over the ``(key, path)`` of the files to import.
+
+    Directories are walked recursively, the keys of their files being the
+    paths relative to the directory.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield os.path.basename(path), path
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                file_path = os.path.join(dirpath, filename)
+                yield os.path.relpath(file_path, path).replace(os.sep, '/'), \
+                    file_path
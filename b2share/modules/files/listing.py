@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2017 CERN.
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Paginated listing of the files of a bucket.
+
+The record metadata embeds the description of all the files of the record
+(``_files``), which the serializer truncates for records having many files.
+The whole list is available page by page from the files of the bucket. The
+default order, by key, follows the primary key of the object versions.
+"""
+
+from invenio_db import db
+from invenio_files_rest.models import FileInstance, ObjectVersion
+from sqlalchemy import func
+
+SORT_OPTIONS = {
+    'key': (ObjectVersion.key,),
+    '-key': (ObjectVersion.key.desc(),),
+    'size': (FileInstance.size, ObjectVersion.key),
+    '-size': (FileInstance.size.desc(), ObjectVersion.key),
+    'updated': (ObjectVersion.updated, ObjectVersion.key),
+    '-updated': (ObjectVersion.updated.desc(), ObjectVersion.key),
+}
+"""Orders of the files listings, by name of the ``sort`` parameter."""
+
+
+def _bucket_files_query(bucket_id):
+    """Return the query of the current files of a bucket."""
+    return db.session.query(ObjectVersion, FileInstance).join(
+        FileInstance, ObjectVersion.file_id == FileInstance.id,
+    ).filter(
+        ObjectVersion.bucket_id == bucket_id,
+        ObjectVersion.is_head.is_(True),
+    )
+
+
+def bucket_files_summary(bucket_id):
+    """Return the number and the total size of the files of a bucket."""
+    count, total_size = _bucket_files_query(bucket_id).with_entities(
+        func.count(ObjectVersion.version_id),
+        func.coalesce(func.sum(FileInstance.size), 0),
+    ).one()
+    return dict(count=count, total_size=int(total_size))
+
+
+def bucket_files_page(bucket_id, sort='key', page=1, size=100):
+    """Return a page of the files of a bucket.
+
+    :param sort: one of :data:`SORT_OPTIONS`.
+    :returns: list of file descriptions, as in the ``_files`` of a record.
+    """
+    query = _bucket_files_query(bucket_id).order_by(*SORT_OPTIONS[sort])
+    return [dict(
+        bucket=str(obj.bucket_id),
+        checksum=fileinstance.checksum,
+        key=obj.key,
+        size=fileinstance.size,
+        version_id=str(obj.version_id),
+    ) for obj, fileinstance in query.offset((page - 1) * size).limit(size)]
+
+
+def summarize_files(files, max_files):
+    """Truncate the ``_files`` of a record having too many files.
+
+    :returns: the first ``max_files`` files and their summary, or all the
+        files and None if they are not truncated.
+    """
+    if max_files is None or len(files) <= max_files:
+        return files, None
+    return files[:max_files], dict(
+        count=len(files),
+        total_size=sum(f.get('size') or 0 for f in files),
+        truncated=True,
+    )
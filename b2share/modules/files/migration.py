@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2017 CERN.
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Migration of files between storage locations.
+
+The files of a location can be moved to another location, for example to a
+cheaper storage for the files which were not downloaded for a long time. The
+download dates come from the invenio-stats file download events.
+
+A file is streamed into a new file instance of the destination location, its
+checksum being computed while it is written. If the checksum matches, all the
+objects of the source file instance are linked to the new one in a single
+transaction. The source file instance is then unused: a delayed task deletes
+it with its data once the grace period of the garbage collector is over (see
+:mod:`b2share.modules.files.gc`), thus the downloads in progress are not
+interrupted.
+
+A migration can be interrupted at any time and started again: the migrated
+files are not in the source location anymore, and the destination file
+instance of an interrupted copy is never used and is garbage collected.
+"""
+
+import multiprocessing
+from datetime import datetime, timedelta
+
+from flask import current_app
+from invenio_db import db
+from invenio_files_rest.models import FileInstance, Location, ObjectVersion
+from invenio_search import current_search_client
+from invenio_search.utils import build_alias_name
+from sqlalchemy import func
+
+from .storage import store_extra_checksums
+from .verification import Throttle
+
+MIGRATED = 'migrated'
+FAILED = 'failed'
+
+DOWNLOAD_EVENTS_INDEX = 'events-stats-file-download'
+
+
+class MigrationChecksumError(Exception):
+    """The copied data does not have the checksum of the source file."""
+
+
+class ThrottledReader(object):
+    """File-like object reading a stream within a throttle's budget."""
+
+    def __init__(self, stream, throttle):
+        """Wrap a stream."""
+        self.stream = stream
+        self.throttle = throttle
+
+    def read(self, size=-1):
+        """Read from the stream, waiting for the budget if needed."""
+        data = self.stream.read(size)
+        self.throttle.consume(len(data))
+        return data
+
+
+def location_prefix(location):
+    """Return the prefix of the URIs of the files of a location."""
+    return location.uri.rstrip('/') + '/'
+
+
+def migration_candidates(source, min_age=None):
+    """Return the query of the files of a location which can be migrated.
+
+    :param source: :class:`~invenio_files_rest.models.Location` of the files.
+    :param min_age: :class:`datetime.timedelta`, only return the files
+        created before.
+    """
+    query = FileInstance.query.filter(
+        FileInstance.uri.startswith(location_prefix(source),
+                                    autoescape=True),
+        FileInstance.readable.is_(True),
+        FileInstance.writable.is_(False),
+        FileInstance.checksum.isnot(None),
+        # B2SAFE files only reference data stored outside of B2SHARE
+        func.coalesce(FileInstance.storage_class, '') != 'B',
+    )
+    if min_age is not None:
+        query = query.filter(
+            FileInstance.created < datetime.utcnow() - min_age)
+    return query
+
+
+def downloaded_files(file_ids, since):
+    """Return the ids of the files downloaded since a date.
+
+    :param file_ids: ids of the files to check.
+    """
+    if not file_ids:
+        return set()
+    response = current_search_client.search(
+        index=build_alias_name(DOWNLOAD_EVENTS_INDEX),
+        body={
+            'size': 0,
+            'query': {'bool': {'filter': [
+                {'range': {'timestamp': {'gte': since.isoformat()}}},
+                {'terms': {'file_id': [str(id_) for id_ in file_ids]}},
+            ]}},
+            'aggs': {'files': {'terms': {
+                'field': 'file_id', 'size': len(file_ids),
+            }}},
+        },
+        ignore_unavailable=True,
+    )
+    return set(bucket['key'] for bucket in
+               response['aggregations']['files']['buckets']) \
+        if 'aggregations' in response else set()
+
+
+def select_files(source, min_age=None, idle=None, limit=None,
+                 batch_size=1000):
+    """Iterate over the ids and sizes of the files to migrate, by id.
+
+    :param idle: :class:`datetime.timedelta`, skip the files downloaded
+        during this period.
+    :param limit: maximum number of files.
+    """
+    query = migration_candidates(source, min_age=min_age).with_entities(
+        FileInstance.id, FileInstance.size)
+    since = datetime.utcnow() - idle if idle is not None else None
+    after = None
+    count = 0
+    while True:
+        batch_query = query
+        if after is not None:
+            batch_query = batch_query.filter(FileInstance.id > after)
+        batch = batch_query.order_by(FileInstance.id).limit(batch_size).all()
+        if not batch:
+            return
+        after = batch[-1].id
+        recent = downloaded_files([row.id for row in batch], since) \
+            if since is not None else set()
+        for row in batch:
+            if str(row.id) in recent:
+                continue
+            yield str(row.id), row.size or 0
+            count += 1
+            if limit and count >= limit:
+                return
+
+
+def migrate_file(file_id, destination, throttle=None, chunk_size=None,
+                 queue=None):
+    """Move the data of a file instance to another location.
+
+    :param destination: the destination
+        :class:`~invenio_files_rest.models.Location`.
+    :param throttle: :class:`~.verification.Throttle` limiting the read
+        bandwidth.
+    :param queue: Celery queue of the task deleting the source file, whose
+        workers have access to the source location.
+    :raises MigrationChecksumError: if the checksum of the copy differs from
+        the checksum of the source. The copy is then deleted.
+    :returns: the new :class:`~invenio_files_rest.models.FileInstance`, or
+        None if the file is already in the destination location.
+    """
+    from .tasks import delete_migrated_file
+    src = FileInstance.get(file_id)
+    if src is None or src.uri.startswith(location_prefix(destination)):
+        return None
+    storage_kwargs = dict(default_location=destination.uri,
+                          default_storage_class=src.storage_class)
+    dst = FileInstance.create()
+    db.session.commit()
+    dst_storage = dst.storage(**storage_kwargs)
+    try:
+        with src.storage().open(mode='rb') as stream:
+            dst.set_contents(
+                ThrottledReader(stream, throttle or Throttle()),
+                size=src.size, chunk_size=chunk_size, **storage_kwargs)
+        if dst.checksum != src.checksum:
+            raise MigrationChecksumError(
+                'Checksum {} of the copy of file {} instead of {}'.format(
+                    dst.checksum, file_id, src.checksum))
+        dst.storage_class = src.storage_class
+        # the checksum was just verified
+        dst.last_check = True
+        dst.last_check_at = datetime.utcnow()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        try:
+            dst_storage.delete()
+        except Exception:
+            # nothing was written
+            pass
+        FileInstance.query.filter_by(id=dst.id).delete()
+        db.session.commit()
+        raise
+
+    with db.session.begin_nested():
+        ObjectVersion.relink_all(src, dst)
+        # the checksums computed while copying
+        store_extra_checksums(*ObjectVersion.query.filter_by(file_id=dst.id))
+        # start the grace period of the garbage collection of the source
+        src.updated = datetime.utcnow()
+    db.session.commit()
+    grace_period = current_app.config['B2SHARE_FILES_GC_GRACE_PERIOD']
+    # a minute later, the source is then older than the grace period
+    delete_migrated_file.apply_async(
+        args=(str(src.id),),
+        countdown=int(grace_period.total_seconds()) + 60, queue=queue)
+    return dst
+
+
+def migrate_files(file_ids, destination, bytes_per_second=None,
+                  chunk_size=None, queue=None):
+    """Migrate files one after the other.
+
+    :param queue: see :func:`migrate_file`.
+    :returns: iterator of the ``(file_id, status, error)`` of each file.
+    """
+    throttle = Throttle(bytes_per_second)
+    for file_id in file_ids:
+        try:
+            migrate_file(file_id, destination, throttle=throttle,
+                         chunk_size=chunk_size, queue=queue)
+        except Exception as e:
+            current_app.logger.exception(
+                'Migration of file {} to location {} failed'.format(
+                    file_id, destination.name))
+            yield file_id, FAILED, str(e)
+        else:
+            yield file_id, MIGRATED, None
+
+
+_worker = {}
+
+
+def _init_worker(app, destination_name, bytes_per_second, chunk_size):
+    """Initialize a migration process."""
+    _worker['app_context'] = app.app_context()
+    _worker['app_context'].push()
+    # The parent's connections must not be used by the children.
+    db.engine.dispose()
+    _worker['destination'] = Location.get_by_name(destination_name)
+    _worker['throttle'] = Throttle(bytes_per_second)
+    _worker['chunk_size'] = chunk_size
+
+
+def _migrate_in_worker(file_id):
+    try:
+        migrate_file(file_id, _worker['destination'],
+                     throttle=_worker['throttle'],
+                     chunk_size=_worker['chunk_size'])
+    except Exception as e:
+        db.session.rollback()
+        return file_id, FAILED, str(e)
+    finally:
+        db.session.remove()
+    return file_id, MIGRATED, None
+
+
+def migrate_location(file_ids, destination, workers=1, bytes_per_second=None,
+                     chunk_size=None):
+    """Migrate files to a location with several processes.
+
+    The processes share the bandwidth equally.
+
+    :param file_ids: iterable of file ids, for example from
+        :func:`select_files`.
+    :returns: iterator of the ``(file_id, status, error)`` of each file.
+    """
+    if workers <= 1:
+        for result in migrate_files(file_ids, destination,
+                                    bytes_per_second=bytes_per_second,
+                                    chunk_size=chunk_size):
+            yield result
+        return
+    app = current_app._get_current_object()
+    # The parent's connections must not be used by the children.
+    db.session.remove()
+    db.engine.dispose()
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(
+            app, destination.name,
+            bytes_per_second / workers if bytes_per_second else None,
+            chunk_size)) as pool:
+        for result in pool.imap_unordered(_migrate_in_worker, file_ids):
+            yield result
+
+
+def policy_files(policy):
+    """Return the ids and sizes of the files selected by a policy.
+
+    See ``B2SHARE_FILES_MIGRATION_POLICIES``.
+    """
+    source = Location.get_by_name(policy['source'])
+    if source is None:
+        raise ValueError('Location {} does not exist.'.format(
+            policy['source']))
+    return select_files(
+        source,
+        min_age=timedelta(**policy['min_age'])
+        if policy.get('min_age') else None,
+        idle=timedelta(**policy['idle']) if policy.get('idle') else None,
+        limit=policy.get('max_files'),
+    )
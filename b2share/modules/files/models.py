@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2016 CERN.
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""B2Share files database models.
+
+The files are stored in the tables of invenio-files-rest. The indexes which
+B2SHARE needs on them are declared here, so that they are created with the
+tables of a new instance. The existing instances create them with the
+upgrade alembic revisions.
+"""
+
+from invenio_files_rest.models import FileInstance
+from sqlalchemy import Index
+
+ix_files_files_checksum_size = Index(
+    'ix_files_files_checksum_size',
+    FileInstance.__table__.c.checksum,
+    FileInstance.__table__.c.size,
+)
+"""Lookup of the file instances having the same content."""
@@ -50,6 +50,7 @@ _read_actions = set([
     'bucket-read',
     'object-read',
     'bucket-listmultiparts',
+    'multipart-read',
 ])
 
 
@@ -131,13 +132,15 @@ class DepositFilesPermission(RecordFilesPermission):
                 ReadDepositPermission, UpdateDepositMetadataPermission
             )
             # all actions are granted to the owner
-            if self.action in {'bucket-read', 'object-read'}:
-                # A user can read the files if he can read the deposit
+            if self.action in _read_actions:
+                # A user can read the files and the multipart uploads if he
+                # can read the deposit
                 self.permissions.add(
                     ReadDepositPermission(self.record)
                 )
-            if self.action in {'bucket-update', 'object-delete'}:
-                # A user can modify the files if he can modify the metadata
+            elif self.action in _update_actions:
+                # A user can modify the files, upload them in parts and abort
+                # the multipart uploads if he can modify the metadata
                 self.permissions.add(
                     UpdateDepositMetadataPermission(self.record)
                 )
@@ -23,9 +23,215 @@
 
 """B2share Storage Class."""
 
-from flask import make_response
+import errno
+import hashlib
+import os
+import zlib
+from datetime import datetime
+from io import BytesIO
+from urllib.parse import quote
+
+from flask import current_app, make_response, request
+from invenio_db import db
+from invenio_files_rest.models import ObjectVersionTag
 from invenio_files_rest.storage.pyfs import PyFSFileStorage, \
     pyfs_storage_factory
+from invenio_files_rest.helpers import send_stream
+
+from .ingest import local_path
+
+X_ACCEL_REDIRECT = 'x-accel-redirect'
+"""Offload the downloads to nginx with an internal redirection."""
+
+X_SENDFILE = 'x-sendfile'
+"""Offload the downloads to Apache (mod_xsendfile) or lighttpd."""
+
+
+CHECKSUM_TAG_PREFIX = 'checksum:'
+"""Prefix of the object tags storing the additional checksums of a file."""
+
+_SESSION_CHECKSUMS = 'b2share_files_extra_checksums'
+
+
+class Adler32(object):
+    """Adler-32 checksum with the interface of the :mod:`hashlib` hashes."""
+
+    def __init__(self):
+        """Start a checksum."""
+        self.value = zlib.adler32(b'')
+
+    def update(self, data):
+        """Add data to the checksum."""
+        self.value = zlib.adler32(data, self.value)
+
+    def hexdigest(self):
+        """Return the checksum as 8 hexadecimal digits."""
+        return '{:08x}'.format(self.value)
+
+
+CHECKSUM_ALGORITHMS = {
+    'sha256': hashlib.sha256,
+    'adler32': Adler32,
+}
+"""Additional checksum algorithms, see ``B2SHARE_FILES_EXTRA_CHECKSUMS``."""
+
+
+class MultiHash(object):
+    """Update several hashes with each chunk of a stream.
+
+    It behaves as the MD5 hash which the files are identified with, the other
+    hashes are available in :attr:`extra`.
+    """
+
+    def __init__(self, algorithms):
+        """Start the MD5 hash and the hashes of the given algorithms."""
+        self.md5 = hashlib.md5()
+        self.extra = dict((algo, CHECKSUM_ALGORITHMS[algo]())
+                          for algo in algorithms)
+
+    def update(self, data):
+        """Add data to all the hashes."""
+        self.md5.update(data)
+        for m in self.extra.values():
+            m.update(data)
+
+    def hexdigest(self):
+        """Return the MD5 digest."""
+        return self.md5.hexdigest()
+
+    def checksums(self):
+        """Return the ``algo:value`` of the additional hashes, by algo."""
+        return dict((algo, '{}:{}'.format(algo, m.hexdigest()))
+                    for algo, m in self.extra.items())
+
+
+class ChecksumFileStorage(PyFSFileStorage):
+    """Storage computing all the checksums of a file while writing it.
+
+    The MD5 checksum and the additional checksums of
+    ``B2SHARE_FILES_EXTRA_CHECKSUMS`` are computed from the written chunks,
+    the file is thus never read again for them. As the checksum of the file
+    was just computed, its first periodic verification is skipped.
+
+    The files of the multipart uploads are allocated when they are
+    initialized, see :meth:`initialize`.
+
+    The additional checksums are kept in the database session until
+    :func:`store_extra_checksums` adds them to the tags of the object.
+    """
+
+    fileinstance = None
+    """The :class:`~invenio_files_rest.models.FileInstance` of the file."""
+
+    _hash = None
+
+    def _init_hash(self):
+        """Hash the written data with all the configured algorithms."""
+        if self._hash is None:
+            return super(ChecksumFileStorage, self)._init_hash()
+        # the MultiHash behaves as the MD5 hash
+        return 'md5', self._hash
+
+    def _hash_all(self, write, *args, **kwargs):
+        """Call ``write`` with a hash computing all the checksums."""
+        self._hash = MultiHash(current_app.config.get(
+            'B2SHARE_FILES_EXTRA_CHECKSUMS', []))
+        try:
+            result = write(*args, **kwargs)
+        finally:
+            m, self._hash = self._hash, None
+        if self.fileinstance is not None:
+            # the REST API commits the file before signaling its upload
+            db.session.info.setdefault(_SESSION_CHECKSUMS, {})[
+                str(self.fileinstance.id)] = m.checksums()
+            # the checksum is as recent as the data
+            self.fileinstance.last_check = True
+            self.fileinstance.last_check_at = datetime.utcnow()
+        return result
+
+    def save(self, *args, **kwargs):
+        """Write a stream and compute its checksums."""
+        return self._hash_all(
+            super(ChecksumFileStorage, self).save, *args, **kwargs)
+
+    def _compute_checksum(self, stream, **kwargs):
+        """Compute the checksums of a stream written outside the storage.
+
+        It is also used by :meth:`checksum`, when the parts of a multipart
+        upload are merged: the assembled file is read once for all its
+        checksums.
+        """
+        return self._hash_all(
+            super(ChecksumFileStorage, self)._compute_checksum, stream,
+            **kwargs)
+
+    def initialize(self, size=0):
+        """Create a file of the given size without writing it.
+
+        The parts of a multipart upload are then written concurrently at
+        their offsets. Allocating the blocks of the whole file avoids its
+        fragmentation and fails early if the disk is full.
+        """
+        path = local_path(self.fileurl)
+        if not path:
+            return super(ChecksumFileStorage, self).initialize(size=size)
+        # creates the directory of the file
+        self._get_fs()
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o666)
+        try:
+            if size:
+                try:
+                    os.posix_fallocate(fd, 0, size)
+                except OSError as e:
+                    if e.errno == errno.ENOSPC:
+                        raise
+                    # not supported by the file system: sparse file
+                    os.ftruncate(fd, size)
+        except Exception:
+            self.delete()
+            raise
+        finally:
+            os.close(fd)
+        self._size = size
+        return self.fileurl, size, None
+
+
+def store_extra_checksums(*object_versions):
+    """Add the additional checksums computed during the upload to the tags.
+
+    The tags are copied with the objects when the record is published.
+
+    :param object_versions: the objects of the uploaded file.
+    :returns: True if tags were added.
+    """
+    if not object_versions:
+        return False
+    checksums = db.session.info.get(_SESSION_CHECKSUMS, {}).pop(
+        str(object_versions[0].file_id), None)
+    for algo, checksum in (checksums or {}).items():
+        for object_version in object_versions:
+            ObjectVersionTag.create_or_update(
+                object_version, CHECKSUM_TAG_PREFIX + algo, checksum)
+    return bool(checksums)
+
+
+def extra_checksums(version_ids):
+    """Return the additional checksums of objects, by version id.
+
+    :returns: dict of the ``{algo: 'algo:value'}`` of each object which has
+        additional checksums.
+    """
+    result = {}
+    if not version_ids:
+        return result
+    tags = ObjectVersionTag.query.filter(
+        ObjectVersionTag.version_id.in_(version_ids),
+        ObjectVersionTag.key.startswith(CHECKSUM_TAG_PREFIX),
+    )
+    for tag in tags:
+        result.setdefault(str(tag.version_id), {})[
+            tag.key[len(CHECKSUM_TAG_PREFIX):]] = tag.value
+    return result
 
 
 class B2ShareFileStorage(PyFSFileStorage):
@@ -37,8 +243,79 @@ class B2ShareFileStorage(PyFSFileStorage):
         return make_response(("Found", 302, headers))
 
 
+def offload_header(path):
+    """Return the header offloading the sending of a local file, or None.
+
+    See ``B2SHARE_FILES_SEND_OFFLOAD``.
+    """
+    mode = current_app.config.get('B2SHARE_FILES_SEND_OFFLOAD')
+    if mode == X_SENDFILE:
+        return 'X-Sendfile', path
+    if mode != X_ACCEL_REDIRECT:
+        return None
+    path = os.path.normpath(path)
+    locations = current_app.config.get(
+        'B2SHARE_FILES_SEND_OFFLOAD_LOCATIONS', {})
+    # the longest matching directory first
+    for directory in sorted(locations, key=len, reverse=True):
+        directory_path = os.path.normpath(directory)
+        if path.startswith(directory_path + os.sep):
+            return 'X-Accel-Redirect', '{}/{}'.format(
+                locations[directory].rstrip('/'),
+                quote(path[len(directory_path) + 1:]))
+    return None
+
+
+class OffloadedFileStorage(ChecksumFileStorage):
+    """Storage letting the web server send the local files.
+
+    The permissions are checked before the storage is asked to send the file,
+    thus the application only builds the headers of the response and the web
+    server sends the file, including the range requests. Files which cannot be
+    offloaded are sent by the application.
+    """
+
+    def send_file(self, filename, mimetype=None, restricted=True,
+                  checksum=None, trusted=False, chunk_size=None,
+                  as_attachment=False):
+        """Send the file with the web server if possible."""
+        path = local_path(self.fileurl)
+        header = offload_header(path) if path else None
+        if header is None:
+            return super(OffloadedFileStorage, self).send_file(
+                filename, mimetype=mimetype, restricted=restricted,
+                checksum=checksum, trusted=trusted, chunk_size=chunk_size,
+                as_attachment=as_attachment)
+
+        md5_checksum = None
+        if checksum:
+            algo, value = checksum.split(':')
+            if algo == 'md5':
+                md5_checksum = value
+        # The headers are built as for a streamed file, but without data.
+        response = send_stream(
+            BytesIO(), filename, self._size, self._modified,
+            mimetype=mimetype, restricted=restricted, etag=checksum,
+            content_md5=md5_checksum, trusted=trusted,
+            as_attachment=as_attachment, conditional=False)
+        # Answer the conditional requests matching the checksum here, the
+        # web server handles the range requests.
+        response = response.make_conditional(request)
+        if response.status_code == 200:
+            response.headers[header[0]] = header[1]
+            response.headers['Content-Length'] = '0'
+        return response
+
+
 def b2share_storage_factory(**kwargs):
     """Pass B2ShareFileStorage as parameter to pyfs_storage_factory."""
     if kwargs['fileinstance'].storage_class == 'B':
         kwargs['filestorage_class'] = B2ShareFileStorage
-    return pyfs_storage_factory(**kwargs)
+        return pyfs_storage_factory(**kwargs)
+    elif current_app.config.get('B2SHARE_FILES_SEND_OFFLOAD'):
+        kwargs['filestorage_class'] = OffloadedFileStorage
+    else:
+        kwargs['filestorage_class'] = ChecksumFileStorage
+    storage = pyfs_storage_factory(**kwargs)
+    storage.fileinstance = kwargs['fileinstance']
+    return storage
@@ -27,12 +27,18 @@ from celery import shared_task
 from flask import current_app, url_for
 from flask_babelex import lazy_gettext as _
 from invenio_db import db
-from invenio_records_files.models import RecordsBuckets
-from invenio_files_rest.models import FileInstance, ObjectVersion
-from invenio_files_rest.tasks import schedule_checksum_verification
+from invenio_files_rest.models import FileInstance, Location
+from invenio_files_rest.utils import obj_or_import_string
 from invenio_mail.tasks import send_email
 from sqlalchemy import or_
 
+from .dedup import deduplicate_file
+from .gc import collect_file_instance, collect_garbage, garbage_report
+from .migration import FAILED, migrate_files, policy_files
+from .storage import store_extra_checksums
+from .verification import ERROR, MISMATCH, VerificationRuns, \
+    location_budget, plan_verification, verify_files
+
 
 def failed_checksum_files_query():
     """Get all files that failed their previous checksum verification."""
@@ -50,28 +56,17 @@ def _format_file_info(file_info):
                 str(file_info[4])
             )
 
-def notify_admin():
-    """Send email to admin with the info about checksum verification errors."""
-    # Get all files that didn't match their checksums
-    results = db.session.query(RecordsBuckets.record_id,
-                               ObjectVersion.bucket_id,
-                               ObjectVersion.key,
-                               FileInstance.uri,
-                               FileInstance.checksum).\
-        filter(RecordsBuckets.bucket_id == ObjectVersion.bucket_id,
-               ObjectVersion.file_id == FileInstance.id,
-               FileInstance.last_check == False).all()
-    # Get all files for which an error occurred while verifying their checksum
-    error_count = FileInstance.query.filter_by(last_check=None).count()
-    if error_count != 0:
-        error_files = db.session.query(RecordsBuckets.record_id,
-                                ObjectVersion.bucket_id,
-                                ObjectVersion.key,
-                                FileInstance.uri,
-                                FileInstance.checksum).\
-            filter(RecordsBuckets.bucket_id == ObjectVersion.bucket_id,
-                ObjectVersion.file_id == FileInstance.id,
-                FileInstance.last_check == None).limit(100).all()
+def notify_admin(summary):
+    """Send email to admin with the info about checksum verification errors.
+
+    :param dict summary: summary of a verification run, see
+        :func:`b2share.modules.files.verification.summarize`.
+    """
+    # Files that didn't match their checksums
+    results = summary['failed'][MISMATCH]
+    # Files for which an error occurred while verifying their checksum
+    error_count = summary[ERROR]
+    error_files = summary['failed'][ERROR]
 
     msg_content = ''
     if results:
@@ -81,6 +76,10 @@ def notify_admin():
             current_app.config['JSONSCHEMAS_HOST'],
             '<br/><br/>'.join([_format_file_info(info) for info in results])
         )
+        if summary[MISMATCH] > len(results):
+            msg_content += '{0}: {1}<br/><br/>'.format(
+                _('Total number of files with modified checksums'),
+                str(summary[MISMATCH]))
     if error_count != 0:
         msg_content += ('{0}: {1}<br/><br/>{2}:<br/><br/>{3}<br/><br/>'.format(
             _('Number of files for which an error occurred during the '
@@ -106,6 +105,82 @@ def notify_admin():
         ))
 
 
+@shared_task(ignore_result=True)
+def schedule_checksum_verification(frequency=None, batch_interval=None,
+                                   max_count=None, files_query=None,
+                                   notify=True):
+    """Schedule the verification of the files' checksums.
+
+    This task is meant to run every ``batch_interval``. Each storage location
+    verifies as many files as its budget allows during this interval, see
+    :mod:`b2share.modules.files.verification`. The files which were never
+    checked are verified first, then the files checked the longest time ago.
+
+    :param dict frequency: files checked more recently than this
+        :class:`datetime.timedelta` are not verified. All the matching files
+        are verified if it is None.
+    :param dict batch_interval: :class:`datetime.timedelta` over which the
+        budget of the locations are spent. Defaults to one hour.
+    :param int max_count: maximum number of files verified per location.
+    :param files_query: function, or its import path, returning a
+        FileInstance query for files that should be checked.
+    :param bool notify: email the failed files to B2SHARE_SUPPORT when the
+        verification run is finished.
+
+    No run is planned while the previous run of the same ``files_query`` is
+    not finished, its files would be planned again.
+    """
+    files_query = obj_or_import_string(files_query)
+    kind = '{0.__module__}.{0.__name__}'.format(files_query) \
+        if files_query else 'all'
+    runs = VerificationRuns()
+    pending = runs.pending(kind)
+    if pending is not None:
+        current_app.logger.info(
+            'Checksum verification run {} is not finished, the next {} run '
+            'is skipped'.format(pending, kind))
+        return
+    batches = plan_verification(files_query=files_query, frequency=frequency,
+                                batch_interval=batch_interval,
+                                max_count=max_count)
+    if not batches:
+        return
+    run_id = runs.create(batches, notify=notify, kind=kind)
+    index = 0
+    for name, chunks in batches.items():
+        budget = location_budget(name)
+        # the workers share the budget of their location
+        bytes_per_second = budget.get('bytes_per_second')
+        iops = budget.get('iops')
+        for chunk in chunks:
+            verify_checksum_batch.apply_async(
+                args=(run_id, index, chunk),
+                kwargs=dict(
+                    bytes_per_second=bytes_per_second / len(chunks)
+                    if bytes_per_second else None,
+                    iops=iops / len(chunks) if iops else None,
+                ),
+                queue=budget.get('queue'))
+            index += 1
+
+
+@shared_task(ignore_result=True)
+def verify_checksum_batch(run_id, index, file_ids, bytes_per_second=None,
+                          iops=None):
+    """Verify the checksums of a batch of files of a verification run.
+
+    The last batch of the run reports the failed files of the whole run.
+    """
+    result = verify_files(file_ids, bytes_per_second=bytes_per_second,
+                          iops=iops)
+    current_app.logger.info(
+        'Verified {} bytes of {} files in {:.0f}s for run {}'.format(
+            result.get('bytes', 0), len(file_ids), result['seconds'], run_id))
+    summary = VerificationRuns().task_done(run_id, index, result)
+    if summary is not None and summary['notify']:
+        notify_admin(summary)
+
+
 @shared_task(ignore_result=True)
 def schedule_failed_checksum_files(**kwargs):
     """Schedule files checksum check for files which failed their check.
@@ -132,4 +207,98 @@ def schedule_failed_checksum_files(**kwargs):
         files_query=failed_checksum_files_query,
         **kwargs
     ).apply()
-    notify_admin()
+
+
+@shared_task(ignore_result=True)
+def merge_duplicate_file(file_id):
+    """Merge an uploaded file into an older file with the same content."""
+    original = deduplicate_file(file_id)
+    if original is not None:
+        current_app.logger.info('File {} merged into file {}'.format(
+            file_id, original.id))
+
+
+def store_uploaded_checksums(object_version):
+    """Tag an uploaded object with the checksums computed during its upload.
+
+    See ``B2SHARE_FILES_EXTRA_CHECKSUMS``.
+    """
+    if store_extra_checksums(object_version):
+        db.session.commit()
+
+
+def deduplicate_uploaded_file(object_version):
+    """Schedule the deduplication of an uploaded file if it is enabled."""
+    if current_app.config.get('B2SHARE_FILES_DEDUPLICATION') and \
+            object_version.file_id:
+        merge_duplicate_file.delay(str(object_version.file_id))
+
+
+@shared_task(ignore_result=True)
+def collect_files_garbage(dry_run=False, disk_files=False):
+    """Delete the unused buckets, file instances and files.
+
+    See :mod:`b2share.modules.files.gc`.
+
+    :param bool dry_run: only log how much garbage there is.
+    :param bool disk_files: also delete the stored files without file
+        instance.
+    """
+    report = garbage_report(collect_garbage(dry_run=dry_run,
+                                            disk_files=disk_files))
+    current_app.logger.info('{} files garbage: {}'.format(
+        'Found' if dry_run else 'Collected', json.dumps(report,
+                                                        sort_keys=True)))
+
+
+@shared_task(ignore_result=True)
+def delete_migrated_file(file_id):
+    """Delete the source of a migrated file once its grace period is over.
+
+    See :func:`b2share.modules.files.migration.migrate_file`.
+    """
+    if collect_file_instance(file_id):
+        current_app.logger.info(
+            'Deleted the migrated file {}'.format(file_id))
+
+
+@shared_task(ignore_result=True)
+def migrate_files_to_location(file_ids, location_name, bytes_per_second=None,
+                              queue=None):
+    """Move files to another location, one after the other.
+
+    :param queue: Celery queue of the tasks deleting the source files.
+    """
+    location = Location.get_by_name(location_name)
+    failed = [file_id for file_id, status, _ in migrate_files(
+        file_ids, location, bytes_per_second=bytes_per_second, queue=queue)
+        if status == FAILED]
+    current_app.logger.info(
+        'Migrated {} files to location {}, {} failed'.format(
+            len(file_ids) - len(failed), location_name, len(failed)))
+
+
+@shared_task(ignore_result=True)
+def apply_migration_policies():
+    """Schedule the migration of the files selected by the policies.
+
+    See ``B2SHARE_FILES_MIGRATION_POLICIES``. The files of a policy are
+    split between its workers, which share its bandwidth.
+    """
+    for policy in current_app.config['B2SHARE_FILES_MIGRATION_POLICIES']:
+        workers = policy.get('workers') or 1
+        chunks = [[] for _ in range(workers)]
+        loads = [0] * workers
+        for file_id, size in policy_files(policy):
+            index = loads.index(min(loads))
+            chunks[index].append(file_id)
+            loads[index] += size
+        bytes_per_second = policy.get('bytes_per_second')
+        for chunk in chunks:
+            if chunk:
+                migrate_files_to_location.apply_async(
+                    args=(chunk, policy['destination']),
+                    kwargs=dict(bytes_per_second=bytes_per_second / workers
+                                if bytes_per_second else None,
+                                queue=policy.get('queue')),
+                    queue=policy.get('queue'))
@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2017 CERN.
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Throttled verification of the file checksums.
+
+A verification run is planned for each batch interval:
+
+1. the files which were never checked come first, then the files checked the
+   longest time ago,
+2. the files are grouped by the storage location containing them, each
+   location taking as many bytes as its budget allows during the batch
+   interval (see ``B2SHARE_FILES_CHECKSUM_BUDGETS``),
+3. the files of a location are split between its workers, each worker being a
+   Celery task reading at most its share of the location's bytes per second
+   and I/O operations per second.
+
+The files are read sequentially with large buffers. Each task saves its
+results and throughput under its own cache key. The last task of a run
+aggregates them into the run summary, which is used for the report sent to
+the administrators.
+"""
+
+import hashlib
+import heapq
+import os
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+
+from flask import current_app
+from invenio_cache import current_cache
+from invenio_db import db
+from invenio_files_rest.models import FileInstance, Location, ObjectVersion
+from invenio_records_files.models import RecordsBuckets
+from sqlalchemy import or_
+
+from .ingest import local_path
+
+OK = 'ok'
+MISMATCH = 'mismatch'
+ERROR = 'error'
+
+MAX_REPORTED_FILES = 100
+"""Maximum number of failed files listed in a run summary per kind."""
+
+
+class Throttle(object):
+    """Pace reads to a number of bytes and operations per second."""
+
+    def __init__(self, bytes_per_second=None, iops=None, clock=time.monotonic,
+                 sleep=time.sleep):
+        """Initialize the throttle.
+
+        :param bytes_per_second: maximum read rate, unlimited if None.
+        :param iops: maximum number of read operations per second, unlimited
+            if None.
+        """
+        self.bytes_per_second = bytes_per_second
+        self.iops = iops
+        self.clock = clock
+        self.sleep = sleep
+        self.started = clock()
+        self.bytes = 0
+        self.operations = 0
+
+    def consume(self, size=0, operations=1):
+        """Wait until ``size`` bytes can be read within the budget."""
+        self.bytes += size
+        self.operations += operations
+        delay = 0
+        if self.bytes_per_second:
+            delay = self.bytes / self.bytes_per_second
+        if self.iops:
+            delay = max(delay, self.operations / self.iops)
+        wait = self.started + delay - self.clock()
+        if wait > 0:
+            self.sleep(wait)
+
+
+def location_budget(name):
+    """Return the verification budget of a location.
+
+    The budget of a location in ``B2SHARE_FILES_CHECKSUM_BUDGETS`` overrides
+    ``B2SHARE_FILES_CHECKSUM_DEFAULT_BUDGET``.
+    """
+    budget = dict(current_app.config['B2SHARE_FILES_CHECKSUM_DEFAULT_BUDGET'])
+    budget.update(current_app.config['B2SHARE_FILES_CHECKSUM_BUDGETS']
+                  .get(name, {}))
+    return budget
+
+
+def file_location(uri, locations):
+    """Return the name of the location containing a file, or None.
+
+    :param locations: list of ``(uri, name)`` sorted by decreasing URI
+        length, thus the most specific location matches first.
+    """
+    for location_uri, name in locations:
+        if uri.startswith(location_uri.rstrip('/') + '/'):
+            return name
+    return None
+
+
+def verification_candidates(files_query=None, checked_before=None):
+    """Return the query of the files to verify, by priority.
+
+    :param files_query: function returning a
+        :class:`~invenio_files_rest.models.FileInstance` query. Defaults to
+        every file.
+    :param checked_before: only return the files checked before this date,
+        or never checked.
+    """
+    query = files_query() if files_query else FileInstance.query
+    query = query.filter(FileInstance.readable.is_(True))
+    if checked_before is not None:
+        query = query.filter(or_(FileInstance.last_check_at.is_(None),
+                                 FileInstance.last_check_at < checked_before))
+    return query.with_entities(
+        FileInstance.id, FileInstance.uri, FileInstance.size,
+    ).order_by(FileInstance.last_check_at.asc().nullsfirst(),
+               FileInstance.id)
+
+
+def plan_batches(files, locations, budgets, batch_seconds, max_count=None):
+    """Split the files to verify between the locations and their workers.
+
+    Each location takes files, in the given order, until their total size
+    reaches the bytes its budget allows during ``batch_seconds``. A location
+    always takes its first file, even if it is larger than the budget.
+
+    :param files: iterable of ``(id, uri, size)`` by priority.
+    :param locations: see :func:`file_location`.
+    :param budgets: dict of the budget of each location name, None being
+        the files outside of any location.
+    :param max_count: maximum number of files of each location.
+    :returns: dict of the list of file id lists of each location, one list
+        per worker.
+    """
+    quotas = {}
+    for name, budget in budgets.items():
+        rate = budget.get('bytes_per_second')
+        quotas[name] = rate * batch_seconds if rate else None
+    planned = {name: [] for name in budgets}
+    sizes = Counter()
+    full = set()
+    for file_id, uri, size in files:
+        name = file_location(uri, locations)
+        if name in full:
+            continue
+        planned[name].append((file_id, size or 0))
+        sizes[name] += size or 0
+        if (quotas[name] is not None and sizes[name] >= quotas[name]) or \
+                (max_count and len(planned[name]) >= max_count):
+            full.add(name)
+            if len(full) == len(budgets):
+                break
+
+    batches = {}
+    for name, location_files in planned.items():
+        if not location_files:
+            continue
+        workers = max(1, min(budgets[name].get('workers') or 1,
+                             len(location_files)))
+        # give each file to the least loaded worker
+        heap = [(0, index) for index in range(workers)]
+        chunks = [[] for _ in range(workers)]
+        for file_id, size in location_files:
+            load, index = heapq.heappop(heap)
+            chunks[index].append(str(file_id))
+            heapq.heappush(heap, (load + size, index))
+        batches[name] = chunks
+    return batches
+
+
+def _open_file(fileinstance):
+    """Open a file for a sequential read, returning it and a cleanup."""
+    path = local_path(fileinstance.uri)
+    if path is None:
+        fp = fileinstance.storage().open(mode='rb')
+        return fp, fp.close
+
+    fp = open(path, 'rb', buffering=0)
+    fd = fp.fileno()
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    def close():
+        # a scrub reads each file once, it should not evict the cached data
+        # of the files being served
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        fp.close()
+    return fp, close
+
+
+def compute_checksum(fileinstance, throttle, buffer_size):
+    """Read a file within the throttle's budget and return its checksum.
+
+    The algorithm of the stored checksum is used, MD5 if it has none.
+
+    :returns: tuple of the ``algo:value`` checksum and the number of bytes
+        read.
+    """
+    algo = (fileinstance.checksum or 'md5:').split(':', 1)[0]
+    digest = hashlib.new(algo)
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    read = 0
+    fp, close = _open_file(fileinstance)
+    try:
+        readinto = getattr(fp, 'readinto', None)
+        while True:
+            throttle.consume(buffer_size)
+            if readinto is not None:
+                count = readinto(buf)
+                data = view[:count]
+            else:
+                data = fp.read(buffer_size)
+                count = len(data)
+            if not count:
+                break
+            digest.update(data)
+            read += count
+    finally:
+        close()
+    return '{}:{}'.format(algo, digest.hexdigest()), read
+
+
+def _file_info(file_id):
+    """Return the record, bucket, key, URI and checksum of a failed file."""
+    row = db.session.query(
+        RecordsBuckets.record_id, ObjectVersion.bucket_id, ObjectVersion.key,
+        FileInstance.uri, FileInstance.checksum,
+    ).outerjoin(
+        ObjectVersion, ObjectVersion.file_id == FileInstance.id,
+    ).outerjoin(
+        RecordsBuckets, RecordsBuckets.bucket_id == ObjectVersion.bucket_id,
+    ).filter(FileInstance.id == file_id).first()
+    return [str(value) if value is not None else None for value in row]
+
+
+def verify_files(file_ids, bytes_per_second=None, iops=None,
+                 buffer_size=None):
+    """Verify the checksums of files, one after the other.
+
+    Each file is first marked as not checked, thus a file whose check is
+    interrupted is verified again by
+    :func:`~b2share.modules.files.tasks.schedule_failed_checksum_files`.
+
+    :returns: dict of the counts, throughput and failed files.
+    """
+    buffer_size = buffer_size or \
+        current_app.config['B2SHARE_FILES_CHECKSUM_BUFFER_SIZE']
+    throttle = Throttle(bytes_per_second, iops)
+    counts = Counter()
+    failed = {MISMATCH: [], ERROR: []}
+    started = time.monotonic()
+    for file_id in file_ids:
+        fileinstance = FileInstance.query.get(uuid.UUID(file_id))
+        if fileinstance is None:
+            continue
+        fileinstance.clear_last_check()
+        db.session.commit()
+        try:
+            checksum, read = compute_checksum(fileinstance, throttle,
+                                              buffer_size)
+            counts['bytes'] += read
+            result = OK if checksum == fileinstance.checksum else MISMATCH
+        except Exception as e:
+            current_app.logger.exception(
+                'Checksum verification of file {} failed: {}'.format(
+                    file_id, e))
+            result = ERROR
+        with db.session.begin_nested():
+            fileinstance.last_check = None if result == ERROR \
+                else result == OK
+            fileinstance.last_check_at = datetime.utcnow()
+        db.session.commit()
+        counts[result] += 1
+        if result != OK and len(failed[result]) < MAX_REPORTED_FILES:
+            failed[result].append(_file_info(fileinstance.id))
+    counts['seconds'] = time.monotonic() - started
+    return dict(counts, failed=failed)
+
+
+class VerificationRuns(object):
+    """Verification runs saved in the application cache."""
+
+    prefix = 'b2share_files_checksum'
+
+    def __init__(self, backend=None, timeout=None, pending_timeout=None):
+        """Initialize the run store.
+
+        :param backend: cache with Flask-Caching's interface. Defaults to the
+            application cache.
+        :param timeout: lifetime of the runs in seconds. Defaults to
+            ``B2SHARE_FILES_CHECKSUM_RUN_TTL``.
+        :param pending_timeout: seconds during which an unfinished run is
+            pending. Defaults to ``B2SHARE_FILES_CHECKSUM_PENDING_TTL``.
+        """
+        config = current_app.config
+        self.backend = backend if backend is not None else current_cache
+        self.timeout = timeout if timeout is not None else \
+            config['B2SHARE_FILES_CHECKSUM_RUN_TTL']
+        self.pending_timeout = pending_timeout \
+            if pending_timeout is not None else \
+            config['B2SHARE_FILES_CHECKSUM_PENDING_TTL']
+
+    def _key(self, *parts):
+        return ':'.join((self.prefix,) + tuple(str(p) for p in parts))
+
+    def create(self, batches, notify=True, kind=None):
+        """Save a new run.
+
+        :param batches: see :func:`plan_batches`.
+        :param notify: report the failed files to the administrators when
+            the run is finished.
+        :param kind: name of the kind of run, the run being pending for this
+            kind until its last task is done, see :meth:`pending`.
+        :returns: the id of the run.
+        """
+        run_id = uuid.uuid4().hex
+        tasks = [(name, len(chunk)) for name, chunks in batches.items()
+                 for chunk in chunks]
+        self.backend.set(self._key(run_id), dict(
+            id=run_id, started=datetime.utcnow().isoformat(), tasks=tasks,
+            notify=notify, kind=kind,
+        ), timeout=self.timeout)
+        self.backend.set(self._key(run_id, 'remaining'), len(tasks),
+                         timeout=self.timeout)
+        if kind is not None:
+            self.backend.set(self._key('pending', kind), run_id,
+                             timeout=self.pending_timeout)
+        return run_id
+
+    def pending(self, kind):
+        """Return the id of the unfinished run of a kind, or None.
+
+        A run whose tasks crashed stops being pending after
+        ``pending_timeout``.
+        """
+        return self.backend.get(self._key('pending', kind))
+
+    def get(self, run_id):
+        """Return a run, or None if it does not exist."""
+        return self.backend.get(self._key(run_id))
+
+    def task_done(self, run_id, index, result):
+        """Save the result of a task of a run.
+
+        :returns: the summary of the run if it was its last task, otherwise
+            None.
+        """
+        self.backend.set(self._key(run_id, 'task', index), result,
+                         timeout=self.timeout)
+        if self.backend.dec(self._key(run_id, 'remaining')):
+            return None
+        run = self.get(run_id)
+        if run is None:
+            return None
+        kind = run.get('kind')
+        if kind is not None and self.pending(kind) == run_id:
+            self.backend.delete(self._key('pending', kind))
+        results = self.backend.get_many(*[
+            self._key(run_id, 'task', i) for i in range(len(run['tasks']))
+        ])
+        summary = summarize(run, results)
+        self.backend.set(self._key('last'), summary, timeout=None)
+        return summary
+
+    def last_summary(self):
+        """Return the summary of the last finished run, or None."""
+        return self.backend.get(self._key('last'))
+
+
+def summarize(run, results):
+    """Aggregate the results of the tasks of a run, by location."""
+    locations = {}
+    failed = {MISMATCH: [], ERROR: []}
+    for (name, count), result in zip(run['tasks'], results):
+        location = locations.setdefault(str(name), dict(
+            files=0, bytes=0, seconds=0, lost=0,
+            **{OK: 0, MISMATCH: 0, ERROR: 0}))
+        location['files'] += count
+        if result is None:
+            # the task expired or crashed
+            location['lost'] += count
+            continue
+        for key in ('bytes', OK, MISMATCH, ERROR):
+            location[key] += result.get(key, 0)
+        # the workers of a location run concurrently
+        location['seconds'] = max(location['seconds'], result['seconds'])
+        for kind in failed:
+            failed[kind].extend(result['failed'][kind])
+    total = Counter()
+    for location in locations.values():
+        location['bytes_per_second'] = \
+            int(location['bytes'] / location['seconds']) \
+            if location['seconds'] else 0
+        total.update(location)
+    return dict(
+        id=run['id'],
+        started=run['started'],
+        finished=datetime.utcnow().isoformat(),
+        notify=run['notify'],
+        locations=locations,
+        files=total['files'],
+        bytes=total['bytes'],
+        **{OK: total[OK], MISMATCH: total[MISMATCH], ERROR: total[ERROR],
+           'lost': total['lost'],
+           'failed': {kind: files[:MAX_REPORTED_FILES]
+                      for kind, files in failed.items()}}
+    )
+
+
+def plan_verification(files_query=None, frequency=None, batch_interval=None,
+                      max_count=None):
+    """Plan the files to verify during a batch interval.
+
+    :param frequency: dict of :class:`datetime.timedelta` arguments, files
+        checked more recently are not verified again.
+    :param batch_interval: dict of :class:`datetime.timedelta` arguments,
+        duration over which the budgets are spent.
+    :returns: see :func:`plan_batches`.
+    """
+    batch_interval = timedelta(**(batch_interval or {'hours': 1}))
+    checked_before = datetime.utcnow() - timedelta(**frequency) \
+        if frequency else None
+    locations = sorted(((loc.uri, loc.name) for loc in Location.query),
+                       key=lambda location: len(location[0]), reverse=True)
+    budgets = {name: location_budget(name) for _, name in locations}
+    budgets[None] = location_budget(None)
+    files = verification_candidates(files_query, checked_before) \
+        .yield_per(1000)
+    return plan_batches(files, locations, budgets,
+                        batch_interval.total_seconds(), max_count=max_count)
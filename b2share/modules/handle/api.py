@@ -34,8 +34,12 @@ from .errors import EpicPIDError
 
 
 def create_handle(handle_client, handle_prefix, location,
-                  checksum=None, fixed=False):
-    """Create a new handle for a file, using the B2HANDLE library."""
+                  checksum=None, fixed=False, extra_checksums=None):
+    """Create a new handle for a file, using the B2HANDLE library.
+
+    The ``extra_checksums``, ``{algo: 'algo:value'}``, are stored in the
+    ``EUDAT/CHECKSUM_<ALGO>`` entries.
+    """
 
     try:
         eudat_entries = {
@@ -45,6 +49,8 @@ def create_handle(handle_client, handle_prefix, location,
         if checksum:
             eudat_entries['EUDAT/CHECKSUM'] = str(checksum)
             eudat_entries['EUDAT/CHECKSUM_TIMESTAMP'] = datetime.now().isoformat()
+        for algo, value in (extra_checksums or {}).items():
+            eudat_entries['EUDAT/CHECKSUM_{}'.format(algo.upper())] = value
         handle = handle_client.generate_and_register_handle(
             prefix=handle_prefix, location=location, checksum=checksum,
             **eudat_entries)
@@ -125,12 +131,14 @@ def check_eudat_entries_in_handle_pid(handle_client, handle_prefix, handle,
     return new_values
 
 
-def create_epic_handle(location, checksum=None):
+def create_epic_handle(location, checksum=None, extra_checksums=None):
     """Create a new handle for a file.
 
     Parameters:
         location: The location (URL) of the file.
         checksum: Optional parameter, store the checksum of the file as well.
+        extra_checksums: Optional parameter, other checksums of the file,
+            ``{algo: 'algo:value'}``, stored as CHECKSUM_<ALGO>.
     Returns:
         the URI of the new handle, raises a 503 exception if an error occurred.
     """
@@ -172,14 +180,13 @@ def create_epic_handle(location, checksum=None):
     # for a PUT, add 'If-None-Match': '*' to the header
     hdrs = {'Content-Type': 'application/json', 'Accept': 'application/json'}
 
+    entries = [{'type': 'URL', 'parsed_data': location}]
     if checksum:
-        new_handle_json = jsondumps([{'type': 'URL',
-                                      'parsed_data': location},
-                                     {'type': 'CHECKSUM',
-                                      'parsed_data': checksum}])
-    else:
-        new_handle_json = jsondumps([{'type': 'URL',
-                                      'parsed_data': location}])
+        entries.append({'type': 'CHECKSUM', 'parsed_data': checksum})
+        for algo, value in sorted((extra_checksums or {}).items()):
+            entries.append({'type': 'CHECKSUM_{}'.format(algo.upper()),
+                            'parsed_data': value})
+    new_handle_json = jsondumps(entries)
 
     current_app.logger.debug("EPIC PID json: " + new_handle_json)
 
@@ -51,7 +51,7 @@ class _B2ShareHandleState(object):
 
 
     def create_handle(self, location, checksum=None, fixed=False,
-                      fake=None):
+                      fake=None, extra_checksums=None):
         """Create a new handle for a file, using the B2HANDLE library."""
         fake = fake or current_app.config.get('TESTING', False) \
                 or current_app.config.get('FAKE_EPIC_PID', False)
@@ -62,10 +62,12 @@ class _B2ShareHandleState(object):
             return create_fake_handle(location)
         elif self.handle_client:
             return create_handle(self.handle_client, self.handle_prefix,
-                          location, checksum, fixed)
+                          location, checksum, fixed,
+                          extra_checksums=extra_checksums)
         else:
             # assume EPIC API
-            return create_epic_handle(location, checksum)
+            return create_epic_handle(location, checksum,
+                                      extra_checksums=extra_checksums)
 
 
     def check_eudat_entries_in_handle_pid(self, **kwargs):
@@ -24,7 +24,9 @@
 """B2Share oaiserver module.
 
 This module works with invenio-oaiserver to provide a
-command line interface for checking and fixing OAI PMH sets.
+command line interface for checking and fixing OAI PMH sets. It also
+precomputes the OAI-PMH metadata of the publications when they are indexed,
+see :mod:`b2share.modules.oaiserver.renditions`.
 
 
 OAI-PMH is the protocol used by B2SHARE in order to be harvestable. B2Find uses
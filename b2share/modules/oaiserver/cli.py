@@ -31,13 +31,17 @@ from flask.cli import with_appcontext
 from sqlalchemy.orm.attributes import flag_modified
 
 from invenio_db import db
+from invenio_indexer.api import RecordIndexer
+from invenio_indexer.tasks import process_bulk_queue
 from invenio_oaiserver.models import OAISet
+from invenio_pidstore.models import PersistentIdentifier, PIDStatus
 from invenio_records.models import RecordMetadata
 from invenio_records_files.api import Record
 
 from b2share.modules.communities.api import Community
 from b2share.modules.records.utils import list_db_published_records
 
+from .renditions import put_renditions_mapping
 
 
 @click.group()
@@ -97,3 +101,16 @@ def update_records_set():
             flag_modified(record.model, 'json')
             db.session.merge(record.model)
             db.session.commit()
+
+
+@oai.command()
+@with_appcontext
+def update_renditions():
+    """Reindex the publications in order to render their OAI-PMH metadata."""
+    put_renditions_mapping()
+    query = (x[0] for x in PersistentIdentifier.query.filter_by(
+        object_type='rec', pid_type='b2rec', status=PIDStatus.REGISTERED
+    ).values(PersistentIdentifier.object_uuid))
+    RecordIndexer().bulk_index(query)
+    process_bulk_queue.delay()
+    click.secho('Publications queued for indexing', fg='green')
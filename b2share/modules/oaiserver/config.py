@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2017 University of Tübingen
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""B2Share OAI-PMH configuration."""
+
+from __future__ import absolute_import, print_function
+
+B2SHARE_OAISERVER_RENDITIONS = {
+    'oai_dc': 'b2share.modules.records.serializers.oaipmh_oai_dc',
+    'marcxml': 'b2share.modules.records.serializers.oaipmh_marc21_v1',
+}
+"""OAI-PMH metadata formats precomputed when a publication is indexed.
+
+Maps a metadata prefix to the serializer rendering it. The rendered XML is
+stored in the records index and served by
+:func:`b2share.modules.oaiserver.renditions.rendition_dumper`, which falls
+back to the serializer when a record has no rendition yet.
+"""
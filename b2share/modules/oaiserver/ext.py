@@ -21,8 +21,10 @@
 
 from __future__ import absolute_import, print_function
 
+from . import config
 from .cli import oai as oai_cmd
 
+
 class B2ShareOAIServer(object):
     """B2Share oai server extension."""
 
@@ -33,4 +35,11 @@ class B2ShareOAIServer(object):
 
     def init_app(self, app):
         """Flask application initialization."""
+        self.init_config(app)
         app.cli.add_command(oai_cmd)
+
+    def init_config(self, app):
+        """Initialize configuration."""
+        for k in dir(config):
+            if k.startswith('B2SHARE_'):
+                app.config.setdefault(k, getattr(config, k))
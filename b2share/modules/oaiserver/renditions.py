@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2017 University of Tübingen
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Precomputed OAI-PMH metadata renditions.
+
+Rendering Dublin Core or MARCXML runs the marshmallow schemas and dojson rules
+on every harvested record. Instead the XML of each format listed in
+``B2SHARE_OAISERVER_RENDITIONS`` is rendered when a publication is indexed and
+stored, unindexed, in the ``_internal.oai_renditions`` field of its document.
+ListRecords responses then only need to parse the stored XML.
+"""
+
+from __future__ import absolute_import, print_function
+
+import copy
+from urllib.parse import urlunsplit
+
+from elasticsearch import VERSION as ES_VERSION
+from flask import current_app, has_request_context
+from invenio_oaiserver.proxies import current_oaiserver
+from invenio_records.api import Record
+from invenio_search import current_search_client
+from invenio_search.utils import build_alias_name
+from lxml import etree
+from werkzeug.utils import import_string
+
+RENDITIONS_FIELD = 'oai_renditions'
+"""Field of the ``_internal`` object containing the renditions."""
+
+
+def _get_serializer(metadata_prefix):
+    serializer = current_app.config['B2SHARE_OAISERVER_RENDITIONS'][
+        metadata_prefix]
+    if isinstance(serializer, str):
+        serializer = import_string(serializer)
+    return serializer
+
+
+def _render(pid, hit, formats):
+    renditions = {}
+    for metadata_prefix in formats:
+        try:
+            # serializers modify the hit they receive
+            element = _get_serializer(metadata_prefix)(
+                pid, copy.deepcopy(hit))
+            renditions[metadata_prefix] = etree.tostring(element,
+                                                         encoding='unicode')
+        except Exception:
+            # The record stays harvestable as the rendition is then computed
+            # on the fly.
+            current_app.logger.exception(
+                'Failed to render {} for record {}'.format(metadata_prefix,
+                                                           hit['_id']))
+    return renditions
+
+
+def render_renditions(record, json):
+    """Render the OAI-PMH renditions of a publication being indexed.
+
+    Args:
+        record: the indexed :class:`invenio_records.api.Record`.
+        json (dict): the document which will be indexed. It should be
+            complete as the renditions are rendered from it, exactly as
+            the OAI-PMH server would do from the search hit.
+
+    Returns:
+        dict: XML string of each rendered metadata format.
+    """
+    formats = current_app.config.get('B2SHARE_OAISERVER_RENDITIONS')
+    if not formats or not json.get('_oai', {}).get('id'):
+        return {}
+    hit = {
+        '_id': str(record.id),
+        '_version': record.revision_id,
+        '_source': {k: v for k, v in json.items() if k != '_internal'},
+    }
+    pid = current_oaiserver.oaiid_fetcher(record.id, json)
+    if has_request_context():
+        return _render(pid, hit, formats)
+    # Bulk indexing runs in Celery workers. Serializers generate external
+    # URLs, which requires a request context.
+    base_url = urlunsplit((
+        current_app.config.get('PREFERRED_URL_SCHEME', 'http'),
+        current_app.config['JSONSCHEMAS_HOST'],
+        current_app.config.get('APPLICATION_ROOT') or '', '', ''
+    ))
+    with current_app.test_request_context('/', base_url=base_url):
+        return _render(pid, hit, formats)
+
+
+def rendition_dumper(pid, record, metadata_prefix):
+    """OAI-PMH serializer returning the precomputed rendition of a record.
+
+    Records indexed before the renditions were enabled, or fetched from the
+    database as in GetRecord, are rendered on the fly.
+    """
+    source = record['_source']
+    if not isinstance(source, Record):
+        xml = source.get('_internal', {}).get(RENDITIONS_FIELD, {}).get(
+            metadata_prefix)
+        if xml:
+            return etree.fromstring(xml)
+    return _get_serializer(metadata_prefix)(pid, record)
+
+
+def put_renditions_mapping():
+    """Add the renditions field to the mapping of the records index.
+
+    New indices already have it. Without it existing indices would analyze
+    the stored XML as text.
+    """
+    mapping = {'properties': {'_internal': {'properties': {
+        RENDITIONS_FIELD: {'type': 'object', 'enabled': False},
+    }}}}
+    index = build_alias_name(current_app.config['OAISERVER_RECORD_INDEX'])
+    if ES_VERSION[0] >= 7:
+        current_search_client.indices.put_mapping(index=index, body=mapping)
+    else:
+        current_search_client.indices.put_mapping(index=index,
+                                                  doc_type='record',
+                                                  body=mapping)
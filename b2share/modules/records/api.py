@@ -23,7 +23,11 @@
 
 """B2Share Record API."""
 
+import threading
+from contextlib import contextmanager
+
 from elasticsearch.exceptions import NotFoundError
+from flask import current_app
 from invenio_db import db
 from invenio_pidstore.resolver import Resolver
 from invenio_pidstore.models import PersistentIdentifier, PIDStatus
@@ -35,9 +39,65 @@ from invenio_pidrelations.contrib.versioning import PIDNodeVersioning
 from invenio_records_files.api import Record, FilesIterator, FileObject
 from invenio_records_files.utils import sorted_files_from_bucket
 from invenio_files_rest.models import Bucket, ObjectVersion, FileInstance
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
 
 from .fetchers import b2share_record_uuid_fetcher
 
+
+_validation_cache = threading.local()
+
+
+@contextmanager
+def cached_validation():
+    """Reuse the JSON Schema validators between record validations.
+
+    By default every validation resolves the record's ``$schema`` again, which
+    queries the community and block schemas. Within this context the
+    validators, and the schemas they resolved, are kept for each ``$schema``.
+    Schema versions are immutable, thus this is only a problem if new schema
+    versions are created in the meantime.
+    """
+    previous = getattr(_validation_cache, 'validators', None)
+    _validation_cache.validators = {}
+    try:
+        yield _validation_cache.validators
+    finally:
+        _validation_cache.validators = previous
+
+
+def get_validation_cache():
+    """Return the dict used by :func:`cached_validation`, or None."""
+    return getattr(_validation_cache, 'validators', None)
+
+
+def validate_with_cache(record, validator=None, format_checker=None):
+    """Validate a record like ``Record.validate`` but with a cached validator.
+
+    Returns:
+        bool: False if no :func:`cached_validation` context is active, in
+        which case the record is not validated.
+    """
+    cache = get_validation_cache()
+    if cache is None or record.get('$schema') is None:
+        return False
+    key = (record['$schema'], validator, format_checker)
+    cached_validator = cache.get(key)
+    if cached_validator is None:
+        schema = {'$ref': record['$schema']}
+        state = current_app.extensions['invenio-records']
+        cached_validator = (validator or validator_for(schema))(
+            schema,
+            resolver=state.ref_resolver_cls.from_schema(schema),
+            types=current_app.config.get('RECORDS_VALIDATION_TYPES', {}),
+            format_checker=format_checker,
+        )
+        cache[key] = cached_validator
+    error = best_match(cached_validator.iter_errors(record))
+    if error is not None:
+        raise error
+    return True
+
 class B2ShareFileObject(FileObject):
     """Wrapper for B2Share files."""
 
@@ -63,6 +123,11 @@ class B2ShareRecord(Record):
 
     file_cls = B2ShareFileObject
 
+    def validate(self, **kwargs):
+        """Validate the record, see :func:`cached_validation`."""
+        if not validate_with_cache(self, **kwargs):
+            super(B2ShareRecord, self).validate(**kwargs)
+
     @property
     def pid(self):
         """Return an instance of record PID."""
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2016 CERN.
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Consistency check between the database and the search indices.
+
+The audit makes two passes, thus the memory used does not depend on the number
+of records:
+
+1. the ``(id, revision)`` of the indexable records are read in id order, page
+   by page, and the indexed documents of each page are fetched by id,
+2. the ``(id, _version)`` of the documents of each index are scrolled in index
+   order and the records of each page are read from the database.
+
+Sorting the documents on ``_id`` would need its fielddata, which is
+deprecated.
+
+As records can be modified during the audit, divergences are checked again
+before being repaired.
+"""
+
+from __future__ import absolute_import, print_function
+
+from collections import namedtuple
+from itertools import islice
+
+from elasticsearch import VERSION as ES_VERSION
+from elasticsearch.helpers import scan
+from invenio_db import db
+from invenio_pidstore.models import PersistentIdentifier, PIDStatus
+from invenio_records.models import RecordMetadata
+from invenio_search import current_search_client
+from invenio_search.utils import build_alias_name
+
+from .indexing import DOC_TYPES, INDEXED_PID_TYPES, bulk_index_actions, \
+    indexed_record_ids_query, send_bulk
+
+MISSING = 'missing'
+"""The record is not indexed."""
+
+STALE = 'stale'
+"""The indexed document is not the current revision of the record."""
+
+ORPHAN = 'orphan'
+"""The document does not correspond to an indexable record of its index."""
+
+Divergence = namedtuple('Divergence', [
+    'kind', 'id', 'alias', 'revision', 'version'
+])
+"""Difference between a record and its indexed document."""
+
+
+def iter_db_revisions(chunk_size=1000):
+    """Iterate over ``(id, revision, alias)`` of indexable records by id."""
+    alias_of = {pid_type: alias
+                for alias, pid_type in INDEXED_PID_TYPES.items()}
+    last_id = None
+    while True:
+        query = db.session.query(
+            RecordMetadata.id, RecordMetadata.version_id,
+            PersistentIdentifier.pid_type,
+        ).join(
+            PersistentIdentifier,
+            PersistentIdentifier.object_uuid == RecordMetadata.id,
+        ).filter(
+            PersistentIdentifier.object_type == 'rec',
+            PersistentIdentifier.status == PIDStatus.REGISTERED,
+            PersistentIdentifier.pid_type.in_(alias_of.keys()),
+        )
+        if last_id is not None:
+            query = query.filter(RecordMetadata.id > last_id)
+        rows = query.order_by(RecordMetadata.id).limit(chunk_size).all()
+        if not rows:
+            return
+        for record_id, version_id, pid_type in rows:
+            # the indexer uses the revision id as external version
+            yield str(record_id), version_id - 1, alias_of[pid_type]
+        last_id = rows[-1][0]
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_index_versions(alias, chunk_size=1000, client=None):
+    """Iterate over ``(id, version, alias)`` of the documents of an index.
+
+    The documents are scrolled in index order.
+    """
+    client = client or current_search_client
+    for hit in scan(client, index=build_alias_name(alias), size=chunk_size,
+                    query={'query': {'match_all': {}}, 'version': True,
+                           '_source': False}):
+        yield hit['_id'], hit['_version'], alias
+
+
+def get_index_versions(alias, record_ids, client=None):
+    """Return the version of the indexed documents of the given records."""
+    client = client or current_search_client
+    hits = client.search(index=build_alias_name(alias), body={
+        'query': {'ids': {'values': record_ids}},
+        'size': len(record_ids),
+        '_source': False,
+        'version': True,
+    })['hits']['hits']
+    return dict((hit['_id'], hit['_version']) for hit in hits)
+
+
+def find_unindexed(chunk_size=1000, client=None):
+    """Find the indexable records which are not indexed or are stale.
+
+    :returns: iterator of :class:`Divergence`, in id order.
+    """
+    for chunk in _chunks(iter_db_revisions(chunk_size=chunk_size),
+                         chunk_size):
+        versions = {}
+        for alias in sorted(INDEXED_PID_TYPES):
+            ids = [record_id for record_id, _, a in chunk if a == alias]
+            if ids:
+                versions[alias] = get_index_versions(alias, ids,
+                                                     client=client)
+        for record_id, revision, alias in chunk:
+            version = versions[alias].get(record_id)
+            if version is None:
+                yield Divergence(MISSING, record_id, alias, revision, None)
+            elif version != revision:
+                yield Divergence(STALE, record_id, alias, revision, version)
+
+
+def find_orphans(chunk_size=1000, client=None):
+    """Find the documents which do not correspond to an indexable record.
+
+    A document of a record indexed in the wrong index is an orphan.
+
+    :returns: iterator of :class:`Divergence`, in index order.
+    """
+    for alias, pid_type in sorted(INDEXED_PID_TYPES.items()):
+        documents = iter_index_versions(alias, chunk_size=chunk_size,
+                                        client=client)
+        for chunk in _chunks(documents, chunk_size):
+            current = {str(row[0]) for row in indexed_record_ids_query(
+                [pid_type]).filter(PersistentIdentifier.object_uuid.in_(
+                    [record_id for record_id, _, _ in chunk]))}
+            for record_id, version, _ in chunk:
+                if record_id not in current:
+                    yield Divergence(ORPHAN, record_id, alias, None, version)
+
+
+def audit_index(chunk_size=1000, client=None):
+    """Compare the database with the records and deposits indices.
+
+    :returns: iterator of :class:`Divergence`, the missing and stale records
+        first, then the orphan documents.
+    """
+    for divergence in find_unindexed(chunk_size=chunk_size, client=client):
+        yield divergence
+    for divergence in find_orphans(chunk_size=chunk_size, client=client):
+        yield divergence
+
+
+def repair_divergences(divergences, client=None):
+    """Reindex or delete the documents of the given divergences.
+
+    Orphan documents are only deleted if their record is still not indexable
+    in their index.
+
+    Returns:
+        tuple: number of successful and failed actions.
+    """
+    client = client or current_search_client
+    to_index = [d.id for d in divergences if d.kind in (MISSING, STALE)]
+    indexed, errors = send_bulk(client, bulk_index_actions(to_index)) \
+        if to_index else (0, 0)
+
+    actions = []
+    for alias, pid_type in INDEXED_PID_TYPES.items():
+        orphans = [d.id for d in divergences
+                   if d.kind == ORPHAN and d.alias == alias]
+        if not orphans:
+            continue
+        current = {str(row[0]) for row in indexed_record_ids_query(
+            [pid_type]).filter(PersistentIdentifier.object_uuid.in_(orphans))}
+        for record_id in set(orphans) - current:
+            action = {'_op_type': 'delete', '_id': record_id,
+                      '_index': build_alias_name(alias)}
+            if ES_VERSION[0] < 7:
+                action['_type'] = DOC_TYPES[alias]
+            actions.append(action)
+    if actions:
+        deleted, failed = send_bulk(client, actions)
+        indexed += deleted
+        errors += failed
+    return indexed, errors
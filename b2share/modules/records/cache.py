@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2016 CERN.
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Cache of rendered published record responses.
+
+Only anonymous reads of open access publications are cached, as their
+representation does not depend on the user. Two kinds of entries are stored:
+
+* ``<prefix>:rev:<pid_value>`` gives the current revision of the record. It
+  is removed whenever the record is updated or deleted.
+* ``<prefix>:body:<pid_value>:<revision>:<mimetype>:<host>`` contains the
+  rendered response of one revision.
+
+The revision is removed when the record is updated. Once the transaction is
+committed the writer sets it to the committed revision, or to a tombstone for a
+deleted record, while requests only add it if it is missing. A request which
+read the previous revision cannot thus make it current again: if it stores the
+revision before the commit it is overwritten by the writer, after the commit it
+is ignored. A request can still cache the body of a previous revision, which
+is never returned as it is not the current revision.
+
+A request first reads the current revision. If it matches the request's
+``If-None-Match`` header a 304 response is returned, otherwise the rendered
+response is returned if it was cached. In both cases neither the database nor
+the serializers are used.
+"""
+
+from __future__ import absolute_import, print_function
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context, request
+from flask_login import current_user
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from b2share.modules.access.policies import allow_public_file_metadata
+
+from .utils import is_publication
+
+
+class LocalLRUCache(object):
+    """Size bounded, process local cache with entry expiration.
+
+    It implements the subset of the Flask-Caching interface used by
+    :class:`RecordResponseCache`.
+    """
+
+    def __init__(self, max_size=1000, default_timeout=60):
+        """Initialize the cache."""
+        self.max_size = max_size
+        self.default_timeout = default_timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value of a key or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        """Set the value of a key, evicting the least recently used one."""
+        if timeout is None:
+            timeout = self.default_timeout
+        with self._lock:
+            self._entries[key] = (time.time() + timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def add(self, key, value, timeout=None):
+        """Set the value of a key only if it is missing.
+
+        :returns: True if the value was set.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= time.time():
+                return False
+        self.set(key, value, timeout=timeout)
+        return True
+
+    def delete(self, key):
+        """Remove a key."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+DELETED_REVISION = 'deleted'
+"""Current revision of a deleted record."""
+
+
+class RecordResponseCache(object):
+    """Cache of rendered record responses."""
+
+    def __init__(self, backend, timeout, prefix='b2share_records_response'):
+        """Initialize the cache.
+
+        :param backend: cache with Flask-Caching's ``get``, ``set``, ``add``
+            and ``delete`` methods.
+        :param timeout: lifetime in seconds of the cache entries.
+        """
+        self.backend = backend
+        self.timeout = timeout
+        self.prefix = prefix
+
+    def _revision_key(self, pid_value):
+        return '{}:rev:{}'.format(self.prefix, pid_value)
+
+    def _body_key(self, pid_value, revision, mimetype):
+        return '{}:body:{}:{}:{}:{}'.format(self.prefix, pid_value, revision,
+                                            mimetype, request.host)
+
+    @staticmethod
+    def is_cacheable_request():
+        """Check if the current request can be served from the cache."""
+        return (request.method in ('GET', 'HEAD') and not request.args
+                and not current_user.is_authenticated)
+
+    @staticmethod
+    def is_cacheable_record(record):
+        """Check if the record's representation is the same for every user."""
+        return (is_publication(record.model) and
+                allow_public_file_metadata(record))
+
+    def get_response(self, pid_value, mimetype):
+        """Return the cached response of a record, or None.
+
+        The response is a 304 if the client already has the current revision.
+        """
+        revision = self.backend.get(self._revision_key(pid_value))
+        if revision is None or revision == DELETED_REVISION:
+            return None
+        etag = str(revision)
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+        cached = self.backend.get(self._body_key(pid_value, revision,
+                                                 mimetype))
+        if cached is None:
+            return None
+        body, headers = cached
+        return current_app.response_class(body, status=200, headers=headers)
+
+    def set_response(self, pid_value, record, mimetype, response):
+        """Store the rendered response of a record."""
+        if response.status_code != 200 or response.direct_passthrough:
+            return
+        revision = record.revision_id
+        headers = [(k, v) for k, v in response.headers
+                   if k.lower() not in ('set-cookie', 'content-length')]
+        self.backend.set(self._body_key(pid_value, revision, mimetype),
+                         (response.get_data(), headers),
+                         timeout=self.timeout)
+        # the writer of a newer revision may have set it in the meantime
+        self.backend.add(self._revision_key(pid_value), revision,
+                         timeout=self.timeout)
+
+    def invalidate(self, pid_value):
+        """Forget the current revision of a record."""
+        self.backend.delete(self._revision_key(pid_value))
+
+    def set_revision(self, pid_value, revision):
+        """Set the committed revision of a record.
+
+        :param revision: the revision or :data:`DELETED_REVISION`.
+        """
+        self.backend.set(self._revision_key(pid_value), revision,
+                         timeout=self.timeout)
+
+
+def create_response_cache(app):
+    """Create the response cache configured for the application.
+
+    Returns None if ``B2SHARE_RECORDS_RESPONSE_CACHE`` is not set.
+    """
+    backend_name = app.config.get('B2SHARE_RECORDS_RESPONSE_CACHE')
+    if not backend_name:
+        return None
+    timeout = app.config['B2SHARE_RECORDS_RESPONSE_CACHE_TIMEOUT']
+    if backend_name == 'local':
+        backend = LocalLRUCache(
+            max_size=app.config['B2SHARE_RECORDS_RESPONSE_CACHE_SIZE'],
+            default_timeout=timeout)
+    elif backend_name == 'redis':
+        from invenio_cache import current_cache
+        backend = current_cache
+    else:
+        raise ValueError(
+            'Invalid B2SHARE_RECORDS_RESPONSE_CACHE: {}'.format(backend_name))
+    return RecordResponseCache(backend, timeout)
+
+
+_PENDING_INVALIDATIONS = 'b2share_records_response_invalidations'
+_COMMITTED_REVISIONS = 'b2share_records_response_revisions'
+
+
+def invalidate_record_response_trigger(sender, *args, **kwargs):
+    """Invalidate the cached responses of an updated or deleted record.
+
+    The committed revision is set after the commit, see
+    :func:`invalidate_committed_responses`.
+    """
+    response_cache = get_response_cache()
+    record = kwargs['record']
+    if response_cache is None or not is_publication(record.model):
+        return
+    pid_value = record.get('_deposit', {}).get('id')
+    if pid_value:
+        response_cache.invalidate(pid_value)
+        session = Session.object_session(record.model)
+        if session is not None:
+            session.info.setdefault(_PENDING_INVALIDATIONS, {})[
+                pid_value] = record.model
+
+
+def _committed_revision(model):
+    """Return the revision of a flushed record model."""
+    state = inspect(model)
+    if state.deleted or state.detached or model.json is None:
+        return DELETED_REVISION
+    return model.version_id - 1
+
+
+@event.listens_for(Session, 'before_commit')
+def prepare_committed_revisions(session):
+    """Read the revisions of the updated records before they are committed.
+
+    The session cannot query the database anymore once committed.
+    """
+    models = session.info.get(_PENDING_INVALIDATIONS)
+    if not models or session.transaction.nested:
+        return
+    session.flush()
+    session.info[_COMMITTED_REVISIONS] = dict(
+        (pid_value, _committed_revision(model))
+        for pid_value, model in models.items())
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed_responses(session):
+    """Set the current revision of the records updated by a transaction.
+
+    The invalidations of a rolled back transaction are kept for the next
+    commit, invalidating a response too often is harmless.
+    """
+    if session.transaction.nested:
+        # only the savepoint is released
+        return
+    session.info.pop(_PENDING_INVALIDATIONS, None)
+    revisions = session.info.pop(_COMMITTED_REVISIONS, None)
+    if not revisions or not has_app_context():
+        return
+    response_cache = get_response_cache()
+    if response_cache is not None:
+        for pid_value, revision in revisions.items():
+            response_cache.set_revision(pid_value, revision)
+
+
+def get_response_cache():
+    """Return the :class:`RecordResponseCache`, None if it is disabled.
+
+    The cache is also disabled in the applications without the records
+    extension, like the UI application.
+    """
+    ext = current_app.extensions.get('b2share-records')
+    return getattr(ext, 'response_cache', None)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2016 CERN.
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Change feed of the published records.
+
+Publications are listed in ``(updated, id)`` order of their
+``records_metadata`` row, which is indexed. Every modification of a record
+updates this row, thus a client can synchronize itself by reading the feed
+from the cursor returned by its previous call.
+
+Deleting a publication keeps its row, with a NULL ``json``, and marks its PID
+as deleted. Such records are listed as tombstones.
+
+The ``updated`` timestamp is set when the row is flushed, which can be long
+before the transaction commits, for example in the batches of the ingestion or
+of the upgrade. A row committed after a client read the feed would then appear
+before its cursor and never be listed. The rows flushed by a transaction are
+thus updated again right before it commits, see
+:func:`touch_committed_records`. Only the rows committed during the last
+``B2SHARE_RECORDS_CHANGES_DELAY`` seconds can still be committed in a
+different order, thus they are not listed yet.
+"""
+
+from __future__ import absolute_import, print_function
+
+import binascii
+import copy
+import uuid
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timedelta
+
+import pytz
+from invenio_db import db
+from invenio_pidstore.models import PersistentIdentifier, PIDStatus
+from invenio_records.models import RecordMetadata
+from invenio_records_files.models import RecordsBuckets
+from sqlalchemy import event, tuple_
+from sqlalchemy.orm import Session
+
+from b2share.modules.access.policies import allow_public_file_metadata
+
+from .errors import InvalidChangesCursorError
+from .providers import RecordUUIDProvider
+
+CURSOR_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+_FLUSHED_RECORDS = 'b2share_records_changes_flushed'
+
+
+@event.listens_for(Session, 'after_flush')
+def collect_flushed_records(session, flush_context):
+    """Remember the records modified by a transaction."""
+    ids = set(obj.id for obj in session.new.union(session.dirty)
+              if isinstance(obj, RecordMetadata))
+    if ids:
+        session.info.setdefault(_FLUSHED_RECORDS, set()).update(ids)
+
+
+@event.listens_for(Session, 'before_commit')
+def touch_committed_records(session):
+    """Set the ``updated`` timestamp of the modified records to now.
+
+    The remaining delay until the commit is the time of a single update.
+    """
+    if session.transaction.nested:
+        return
+    session.flush()
+    ids = session.info.pop(_FLUSHED_RECORDS, None)
+    if ids:
+        table = RecordMetadata.__table__
+        session.execute(table.update().where(table.c.id.in_(ids)).values(
+            updated=datetime.utcnow()))
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_flushed_records(session):
+    """Forget the records of a rolled back transaction."""
+    if not session.transaction or not session.transaction.nested:
+        session.info.pop(_FLUSHED_RECORDS, None)
+
+
+def encode_cursor(updated, record_id):
+    """Create the opaque cursor pointing after the given row."""
+    value = '{}/{}'.format(updated.strftime(CURSOR_DATE_FORMAT),
+                           record_id.hex)
+    return urlsafe_b64encode(value.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Return the ``(updated, id)`` key encoded in a cursor.
+
+    :raises InvalidChangesCursorError: if the cursor is malformed.
+    """
+    try:
+        value = urlsafe_b64decode(cursor.encode('ascii')).decode('ascii')
+        updated, record_id = value.split('/')
+        return (datetime.strptime(updated, CURSOR_DATE_FORMAT),
+                uuid.UUID(record_id))
+    except (ValueError, binascii.Error, UnicodeError):
+        raise InvalidChangesCursorError()
+
+
+def list_changes(after=None, size=100, delay=0):
+    """List the next modified or deleted publications.
+
+    :param after: ``(updated, id)`` key after which rows are listed.
+    :param size: maximum number of rows.
+    :param delay: age in seconds under which rows are not listed.
+    :returns: list of ``(PersistentIdentifier, RecordMetadata)`` in feed
+        order.
+    """
+    query = db.session.query(PersistentIdentifier, RecordMetadata).join(
+        RecordMetadata,
+        RecordMetadata.id == PersistentIdentifier.object_uuid,
+    ).filter(
+        PersistentIdentifier.pid_type == RecordUUIDProvider.pid_type,
+        PersistentIdentifier.object_type == 'rec',
+        PersistentIdentifier.status.in_([PIDStatus.REGISTERED,
+                                         PIDStatus.DELETED]),
+        RecordMetadata.updated < datetime.utcnow() - timedelta(
+            seconds=delay),
+    )
+    if after is not None:
+        query = query.filter(
+            tuple_(RecordMetadata.updated, RecordMetadata.id) > tuple_(*after)
+        )
+    return query.order_by(
+        RecordMetadata.updated, RecordMetadata.id
+    ).limit(size).all()
+
+
+def serialize_changes(changes, serializer, links_factory=None):
+    """Serialize changes returned by :func:`list_changes`.
+
+    Publications are serialized as search hits, i.e. the same way as in the
+    records search results.
+    """
+    record_ids = [model.id for _, model in changes if model.json is not None]
+    buckets = dict(db.session.query(
+        RecordsBuckets.record_id, RecordsBuckets.bucket_id
+    ).filter(RecordsBuckets.record_id.in_(record_ids))) if record_ids else {}
+
+    result = []
+    for pid, model in changes:
+        change = dict(
+            id=pid.pid_value,
+            updated=pytz.utc.localize(model.updated).isoformat(),
+            deleted=model.json is None or pid.status == PIDStatus.DELETED,
+        )
+        if not change['deleted']:
+            # same transformation as the indexer receiver
+            source = copy.deepcopy(model.json)
+            external_pids = source['_deposit'].pop('external_pids', None)
+            if external_pids and allow_public_file_metadata(source):
+                source['external_pids'] = external_pids
+            source['_created'] = pytz.utc.localize(model.created).isoformat()
+            source['_updated'] = change['updated']
+            source['_internal'] = {}
+            if model.id in buckets:
+                source['_internal']['files_bucket_id'] = \
+                    str(buckets[model.id])
+            change['record'] = serializer.transform_search_hit(
+                pid, dict(_id=str(model.id), _version=model.version_id - 1,
+                          _source=source),
+                links_factory=links_factory,
+            )
+        result.append(change)
+    return result
@@ -26,20 +26,35 @@
 
 from __future__ import absolute_import, print_function
 
+import os
+import time
+from datetime import datetime
+
 import click
+from flask import current_app
 from flask.cli import with_appcontext
 import requests
 
+from invenio_accounts.models import User
 from invenio_db import db
 from invenio_pidstore.models import PIDStatus
 from invenio_pidstore.providers.datacite import DataCiteProvider
 from invenio_records_files.api import Record
+from invenio_search import current_search_client
+from invenio_search.cli import index
+
+from b2share.modules.files.ingest import COPY, LINK_MODES
 
 from .serializers import datacite_v31
 from .providers import RecordUUIDProvider
 from .minters import make_record_url, b2share_pid_minter
 from .tasks import update_expired_embargoes as update_expired_embargoes_task
 from .utils import list_db_published_records
+from .audit import MISSING, ORPHAN, STALE, audit_index, \
+    repair_divergences
+from .indexing import CATCH_UP_MARGIN, INDEXED_PID_TYPES, IndexRebuild, \
+    reindex_records, select_record_ids
+from .ingest import IngestionErrors, ingest_records
 
 
 @click.group()
@@ -47,6 +62,168 @@ def b2records():
     """B2SHARE Records commands."""
 
 
+@index.command()
+@click.option('-a', '--alias', 'aliases', multiple=True,
+              type=click.Choice(sorted(INDEXED_PID_TYPES)),
+              default=sorted(INDEXED_PID_TYPES), show_default=True,
+              help='Index alias to rebuild. Can be repeated.')
+@click.option('-w', '--workers', default=os.cpu_count() or 1,
+              show_default=True,
+              help='Number of indexing processes of a new rebuild.')
+@click.option('-c', '--chunk-size', default=500, show_default=True,
+              help='Number of records per bulk request.')
+@click.option('--state-file', type=click.Path(dir_okay=False),
+              help='Rebuild state file. Defaults to index-rebuild.json in '
+                   'the instance folder.')
+@click.option('--restart', is_flag=True, default=False,
+              help='Drop the state and indices of an interrupted rebuild.')
+@click.option('--force', is_flag=True, default=False,
+              help='Swap the aliases even if document counts differ.')
+@click.option('--delete-old', is_flag=True, default=False,
+              help='Delete the previous indices after the swap.')
+@with_appcontext
+def rebuild(aliases, workers, chunk_size, state_file, restart, force,
+            delete_old):
+    """Rebuild the records indices without interrupting searches.
+
+    New indices are filled in parallel next to the current ones, then the
+    aliases are swapped. An interrupted rebuild resumes when the command is
+    run again.
+    """
+    state_file = state_file or os.path.join(current_app.instance_path,
+                                            'index-rebuild.json')
+    index_rebuild = IndexRebuild.load(state_file)
+    if index_rebuild and restart:
+        index_rebuild.abort()
+        index_rebuild = None
+    if index_rebuild:
+        click.secho('Resuming the rebuild started at {}'.format(
+            index_rebuild.started), fg='yellow')
+    else:
+        index_rebuild = IndexRebuild.start(state_file, aliases, workers)
+    for alias, new_index in index_rebuild.new_indices.items():
+        click.secho('{} -> {}'.format(alias, new_index))
+
+    partitions = index_rebuild.state['partitions']
+    total = sum(index_rebuild.count_records().values())
+    done = sum(p['indexed'] + p['errors'] for p in partitions)
+    start_time = time.time()
+    with click.progressbar(length=total, label='Indexing') as bar:
+        bar.update(done)
+        try:
+            index_rebuild.run(chunk_size=chunk_size, on_progress=bar.update)
+        except RuntimeError as e:
+            raise click.ClickException(
+                '{}. Run the command again to resume.'.format(e))
+    elapsed = time.time() - start_time
+    processed = sum(p['indexed'] + p['errors'] for p in partitions) - done
+    click.secho('{} records in {:.0f}s ({:.0f} docs/s), {} errors'.format(
+        processed, elapsed, processed / elapsed if elapsed else 0,
+        sum(p['errors'] for p in partitions)))
+
+    index_rebuild.finalize_settings()
+    caught_up = index_rebuild.catch_up(
+        index_rebuild.started - CATCH_UP_MARGIN, chunk_size=chunk_size)
+    mismatch = False
+    for alias, (expected, indexed) in index_rebuild.verify().items():
+        color = 'green' if expected == indexed else 'red'
+        mismatch = mismatch or expected != indexed
+        click.secho('{}: {} records, {} documents'.format(
+            alias, expected, indexed), fg=color)
+    if mismatch and not force:
+        raise click.ClickException(
+            'Document counts differ, the aliases were not swapped. Run the '
+            'command again with --force to swap them anyway.')
+
+    old_indices = index_rebuild.swap()
+    # index what was modified between the first catch up and the swap
+    index_rebuild.catch_up(caught_up - CATCH_UP_MARGIN,
+                           chunk_size=chunk_size)
+    click.secho('Aliases swapped', fg='green')
+    for old_index in old_indices:
+        if delete_old:
+            current_search_client.indices.delete(index=old_index)
+            click.secho('Deleted {}'.format(old_index))
+        else:
+            click.secho('Previous index {} is kept'.format(old_index))
+    os.remove(state_file)
+
+
+@b2records.command()
+@with_appcontext
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--owner', required=True,
+              help='Email of the user owning the ingested records.')
+@click.option('-b', '--batch-size', default=100, show_default=True,
+              help='Number of records committed together.')
+@click.option('-e', '--errors', 'errors_file', type=click.File('a'),
+              default='ingest-errors.jsonl', show_default=True,
+              help='File receiving one JSON line per failed record.')
+@click.option('--link-mode', type=click.Choice(LINK_MODES), default=COPY,
+              show_default=True,
+              help='Reflink or hard link the record files into the storage '
+                   'when they are on the same file system.')
+@click.option('--publish/--no-publish', default=True, show_default=True,
+              help='Publish the records or keep them as drafts.')
+@click.option('-c', '--concurrency', default=1, show_default=True,
+              help='Number of indexing processes.')
+def ingest(directory, owner, batch_size, errors_file, link_mode, publish,
+           concurrency):
+    """Ingest the JSON records of a directory.
+
+    Each JSON file contains the metadata of one record, as for the records
+    REST API. The files of a record are imported from the directory having the
+    same name as its JSON file, if it exists. The records of each batch are
+    indexed once the batch is committed.
+    """
+    user = User.query.filter(User.email == owner).one_or_none()
+    if user is None:
+        raise click.BadParameter('User {} does not exist.'.format(owner),
+                                 param_hint='--owner')
+    errors = IngestionErrors(errors_file)
+    start_time = time.time()
+    # the records committed by this run are updated after this date
+    start_date = datetime.utcnow().replace(microsecond=0)
+    reindex_hint = ('Reindex the ingested records with: b2records reindex '
+                    '--drafts --updated-from {}').format(
+                        start_date.isoformat())
+    index_counts = dict(indexed=0, errors=0)
+
+    def index(record_ids):
+        for indexed, index_errors in reindex_records(
+                record_ids, concurrency=concurrency):
+            index_counts['indexed'] += indexed
+            index_counts['errors'] += index_errors
+
+    def progress(ingested):
+        elapsed = time.time() - start_time
+        click.secho('{} records ingested, {} failed ({:.0f} records/min)'
+                    .format(ingested, errors.count,
+                            60 * ingested / elapsed if elapsed else 0))
+
+    try:
+        ingested = ingest_records(
+            directory, user, errors, batch_size=batch_size,
+            link_mode=link_mode, publish=publish, index_callback=index,
+            progress_callback=progress)
+    except Exception:
+        click.secho('The ingestion failed, the records of the last committed '
+                    'batch may not be indexed. ' + reindex_hint, fg='red')
+        raise
+    elapsed = time.time() - start_time
+    click.secho('{} records ingested in {:.1f}s'.format(ingested, elapsed),
+                fg='green')
+    if errors.count:
+        click.secho('{} records failed, see {}'.format(
+            errors.count, errors_file.name), fg='red')
+
+    click.secho('{} documents indexed'.format(index_counts['indexed']),
+                fg='green')
+    if index_counts['errors']:
+        click.secho('{} documents could not be indexed. {}'.format(
+            index_counts['errors'], reindex_hint), fg='red')
+
+
 @b2records.command()
 @with_appcontext
 def update_expired_embargoes():
@@ -55,6 +232,102 @@ def update_expired_embargoes():
     click.secho('Expiring embargoes...', fg='green')
 
 
+@b2records.command()
+@with_appcontext
+@click.option('--records/--no-records', default=True, show_default=True,
+              help='Reindex published records.')
+@click.option('--drafts/--no-drafts', default=False, show_default=True,
+              help='Reindex drafts.')
+@click.option('--community', type=click.UUID,
+              help='Only reindex the records of this community.')
+@click.option('--state', 'publication_state',
+              type=click.Choice(['draft', 'submitted', 'published']),
+              help='Only reindex the records in this publication state.')
+@click.option('--created-from', type=click.DateTime(),
+              help='Only reindex records created at or after this date.')
+@click.option('--created-to', type=click.DateTime(),
+              help='Only reindex records created before this date.')
+@click.option('--updated-from', type=click.DateTime(),
+              help='Only reindex records modified at or after this date.')
+@click.option('--updated-to', type=click.DateTime(),
+              help='Only reindex records modified before this date.')
+@click.option('--pid-file', type=click.File('r'),
+              help='File containing one record or draft id per line.')
+@click.option('-c', '--concurrency', default=1, show_default=True,
+              help='Number of indexing processes.')
+@click.option('--chunk-size', default=500, show_default=True,
+              help='Number of records per bulk request.')
+@click.option('--dry-run', is_flag=True, default=False,
+              help='Only count the selected records.')
+def reindex(records, drafts, community, publication_state, created_from,
+            created_to, updated_from, updated_to, pid_file, concurrency,
+            chunk_size, dry_run):
+    """Reindex the records matching the given filters."""
+    pid_values = None
+    if pid_file:
+        pid_values = [line.strip() for line in pid_file if line.strip()]
+    record_ids = [row[0] for row in select_record_ids(
+        records=records, drafts=drafts, community=community,
+        publication_state=publication_state,
+        created_from=created_from, created_to=created_to,
+        updated_from=updated_from, updated_to=updated_to,
+        pid_values=pid_values,
+    )]
+    click.secho('{} records selected'.format(len(record_ids)))
+    if dry_run or not record_ids:
+        return
+
+    indexed = errors = 0
+    start_time = time.time()
+    with click.progressbar(length=len(record_ids), label='Indexing') as bar:
+        for chunk_indexed, chunk_errors in reindex_records(
+                record_ids, concurrency=concurrency, chunk_size=chunk_size):
+            indexed += chunk_indexed
+            errors += chunk_errors
+            bar.update(chunk_indexed + chunk_errors)
+    elapsed = time.time() - start_time
+    click.secho('{} records indexed in {:.1f}s ({:.0f} docs/s)'.format(
+        indexed, elapsed, indexed / elapsed if elapsed else 0),
+        fg='green')
+    if errors:
+        click.secho('{} records failed'.format(errors), fg='red')
+
+
+@b2records.command()
+@with_appcontext
+@click.option('--repair', is_flag=True, default=False,
+              help='Reindex missing and stale records, delete orphan '
+                   'documents.')
+@click.option('--chunk-size', default=1000, show_default=True,
+              help='Page size of the database and index reads.')
+@click.option('-o', '--output', type=click.File('w'), default='-',
+              help='File receiving one line per divergence.')
+def audit(repair, chunk_size, output):
+    """Compare the database with the records and deposits indices."""
+    counts = {kind: 0 for kind in (MISSING, STALE, ORPHAN)}
+    repaired = failed = 0
+    batch = []
+    for divergence in audit_index(chunk_size=chunk_size):
+        counts[divergence.kind] += 1
+        output.write('{0.kind} {0.alias} {0.id} revision={0.revision} '
+                     'version={0.version}\n'.format(divergence))
+        if repair:
+            batch.append(divergence)
+            if len(batch) >= chunk_size:
+                done, errors = repair_divergences(batch)
+                repaired, failed, batch = repaired + done, failed + errors, []
+    if batch:
+        done, errors = repair_divergences(batch)
+        repaired, failed = repaired + done, failed + errors
+    click.secho(', '.join('{} {}'.format(count, kind)
+                          for kind, count in counts.items()),
+                fg='green' if not any(counts.values()) else 'yellow',
+                err=True)
+    if repair:
+        click.secho('{} documents repaired, {} failed'.format(
+            repaired, failed), fg='red' if failed else 'green', err=True)
+
+
 @b2records.command()
 @with_appcontext
 @click.option('-u', '--update', is_flag=True, default=False,
@@ -101,6 +101,54 @@ PIDSTORE_RECID_FIELD = 'id'
 B2SHARE_ENDPOINTS_ENABLED = True
 """Enable/disable automatic endpoint registration."""
 
+B2SHARE_RECORDS_RESPONSE_CACHE = None
+"""Cache of anonymous GET /api/records/<id> responses of open access records.
+
+Either None (disabled), ``'local'`` for a per process LRU cache or ``'redis'``
+for the shared application cache. The local cache is only invalidated in the
+process which modified the record, so keep its timeout short.
+"""
+
+B2SHARE_RECORDS_RESPONSE_CACHE_TIMEOUT = 60
+"""Lifetime in seconds of the cached record responses."""
+
+B2SHARE_RECORDS_RESPONSE_CACHE_SIZE = 10000
+"""Maximum number of entries of the local response cache."""
+
+B2SHARE_RECORDS_CHANGES_PAGE_SIZE = 100
+"""Default number of changes returned by /api/records/_changes."""
+
+B2SHARE_RECORDS_CHANGES_MAX_PAGE_SIZE = 1000
+"""Maximum number of changes returned by /api/records/_changes."""
+
+B2SHARE_RECORDS_CHANGES_DELAY = 10
+"""Age in seconds under which changes are not yet listed in the feed.
+
+The ``updated`` timestamp of the modified records is set right before their
+transaction commits, whatever its duration. The delay has to cover the time
+between this update and the commit, and the clock differences between the
+hosts, so that a change is never listed after a cursor which is already past
+it.
+"""
+
+B2SHARE_RECORDS_FILES_SUMMARY_SIZE = None
+"""Maximum number of files listed in the JSON of a record or draft.
+
+The records having more files only list the first ones, with a
+``files_summary`` giving the number and the total size of their files. All
+the files are listed page by page by ``<record>/files_list``. None always
+lists all the files.
+
+The web UI lists and edits the files of the record JSON, it does not read
+``files_list``. Only set a limit for the API clients reading it.
+"""
+
+B2SHARE_RECORDS_FILES_PAGE_SIZE = 100
+"""Default number of files returned by ``<record>/files_list``."""
+
+B2SHARE_RECORDS_FILES_MAX_PAGE_SIZE = 1000
+"""Maximum number of files returned by ``<record>/files_list``."""
+
 
 RECORDS_REST_FACETS = dict(
     records=dict(
@@ -65,6 +65,12 @@ class InvalidOperationError(RESTException):
     description = 'Invalid Operation.'
 
 
+class InvalidChangesCursorError(RESTException):
+    """Raise when the cursor of the records change feed is invalid."""
+    code = 400
+    description = 'Invalid change feed cursor.'
+
+
 class GenericError(object):
     """Represents a generic error described by a simple message.
 
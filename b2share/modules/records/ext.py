@@ -32,7 +32,7 @@ from __future__ import absolute_import, print_function
 from invenio_files_rest.signals import file_deleted, file_uploaded
 from invenio_indexer.signals import before_record_index
 
-from . import config, indexer
+from . import config, indexer, models
 from . tasks import update_record_files_async
 from . triggers import register_triggers
 from . errors import register_error_handlers
@@ -44,6 +44,7 @@ from invenio_records_rest import utils
 from .views import create_blueprint
 from .indexer import indexer_receiver
 from .cli import b2records
+from .cache import create_response_cache
 
 
 class B2ShareRecords(object):
@@ -64,6 +65,7 @@ class B2ShareRecords(object):
         """Flask application initialization."""
         self.init_config(app)
         app.extensions['b2share-records'] = self
+        self.response_cache = create_response_cache(app)
         self._register_signals(app)
         app.cli.add_command(b2records)
         register_triggers(app)
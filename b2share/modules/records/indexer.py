@@ -92,5 +92,12 @@ def indexer_receiver(sender, json=None, record=None, index=None,
         if record_buckets:
             json['_internal']['files_bucket_id'] = \
                 str(record_buckets[0].bucket_id)
+
+        # render the OAI-PMH metadata once instead of at each harvest
+        from b2share.modules.oaiserver.renditions import RENDITIONS_FIELD, \
+            render_renditions
+        renditions = render_renditions(record, json)
+        if renditions:
+            json['_internal'][RENDITIONS_FIELD] = renditions
     except Exception:
         raise
@@ -0,0 +1,568 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2016 CERN.
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Bulk indexing of records outside of the indexing queue.
+
+:func:`deferred_indexing` postpones the indexing done when records are created
+or modified, so that bulk imports can index all their records at the end.
+
+:func:`select_record_ids` and :func:`reindex_records` reindex a subset of the
+records in place, for example after fixing the schema of one community.
+
+:class:`IndexRebuild` builds new versions of the ``records`` and ``deposits``
+indices while the current ones are still used:
+
+1. New indices are created with the current mappings. Replicas and refresh
+   are disabled while they are filled.
+2. The record UUID space is split in partitions, each one indexed by its own
+   process. The last indexed UUID of each partition is saved in a state file,
+   thus an interrupted rebuild resumes where it stopped.
+3. The records modified since the rebuild started are indexed again, the
+   number of documents is checked and the aliases are moved atomically to the
+   new indices.
+"""
+
+from __future__ import absolute_import, print_function
+
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from queue import Empty
+
+from elasticsearch import VERSION as ES_VERSION, Elasticsearch
+from elasticsearch.helpers import bulk, expand_action
+from flask import current_app
+from invenio_db import db
+from invenio_indexer.api import RecordIndexer
+from invenio_indexer.utils import _es7_expand_action
+from invenio_pidstore.models import PersistentIdentifier, PIDStatus
+from invenio_records.models import RecordMetadata
+from invenio_search import current_search, current_search_client
+from invenio_search.utils import build_alias_name, build_index_name
+
+from .utils import is_deposit
+
+INDEXED_PID_TYPES = {
+    'records': 'b2rec',
+    'deposits': 'b2dep',
+}
+"""PID type of the records of each index alias."""
+
+DOC_TYPES = {
+    'records': 'record',
+    'deposits': 'deposit',
+}
+"""Document type of each index alias, for Elasticsearch < 7."""
+
+CATCH_UP_MARGIN = timedelta(seconds=60)
+"""Margin taken before catch up dates for in-flight transactions."""
+
+_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+_deferred = threading.local()
+
+
+@contextmanager
+def deferred_indexing():
+    """Collect the ids of the records to index instead of indexing them.
+
+    Within this context :class:`DeferrableRecordIndexer` only adds the ids of
+    the records it should index to the yielded set. The caller is responsible
+    for indexing them once they are committed, for example with
+    :func:`reindex_records`. Deletions are not deferred.
+    """
+    previous = getattr(_deferred, 'record_ids', None)
+    _deferred.record_ids = set()
+    try:
+        yield _deferred.record_ids
+    finally:
+        _deferred.record_ids = previous
+
+
+def _defer(record_id):
+    record_ids = getattr(_deferred, 'record_ids', None)
+    if record_ids is None:
+        return False
+    record_ids.add(str(record_id))
+    return True
+
+
+class DeferrableRecordIndexer(RecordIndexer):
+    """Record indexer which can be postponed with :func:`deferred_indexing`."""
+
+    def index(self, record, arguments=None, **kwargs):
+        """Index a record, or defer it."""
+        if _defer(record.id):
+            return None
+        return super(DeferrableRecordIndexer, self).index(
+            record, arguments=arguments, **kwargs)
+
+    def index_by_id(self, record_uuid, **kwargs):
+        """Index a record by id, or defer it."""
+        if _defer(record_uuid):
+            return None
+        return super(DeferrableRecordIndexer, self).index_by_id(
+            record_uuid, **kwargs)
+
+
+def create_search_client():
+    """Create a new Elasticsearch client.
+
+    Forked processes cannot share the connections of their parent.
+    """
+    config = current_app.config
+    client_config = dict(config.get('SEARCH_CLIENT_CONFIG') or {})
+    client_config.setdefault('hosts', config.get('SEARCH_ELASTIC_HOSTS'))
+    return Elasticsearch(**client_config)
+
+
+def bulk_index_actions(record_ids, indices=None):
+    """Generate the bulk actions indexing the given records.
+
+    :param record_ids: UUIDs of the records.
+    :param indices: physical index of each alias. Defaults to the aliases.
+    """
+    indexer = RecordIndexer()
+    models = RecordMetadata.query.filter(RecordMetadata.id.in_(record_ids))
+    for model in models:
+        if model.json is None:
+            continue
+        alias = 'deposits' if is_deposit(model) else 'records'
+        record = indexer.record_cls(model.json, model=model)
+        body = indexer._prepare_record(record, alias, DOC_TYPES[alias])
+        action = {
+            '_op_type': 'index',
+            '_index': (indices or {}).get(alias, build_alias_name(alias)),
+            '_id': str(model.id),
+            '_version': record.revision_id,
+            '_version_type': 'external_gte',
+            '_source': body,
+        }
+        if ES_VERSION[0] < 7:
+            action['_type'] = DOC_TYPES[alias]
+        yield action
+
+
+def send_bulk(client, actions, chunk_size=500):
+    """Send bulk actions to Elasticsearch.
+
+    Returns:
+        tuple: number of successful and failed actions.
+    """
+    return bulk(
+        client, actions, chunk_size=chunk_size, stats_only=True,
+        raise_on_error=False, raise_on_exception=True,
+        request_timeout=current_app.config['INDEXER_BULK_REQUEST_TIMEOUT'],
+        expand_action_callback=(
+            _es7_expand_action if ES_VERSION[0] >= 7 else expand_action
+        ),
+    )
+
+
+def indexed_record_ids_query(pid_types):
+    """Query the UUIDs of the records which should be indexed."""
+    return db.session.query(
+        PersistentIdentifier.object_uuid
+    ).filter(
+        PersistentIdentifier.object_type == 'rec',
+        PersistentIdentifier.status == PIDStatus.REGISTERED,
+        PersistentIdentifier.pid_type.in_(pid_types),
+    ).distinct()
+
+
+def iter_record_id_chunks(pid_types, start=None, end=None, chunk_size=500):
+    """Iterate by chunks over the UUIDs of the indexable records.
+
+    UUIDs are returned in increasing order, paginated on the UUID itself.
+
+    :param start: exclusive lower bound.
+    :param end: inclusive upper bound.
+    """
+    while True:
+        query = indexed_record_ids_query(pid_types)
+        if start is not None:
+            query = query.filter(PersistentIdentifier.object_uuid > start)
+        if end is not None:
+            query = query.filter(PersistentIdentifier.object_uuid <= end)
+        chunk = [row[0] for row in query.order_by(
+            PersistentIdentifier.object_uuid).limit(chunk_size)]
+        if not chunk:
+            return
+        yield chunk
+        start = chunk[-1]
+
+
+def select_record_ids(records=True, drafts=False, community=None,
+                      publication_state=None, created_from=None,
+                      created_to=None, updated_from=None, updated_to=None,
+                      pid_values=None):
+    """Select with a single query the UUIDs of the records to reindex.
+
+    :param records: select published records.
+    :param drafts: select drafts.
+    :param community: community id.
+    :param publication_state: publication state, i.e. ``draft``,
+        ``submitted`` or ``published``.
+    :param pid_values: values of the record or draft PIDs. Both share the
+        same value.
+    :returns: a query returning one UUID per row.
+    """
+    pid_types = [pid_type for alias, pid_type in INDEXED_PID_TYPES.items()
+                 if (alias == 'records' and records) or
+                 (alias == 'deposits' and drafts)]
+    query = db.session.query(RecordMetadata.id).join(
+        PersistentIdentifier,
+        PersistentIdentifier.object_uuid == RecordMetadata.id,
+    ).filter(
+        PersistentIdentifier.object_type == 'rec',
+        PersistentIdentifier.status == PIDStatus.REGISTERED,
+        PersistentIdentifier.pid_type.in_(pid_types),
+    )
+    if pid_values is not None:
+        query = query.filter(PersistentIdentifier.pid_value.in_(pid_values))
+    if community is not None:
+        query = query.filter(
+            RecordMetadata.json.op('->>')('community') == str(community))
+    if publication_state is not None:
+        query = query.filter(
+            RecordMetadata.json.op('->>')('publication_state') ==
+            publication_state)
+    for column, low, high in ((RecordMetadata.created, created_from,
+                               created_to),
+                              (RecordMetadata.updated, updated_from,
+                               updated_to)):
+        if low is not None:
+            query = query.filter(column >= low)
+        if high is not None:
+            query = query.filter(column < high)
+    return query.distinct()
+
+
+_worker_client = None
+
+
+def _init_worker(app):
+    """Initialize a forked reindexing process."""
+    global _worker_client
+    app.app_context().push()
+    # do not reuse the connections of the parent process
+    db.engine.dispose()
+    _worker_client = create_search_client()
+
+
+def _index_chunk(record_ids):
+    try:
+        return send_bulk(_worker_client, bulk_index_actions(record_ids),
+                         chunk_size=len(record_ids))
+    finally:
+        db.session.remove()
+
+
+def reindex_records(record_ids, concurrency=1, chunk_size=500):
+    """Bulk index records in place.
+
+    :param record_ids: list of record UUIDs.
+    :param concurrency: number of indexing processes.
+    :returns: iterator of ``(indexed, errors)`` counts, one per chunk.
+    """
+    chunks = [record_ids[i:i + chunk_size]
+              for i in range(0, len(record_ids), chunk_size)]
+    if concurrency <= 1:
+        for chunk in chunks:
+            yield send_bulk(current_search_client,
+                            bulk_index_actions(chunk), chunk_size=chunk_size)
+            db.session.expunge_all()
+        return
+    app = current_app._get_current_object()
+    # The parent's connections must not be used by the children.
+    db.session.remove()
+    db.engine.dispose()
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(concurrency, initializer=_init_worker,
+                  initargs=(app,)) as pool:
+        for result in pool.imap_unordered(_index_chunk, chunks):
+            yield result
+
+
+def uuid_partitions(count):
+    """Split the UUID space in ``count`` ranges of the same size."""
+    bounds = [str(uuid.UUID(int=(i * (1 << 128)) // count))
+              for i in range(1, count)]
+    starts = [None] + bounds
+    ends = bounds + [None]
+    return [dict(start=s, end=e, last_id=None, done=False, indexed=0,
+                 errors=0) for s, e in zip(starts, ends)]
+
+
+def _index_partition(app, number, partition, indices, pid_types, chunk_size,
+                     progress):
+    """Index one partition. Runs in a forked process."""
+    with app.app_context():
+        # do not reuse the connections of the parent process
+        db.engine.dispose()
+        client = create_search_client()
+        start = partition['last_id'] or partition['start']
+        for chunk in iter_record_id_chunks(
+                pid_types, start=start, end=partition['end'],
+                chunk_size=chunk_size):
+            indexed, errors = send_bulk(
+                client, bulk_index_actions(chunk, indices),
+                chunk_size=chunk_size)
+            db.session.expunge_all()
+            progress.put((number, indexed, errors, str(chunk[-1])))
+        progress.put((number, None, None, None))
+
+
+class IndexRebuild(object):
+    """Rebuild of the search indices next to the live ones."""
+
+    def __init__(self, state_file, state):
+        """Initialize the rebuild from its state."""
+        self.state_file = state_file
+        self.state = state
+
+    @classmethod
+    def start(cls, state_file, aliases, partitions):
+        """Create the new indices and the state file of a rebuild."""
+        client = current_search_client
+        suffix = '-' + str(int(time.time()))
+        state = dict(
+            started=datetime.utcnow().strftime(_DATE_FORMAT),
+            aliases={},
+            partitions=uuid_partitions(partitions),
+        )
+        for alias in aliases:
+            indices = [(name, path) for name, path
+                       in current_search.active_aliases[alias].items()
+                       if not isinstance(path, dict)]
+            if len(indices) != 1:
+                raise ValueError(
+                    'Alias {} does not map to a single index'.format(alias))
+            name, mapping_path = indices[0]
+            with open(mapping_path, 'r') as f:
+                body = json.load(f)
+            settings = body.setdefault('settings', {})
+            replicas = settings.get('number_of_replicas', 1)
+            # no replication nor refresh while the index is being filled
+            settings['number_of_replicas'] = 0
+            settings['refresh_interval'] = '-1'
+            new_index = build_index_name(name, suffix=suffix)
+            client.indices.create(index=new_index, body=body)
+            state['aliases'][alias] = dict(
+                index=name,
+                new_index=new_index,
+                replicas=replicas,
+                pid_type=INDEXED_PID_TYPES[alias],
+            )
+        rebuild = cls(state_file, state)
+        rebuild.save()
+        return rebuild
+
+    @classmethod
+    def load(cls, state_file):
+        """Load a rebuild from its state file. Returns None if it is missing.
+        """
+        if not os.path.exists(state_file):
+            return None
+        with open(state_file, 'r') as f:
+            return cls(state_file, json.load(f))
+
+    def save(self):
+        """Atomically write the state file."""
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_file, self.state_file)
+
+    @property
+    def new_indices(self):
+        """Physical index built for each alias."""
+        return {alias: info['new_index']
+                for alias, info in self.state['aliases'].items()}
+
+    @property
+    def pid_types(self):
+        """PID types of the rebuilt records."""
+        return [info['pid_type'] for info in self.state['aliases'].values()]
+
+    def count_records(self):
+        """Count the records which should be indexed, per alias."""
+        return {alias: indexed_record_ids_query([info['pid_type']]).count()
+                for alias, info in self.state['aliases'].items()}
+
+    def run(self, chunk_size=500, on_progress=None):
+        """Index the partitions which are not done, in parallel.
+
+        :param on_progress: called with the number of indexed records after
+            each chunk.
+        :raises RuntimeError: if a partition process failed. The rebuild
+            can then be resumed.
+        """
+        ctx = multiprocessing.get_context('fork')
+        progress = ctx.Queue()
+        app = current_app._get_current_object()
+        partitions = self.state['partitions']
+        processes = []
+        # The parent's connections must not be used by the children.
+        db.session.remove()
+        db.engine.dispose()
+        for number, partition in enumerate(partitions):
+            if partition['done']:
+                continue
+            process = ctx.Process(
+                target=_index_partition,
+                args=(app, number, partition, self.new_indices,
+                      self.pid_types, chunk_size, progress))
+            process.start()
+            processes.append(process)
+
+        running = len(processes)
+        while running:
+            try:
+                number, indexed, errors, last_id = progress.get(timeout=5)
+            except Empty:
+                if not any(p.is_alive() for p in processes):
+                    break
+                continue
+            partition = partitions[number]
+            if indexed is None:
+                partition['done'] = True
+                running -= 1
+            else:
+                partition['indexed'] += indexed
+                partition['errors'] += errors
+                partition['last_id'] = last_id
+                if on_progress:
+                    on_progress(indexed + errors)
+            self.save()
+        for process in processes:
+            process.join()
+        failed = [i for i, p in enumerate(partitions) if not p['done']]
+        if failed:
+            raise RuntimeError(
+                'Partitions {} failed'.format(', '.join(map(str, failed))))
+
+    def finalize_settings(self):
+        """Restore replication and refresh of the new indices."""
+        for info in self.state['aliases'].values():
+            current_search_client.indices.put_settings(
+                index=info['new_index'],
+                body={'index': {
+                    'number_of_replicas': info['replicas'],
+                    'refresh_interval': None,
+                }})
+            current_search_client.indices.refresh(index=info['new_index'])
+
+    def catch_up(self, since, chunk_size=500):
+        """Apply to the new indices the modifications made since a date.
+
+        Returns:
+            datetime: start of the catch up, to be used for the next one.
+        """
+        started = datetime.utcnow()
+        rows = db.session.query(
+            RecordMetadata.id, PersistentIdentifier.status
+        ).join(
+            PersistentIdentifier,
+            PersistentIdentifier.object_uuid == RecordMetadata.id,
+        ).filter(
+            PersistentIdentifier.pid_type.in_(self.pid_types),
+            PersistentIdentifier.object_type == 'rec',
+            RecordMetadata.updated >= since,
+        ).distinct().all()
+        to_index = [r[0] for r in rows if r[1] == PIDStatus.REGISTERED]
+        to_delete = {r[0] for r in rows} - set(to_index)
+        for i in range(0, len(to_index), chunk_size):
+            send_bulk(current_search_client,
+                      bulk_index_actions(to_index[i:i + chunk_size],
+                                         self.new_indices),
+                      chunk_size=chunk_size)
+        actions = []
+        # deleted records are not routed, try both indices
+        for record_id in to_delete:
+            for alias, index in self.new_indices.items():
+                action = {'_op_type': 'delete', '_index': index,
+                          '_id': str(record_id)}
+                if ES_VERSION[0] < 7:
+                    action['_type'] = DOC_TYPES[alias]
+                actions.append(action)
+        send_bulk(current_search_client, actions, chunk_size=chunk_size)
+        for index in self.new_indices.values():
+            current_search_client.indices.refresh(index=index)
+        return started
+
+    def verify(self):
+        """Compare the number of documents with the number of records.
+
+        Returns:
+            dict: alias to ``(expected, indexed)`` document counts.
+        """
+        expected = self.count_records()
+        return {
+            alias: (expected[alias], current_search_client.count(
+                index=index)['count'])
+            for alias, index in self.new_indices.items()
+        }
+
+    def swap(self):
+        """Atomically move the aliases to the new indices.
+
+        Returns:
+            list: the indices which were previously aliased.
+        """
+        actions = []
+        old_indices = set()
+        for alias, info in self.state['aliases'].items():
+            for name in (build_alias_name(alias),
+                         build_alias_name(info['index'])):
+                # The write alias does not exist if the index was created
+                # without suffix.
+                if not current_search_client.indices.exists_alias(name=name):
+                    continue
+                for index in current_search_client.indices.get_alias(
+                        name=name):
+                    old_indices.add(index)
+                    actions.append({'remove': {'index': index,
+                                               'alias': name}})
+                actions.append({'add': {'index': info['new_index'],
+                                        'alias': name}})
+        current_search_client.indices.update_aliases(
+            body={'actions': actions})
+        return sorted(old_indices - set(self.new_indices.values()))
+
+    def abort(self):
+        """Delete the new indices and the state file."""
+        for index in self.new_indices.values():
+            current_search_client.indices.delete(index=index,
+                                                 ignore=[404])
+        os.remove(self.state_file)
+
+    @property
+    def started(self):
+        """Start date of the rebuild."""
+        return datetime.strptime(self.state['started'], _DATE_FORMAT)
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2016 CERN.
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Bulk ingestion of records.
+
+Records are read from a directory of JSON files, one record per file, in the
+format accepted by the deposit REST API. The files of a record are imported
+from the directory having the same name as its JSON file, if it exists::
+
+    dataset-1.json
+    dataset-1/
+        data.csv
+    dataset-2.json
+
+The records are ingested in batches:
+
+1. the JSON files are parsed,
+2. the deposit and record PIDs of the whole batch are minted with one insert,
+3. each record is created, validated and published in its own savepoint, the
+   JSON Schema validators being cached for the whole ingestion,
+4. the batch is committed.
+
+Indexing is deferred until each batch is committed, its records are then bulk
+indexed. The records of the batches which were committed before a failure are
+thus already indexed. ePIC handles and DOIs are still allocated one record at a
+time when the records are published.
+
+Records which cannot be ingested are written, with their error, to a JSON lines
+error file and the ingestion continues.
+"""
+
+from __future__ import absolute_import, print_function
+
+import json
+import os
+import uuid
+from datetime import datetime
+from itertools import islice
+from urllib.parse import urlunsplit
+
+from flask import current_app
+from invenio_db import db
+from invenio_pidstore.models import PersistentIdentifier, PIDStatus
+from jsonschema.exceptions import ValidationError
+
+from b2share.modules.files.ingest import COPY, import_file, \
+    iter_import_sources
+
+from .api import cached_validation
+from .indexing import deferred_indexing
+from .providers import RecordUUIDProvider
+
+PARSE = 'parse'
+"""The JSON file could not be read."""
+
+VALIDATE = 'validate'
+"""The record metadata is invalid."""
+
+CREATE = 'create'
+"""The record could not be created or published."""
+
+SYSTEM_FIELDS = ('$schema', '_deposit', '_pid', '_oai', '_files',
+                 'publication_state')
+"""Fields which are set by B2SHARE and cannot be ingested."""
+
+
+class IngestionErrors(object):
+    """JSON lines file listing the records which could not be ingested."""
+
+    def __init__(self, fileobj):
+        """Initialize the error file."""
+        self.fileobj = fileobj
+        self.count = 0
+
+    def add(self, path, stage, error):
+        """Record the error of the JSON file at ``path``."""
+        self.fileobj.write(json.dumps(dict(
+            path=path, stage=stage, type=type(error).__name__,
+            error=str(error),
+        )) + '\n')
+        self.fileobj.flush()
+        self.count += 1
+
+
+def list_record_files(directory):
+    """Return the sorted paths of the JSON files of a directory."""
+    return [os.path.join(directory, name)
+            for name in sorted(os.listdir(directory))
+            if name.endswith('.json') and
+            os.path.isfile(os.path.join(directory, name))]
+
+
+def parse_records(paths, errors):
+    """Iterate over the ``(path, metadata)`` of the readable JSON files."""
+    for path in paths:
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                raise ValueError('The record is not a JSON object.')
+            for field in SYSTEM_FIELDS:
+                if field in data:
+                    raise ValueError(
+                        'Field "{}" cannot be set.'.format(field))
+        except (OSError, ValueError) as e:
+            errors.add(path, PARSE, e)
+            continue
+        yield path, data
+
+
+def mint_pids(count):
+    """Mint the deposit and reserved record PIDs of ``count`` records.
+
+    This does the same as
+    :func:`~b2share.modules.deposit.minters.b2share_deposit_uuid_minter` but
+    with a single insert.
+
+    Returns:
+        list: UUIDs of the future deposits, also used as PID values.
+    """
+    from b2share.modules.deposit.providers import DepositUUIDProvider
+
+    now = datetime.utcnow()
+    ids = [uuid.uuid4() for _ in range(count)]
+    rows = []
+    for id_ in ids:
+        rows.append(dict(
+            pid_type=DepositUUIDProvider.pid_type, pid_value=id_.hex,
+            status=PIDStatus.REGISTERED, object_type='rec', object_uuid=id_,
+            created=now, updated=now,
+        ))
+        rows.append(dict(
+            pid_type=RecordUUIDProvider.pid_type, pid_value=id_.hex,
+            status=PIDStatus.RESERVED, object_type='rec', object_uuid=None,
+            created=now, updated=now,
+        ))
+    db.session.bulk_insert_mappings(PersistentIdentifier, rows)
+    return ids
+
+
+def release_pids(pid_values):
+    """Delete the PIDs minted by :func:`mint_pids` for failed records."""
+    from b2share.modules.deposit.providers import DepositUUIDProvider
+
+    PersistentIdentifier.query.filter(
+        PersistentIdentifier.pid_type.in_([DepositUUIDProvider.pid_type,
+                                           RecordUUIDProvider.pid_type]),
+        PersistentIdentifier.pid_value.in_(pid_values),
+    ).delete(synchronize_session=False)
+
+
+def ingest_record(data, id_, files_dir=None, link_mode=COPY, publish=True):
+    """Create a deposit with pre-minted PIDs, import its files and publish it.
+
+    Returns:
+        :class:`~b2share.modules.deposit.api.Deposit`: the created deposit.
+    """
+    from b2share.modules.deposit.api import Deposit
+
+    data['_deposit'] = {'id': id_.hex, 'status': 'draft'}
+    deposit = Deposit.create(data, id_=id_)
+    if files_dir:
+        for key, path in iter_import_sources([files_dir]):
+            import_file(deposit.files.bucket, key, path, link_mode=link_mode)
+    if publish:
+        deposit.publish()
+    return deposit
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def ingest_records(directory, owner, errors, batch_size=100, link_mode=COPY,
+                   publish=True, index_callback=None, progress_callback=None):
+    """Ingest the records of a directory.
+
+    :param directory: directory containing the JSON files.
+    :param owner: :class:`~invenio_accounts.models.User` owning the records.
+    :param errors: :class:`IngestionErrors` receiving the failed records.
+    :param batch_size: number of records committed together.
+    :param publish: publish the records, otherwise they stay drafts.
+    :param index_callback: function called after the commit of each batch
+        with the sorted ids of its records and deposits, which it indexes,
+        for example with :func:`~.indexing.reindex_records`.
+    :param progress_callback: function called after each batch with the
+        number of ingested records so far.
+    :returns: the number of ingested records.
+    """
+    from b2share.modules.deposit.errors import InvalidDepositError
+
+    base_url = urlunsplit((
+        current_app.config.get('PREFERRED_URL_SCHEME', 'http'),
+        current_app.config['JSONSCHEMAS_HOST'],
+        current_app.config.get('APPLICATION_ROOT') or '', '', ''
+    ))
+    paths = list_record_files(directory)
+    ingested = 0
+    with current_app.test_request_context('/', base_url=base_url), \
+            deferred_indexing() as to_index, cached_validation():
+        current_app.login_manager.reload_user(owner)
+        for batch in _batches(parse_records(paths, errors), batch_size):
+            ids = mint_pids(len(batch))
+            failed = []
+            for (path, data), id_ in zip(batch, ids):
+                files_dir = os.path.splitext(path)[0]
+                try:
+                    with db.session.begin_nested():
+                        ingest_record(
+                            data, id_, link_mode=link_mode, publish=publish,
+                            files_dir=files_dir
+                            if os.path.isdir(files_dir) else None)
+                except (ValidationError, InvalidDepositError) as e:
+                    errors.add(path, VALIDATE, e)
+                    failed.append(id_.hex)
+                except Exception as e:
+                    errors.add(path, CREATE, e)
+                    failed.append(id_.hex)
+            if failed:
+                release_pids(failed)
+            db.session.commit()
+            ingested += len(batch) - len(failed)
+            if index_callback and to_index:
+                index_callback(sorted(to_index))
+            to_index.clear()
+            if progress_callback:
+                progress_callback(ingested)
+    return ingested
+
@@ -68,6 +68,8 @@ class B2ShareRecordsSearch(RecordsSearch):
     def __init__(self, all_versions=False, **kwargs):
         """Initialize instance."""
         super(B2ShareRecordsSearch, self).__init__(**kwargs)
+        # the precomputed OAI-PMH renditions are only read by the OAI server
+        self._source = {'excludes': ['_internal.oai_renditions']}
 
         return
 
@@ -25,17 +25,12 @@
 
 from __future__ import absolute_import, print_function
 
-from invenio_records_rest.serializers.response import search_responsify
-from invenio_records_rest.serializers.dc import DublinCoreSerializer
-from invenio_records_rest.serializers.datacite import DataCite31Serializer
+from functools import lru_cache
 
-from dojson.contrib.to_marc21 import to_marc21
-from invenio_marc21.serializers.marcxml import MARCXMLSerializer
+from werkzeug.local import LocalProxy
+from invenio_records_rest.serializers.response import search_responsify
 
 from b2share.modules.records.serializers.schemas.json import RecordSchemaJSONV1
-from b2share.modules.records.serializers.schemas.dc import RecordSchemaDublinCoreV1
-from b2share.modules.records.serializers.schemas.marcxml import RecordSchemaMarcXMLV1
-from b2share.modules.records.serializers.schemas.datacite import DataCiteSchemaV1
 
 from b2share.modules.records.serializers.response import record_responsify, \
     JSONSerializer
@@ -45,11 +40,51 @@ json_v1_response = record_responsify(json_v1, 'application/json')
 json_v1_search = search_responsify(json_v1, 'application/json')
 
 
+# The XML serializers below pull in dojson, the MARC21 rules and the
+# DataCite/DC libraries. They are only needed by OAI-PMH and DOI minting, thus
+# they are built on first use instead of at import time.
+
+@lru_cache(maxsize=None)
+def _dc_v1():
+    from invenio_records_rest.serializers.dc import DublinCoreSerializer
+    from b2share.modules.records.serializers.schemas.dc import \
+        RecordSchemaDublinCoreV1
+    return DublinCoreSerializer(RecordSchemaDublinCoreV1, replace_refs=True)
+
+
+@lru_cache(maxsize=None)
+def _marcxml_v1():
+    from dojson.contrib.to_marc21 import to_marc21
+    from invenio_marc21.serializers.marcxml import MARCXMLSerializer
+    from b2share.modules.records.serializers.schemas.marcxml import \
+        RecordSchemaMarcXMLV1
+    return MARCXMLSerializer(to_marc21, schema_class=RecordSchemaMarcXMLV1,
+                             replace_refs=True)
+
+
+@lru_cache(maxsize=None)
+def _datacite_v31():
+    from invenio_records_rest.serializers.datacite import \
+        DataCite31Serializer
+    from b2share.modules.records.serializers.schemas.datacite import \
+        DataCiteSchemaV1
+    return DataCite31Serializer(DataCiteSchemaV1, replace_refs=True)
+
+
 # OAI-PMH record serializers.
-dc_v1 = DublinCoreSerializer(RecordSchemaDublinCoreV1, replace_refs=True)
-marcxml_v1 = MARCXMLSerializer(to_marc21, schema_class=RecordSchemaMarcXMLV1, replace_refs=True)
-oaipmh_oai_dc = dc_v1.serialize_oaipmh
-oaipmh_marc21_v1 = marcxml_v1.serialize_oaipmh
+dc_v1 = LocalProxy(_dc_v1)
+marcxml_v1 = LocalProxy(_marcxml_v1)
+
+
+def oaipmh_oai_dc(pid, record):
+    """Serialize a record to OAI-PMH Dublin Core."""
+    return dc_v1.serialize_oaipmh(pid, record)
+
+
+def oaipmh_marc21_v1(pid, record):
+    """Serialize a record to OAI-PMH MARCXML."""
+    return marcxml_v1.serialize_oaipmh(pid, record)
+
 
 # DOI record serializers.
-datacite_v31 = DataCite31Serializer(DataCiteSchemaV1, replace_refs=True)
+datacite_v31 = LocalProxy(_datacite_v31)
@@ -26,6 +26,7 @@
 from flask import g, current_app
 from marshmallow import Schema, fields, pre_dump
 from b2share.modules.access.policies import allow_public_file_metadata
+from b2share.modules.files.listing import summarize_files
 from b2share.modules.files.permissions import files_permission_factory
 from b2share.modules.records.utils import is_deposit
 from b2share.modules.records.minters import generate_doi
@@ -43,6 +44,7 @@ class DraftSchemaJSONV1(Schema):
     created = fields.Str()
     updated = fields.Str()
     files = fields.Raw()
+    files_summary = fields.Raw()
 
     @pre_dump
     def filter_internal(self, data):
@@ -87,7 +89,12 @@ class DraftSchemaJSONV1(Schema):
         if '_files' in data['metadata']:
             # Also add the files field only if the user is allowed
             if user_has_permission:
-                data['files'] = data['metadata']['_files']
+                # the whole list is available from the files_list endpoint
+                data['files'], summary = summarize_files(
+                    data['metadata']['_files'], current_app.config.get(
+                        'B2SHARE_RECORDS_FILES_SUMMARY_SIZE'))
+                if summary is not None:
+                    data['files_summary'] = summary
                 if external_pids and bucket:
                     external_dict = {x['key']: x['ePIC_PID']
                                      for x in external_pids}
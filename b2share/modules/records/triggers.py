@@ -38,8 +38,10 @@ from invenio_records.signals import (
 from invenio_indexer.api import RecordIndexer
 from invenio_rest.errors import FieldError
 
+from .cache import invalidate_record_response_trigger
 from .errors import AlteredRecordError
 from .indexer import is_publication
+from .indexing import DeferrableRecordIndexer
 
 
 def register_triggers(app):
@@ -48,6 +50,8 @@ def register_triggers(app):
     before_record_delete.connect(unindex_record_trigger)
     after_record_update.connect(index_record_trigger)
     after_record_insert.connect(index_record_trigger)
+    after_record_update.connect(invalidate_record_response_trigger)
+    before_record_delete.connect(invalidate_record_response_trigger)
 
 
 # TODO(edima): replace this check with explicit permissions
@@ -73,7 +77,7 @@ def index_record_trigger(sender, *args, **kwargs):
     if is_publication(record.model):
         # index the record synchronously as an asynchronous task will not
         # find the record if it runs before this transaction's commit.
-        RecordIndexer().index(record)
+        DeferrableRecordIndexer().index(record)
 
 
 def unindex_record_trigger(sender, *args, **kwargs):
@@ -44,7 +44,7 @@ from invenio_pidstore.models import PersistentIdentifier
 from invenio_pidrelations.contrib.versioning import PIDNodeVersioning
 from invenio_pidrelations.models import PIDRelation
 from invenio_records_files.api import Record
-from invenio_rest.errors import RESTValidationError
+from invenio_rest.errors import FieldError, RESTValidationError
 from invenio_search import RecordsSearch
 from invenio_records.models import RecordMetadata
 from invenio_records_files.api import RecordsBuckets
@@ -60,9 +60,13 @@ from invenio_mail.tasks import send_email
 from invenio_rest import ContentNegotiatedMethodView
 from invenio_accounts.models import User
 
+from .cache import get_response_cache
+from .changes import decode_cursor, encode_cursor, list_changes, \
+    serialize_changes
 from .providers import RecordUUIDProvider
 from .permissions import DeleteRecordPermission
 from .proxies import current_records_rest
+from .utils import is_deposit
 
 
 # duplicated from invenio-records-rest because we need
@@ -259,11 +263,26 @@ def create_url_rules(endpoint, list_route=None, item_route=None,
         RequestAccessResource.view_name.format(endpoint),
         resolver=resolver)
 
+    changes_view = RecordsChangesResource.as_view(
+        RecordsChangesResource.view_name.format(endpoint),
+        links_factory=links_factory)
+
+    files_archive_view = RecordFilesArchiveResource.as_view(
+        RecordFilesArchiveResource.view_name.format(endpoint),
+        resolver=resolver)
+
+    files_list_view = RecordFilesListResource.as_view(
+        RecordFilesListResource.view_name.format(endpoint),
+        resolver=resolver)
+
     views = [
         dict(rule=list_route, view_func=list_view),
         dict(rule=item_route, view_func=item_view),
         dict(rule=item_route + '/abuse', view_func=abuse_view),
         dict(rule=item_route + '/accessrequests', view_func=access_view),
+        dict(rule=list_route + '_changes', view_func=changes_view),
+        dict(rule=item_route + '/files.zip', view_func=files_archive_view),
+        dict(rule=item_route + '/files_list', view_func=files_list_view),
         # Special case for versioning as the parent PID is redirected.
         dict(rule='/api/records/<pid_value>/versions', view_func=versions_view),
     ]
@@ -507,6 +526,29 @@ class B2ShareRecordResource(RecordResource):
         """Disable PUT."""
         abort(405)
 
+    def get(self, pid_value, **kwargs):
+        """Get a record, using the response cache when it is enabled."""
+        response_cache = get_response_cache()
+        if response_cache is None or \
+                not response_cache.is_cacheable_request():
+            return super(B2ShareRecordResource, self).get(
+                pid_value=pid_value, **kwargs)
+
+        serializers, default_media_type = self.get_method_serializers('GET')
+        mimetype = request.accept_mimetypes.best_match(
+            serializers.keys(), default=default_media_type)
+        response = response_cache.get_response(pid_value.value, mimetype)
+        if response is not None:
+            return response
+
+        response = super(B2ShareRecordResource, self).get(
+            pid_value=pid_value, **kwargs)
+        _, record = pid_value.data
+        if response_cache.is_cacheable_record(record):
+            response_cache.set_response(pid_value.value, record, mimetype,
+                                        response)
+        return response
+
     @pass_record
     def delete(self, pid, record, *args, **kwargs):
         """Delete a record."""
@@ -587,6 +629,179 @@ class RecordsVersionsResource(ContentNegotiatedMethodView):
         return {'versions': records}
 
 
+class RecordsChangesResource(ContentNegotiatedMethodView):
+
+    view_name = '{0}_changes'
+
+    def __init__(self, links_factory=None, **kwargs):
+        """Constructor.
+
+        :param links_factory: Factory of the links of each record.
+        """
+        default_media_type = 'application/json'
+        super(RecordsChangesResource, self).__init__(
+            serializers={
+                'application/json': lambda response: jsonify(response)
+            },
+            default_method_media_type={
+                'GET': default_media_type,
+            },
+            default_media_type=default_media_type,
+            **kwargs)
+        self.links_factory = links_factory
+
+    def get(self, **kwargs):
+        """GET the publications modified or deleted after a cursor."""
+        from .serializers import json_v1
+
+        config = current_app.config
+        size = min(max(request.args.get(
+            'size', config['B2SHARE_RECORDS_CHANGES_PAGE_SIZE'], type=int
+        ), 1), config['B2SHARE_RECORDS_CHANGES_MAX_PAGE_SIZE'])
+        cursor = request.args.get('cursor')
+        changes = list_changes(
+            after=decode_cursor(cursor) if cursor else None, size=size,
+            delay=config['B2SHARE_RECORDS_CHANGES_DELAY'])
+        if changes:
+            _, last = changes[-1]
+            cursor = encode_cursor(last.updated, last.id)
+
+        links = dict(self=url_for(request.endpoint, _external=True,
+                                  **request.args.to_dict()))
+        # The next page is requested with the new cursor, even when this one
+        # is not full, in order to get the future changes.
+        next_args = dict(size=size)
+        if cursor:
+            next_args['cursor'] = cursor
+        links['next'] = url_for(request.endpoint, _external=True,
+                                **next_args)
+        return {
+            'changes': serialize_changes(changes, json_v1,
+                                         links_factory=self.links_factory),
+            'cursor': cursor,
+            'links': links,
+        }
+
+
+class RecordFilesArchiveResource(ContentNegotiatedMethodView):
+
+    view_name = '{0}_files_archive'
+
+    def __init__(self, resolver=None, **kwargs):
+        """Constructor.
+
+        :param resolver: Persistent identifier resolver instance.
+        """
+        default_media_type = 'application/json'
+        super(RecordFilesArchiveResource, self).__init__(
+            serializers={
+                'application/json': lambda response: jsonify(response)
+            },
+            default_method_media_type={
+                'GET': default_media_type,
+            },
+            default_media_type=default_media_type,
+            **kwargs)
+        self.resolver = resolver
+
+    @pass_record
+    def get(self, pid, record, **kwargs):
+        """GET the files of a record or deposit as a ZIP archive."""
+        from b2share.modules.files.archive import bucket_archive_response
+
+        records_bucket = RecordsBuckets.query.filter_by(
+            record_id=record.id).one_or_none()
+        if records_bucket is None:
+            abort(404)
+        return bucket_archive_response(records_bucket.bucket,
+                                       '{}.zip'.format(pid.pid_value))
+
+
+class RecordFilesListResource(ContentNegotiatedMethodView):
+
+    view_name = '{0}_files_list'
+
+    def __init__(self, resolver=None, **kwargs):
+        """Constructor.
+
+        :param resolver: Persistent identifier resolver instance.
+        """
+        default_media_type = 'application/json'
+        super(RecordFilesListResource, self).__init__(
+            serializers={
+                'application/json': lambda response: jsonify(response)
+            },
+            default_method_media_type={
+                'GET': default_media_type,
+            },
+            default_media_type=default_media_type,
+            **kwargs)
+        self.resolver = resolver
+
+    @pass_record
+    def get(self, pid, record, **kwargs):
+        """GET a page of the files of a record or deposit."""
+        from b2share.modules.files.listing import SORT_OPTIONS, \
+            bucket_files_page, bucket_files_summary
+        from invenio_files_rest.proxies import current_permission_factory
+        from flask_login import current_user
+
+        records_bucket = RecordsBuckets.query.filter_by(
+            record_id=record.id).one_or_none()
+        if records_bucket is None:
+            abort(404)
+        bucket = records_bucket.bucket
+        if not current_permission_factory(bucket, 'bucket-read').can():
+            abort(403 if current_user.is_authenticated else 401)
+
+        config = current_app.config
+        size = min(max(request.args.get(
+            'size', config['B2SHARE_RECORDS_FILES_PAGE_SIZE'], type=int
+        ), 1), config['B2SHARE_RECORDS_FILES_MAX_PAGE_SIZE'])
+        page = max(request.args.get('page', 1, type=int), 1)
+        sort = request.args.get('sort', 'key')
+        if sort not in SORT_OPTIONS:
+            raise RESTValidationError(
+                errors=[FieldError('sort', 'Invalid sort option.')])
+
+        files = bucket_files_page(bucket.id, sort=sort, page=page, size=size)
+        # the PIDs of the files are only stored in the record
+        extra = {f['key']: f for f in record.get('_files', [])
+                 if f.get('ePIC_PID')}
+        if is_deposit(record.model):
+            from b2share.modules.deposit.api import generate_external_pids
+            external_pids = generate_external_pids(record)
+        else:
+            external_pids = record['_deposit'].get('external_pids', [])
+        external_dict = {x['key']: x['ePIC_PID'] for x in external_pids}
+        for f in files:
+            if f['key'] in external_dict:
+                f['b2safe'] = True
+                f['ePIC_PID'] = external_dict[f['key']]
+            elif f['key'] in extra:
+                f['ePIC_PID'] = extra[f['key']]['ePIC_PID']
+
+        summary = bucket_files_summary(bucket.id)
+        args = dict(size=size, sort=sort)
+        links = dict(self=url_for(request.endpoint, _external=True,
+                                  pid_value=pid.pid_value, page=page,
+                                  **args))
+        if page > 1:
+            links['prev'] = url_for(request.endpoint, _external=True,
+                                    pid_value=pid.pid_value, page=page - 1,
+                                    **args)
+        if page * size < summary['count']:
+            links['next'] = url_for(request.endpoint, _external=True,
+                                    pid_value=pid.pid_value, page=page + 1,
+                                    **args)
+        return {
+            'files': files,
+            'total': summary['count'],
+            'total_size': summary['total_size'],
+            'links': links,
+        }
+
+
 class RecordsAbuseResource(ContentNegotiatedMethodView):
 
     view_name = '{0}_abuse'
@@ -25,6 +25,8 @@
 
 
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import dateutil.parser
 import urllib.parse
 import easywebdav2 as easywebdav
@@ -72,6 +74,31 @@ class B2DropClient(object):
             current_app.logger.error("b2drop/webdav error", exc_info=True)
             raise RemoteError.from_webdav(e) from e
 
+    def make_transfer_stream(self, remote_path, parallel_threshold,
+                             part_size, parts):
+        """Open a file, with concurrent range requests if it is large.
+
+        The ranges are used only if the server supports them and the file
+        size is at least ``parallel_threshold``.
+        """
+        if remote_path and remote_path.startswith(self.path):
+            remote_path = remote_path[len(self.path):]
+        url = self.client.baseurl + str(remote_path).strip()
+        response = self.client.session.head(url, allow_redirects=False)
+        if response.status_code != 200:
+            current_app.logger.error(
+                "b2drop/webdav HEAD error code {}".format(
+                    response.status_code))
+            raise RemoteError('error while getting b2drop file: {}'.format(
+                url))
+        size = response.headers.get('Content-Length')
+        if size is not None and int(size) >= parallel_threshold and \
+                response.headers.get('Accept-Ranges') == 'bytes' and \
+                response.headers.get('Content-Encoding', '') == '':
+            return B2DropRangedStream(self.client.session, url, int(size),
+                                      part_size, parts)
+        return B2DropStream(self.client, remote_path)
+
     def cleanFile(self, f):
         name_parts = f.name.split("/")
         orig_name = name_parts[-1]
@@ -115,3 +142,71 @@ class B2DropStream(object):
             return next(self.content_iterator)
         except StopIteration:
             return None
+
+
+class B2DropRangedStream(object):
+    """Stream of a file downloaded with concurrent range requests.
+
+    Up to ``parts`` ranges of ``part_size`` bytes are downloaded in advance
+    and read in order, thus the stream can be written and hashed in a single
+    pass while using at most ``parts * part_size`` bytes of memory.
+    """
+
+    def __init__(self, session, url, size, part_size, parts):
+        self.session = session
+        self.url = url
+        self.size = size
+        self.part_size = part_size
+        self._starts = iter(range(0, size, part_size))
+        self._executor = ThreadPoolExecutor(max_workers=parts)
+        self._parts = deque()
+        self._buffer = b''
+        self._position = 0
+        for _ in range(parts):
+            self._schedule()
+
+    def _schedule(self):
+        start = next(self._starts, None)
+        if start is not None:
+            end = min(start + self.part_size, self.size) - 1
+            self._parts.append(self._executor.submit(self._get, start, end))
+
+    def _get(self, start, end):
+        response = self.session.get(
+            self.url, headers={'Range': 'bytes={}-{}'.format(start, end)},
+            allow_redirects=False)
+        if response.status_code != 206 or \
+                len(response.content) != end - start + 1:
+            raise RemoteError(
+                'error while GETting b2drop file range {}-{}: {}'.format(
+                    start, end, self.url))
+        return response.content
+
+    def length(self):
+        return self.size
+
+    def read(self, chunk_size):
+        if self._position >= len(self._buffer):
+            if not self._parts:
+                self.close()
+                return None
+            try:
+                self._buffer = self._parts.popleft().result()
+            except Exception:
+                self.close()
+                raise
+            self._position = 0
+            self._schedule()
+        if self._position == 0 and chunk_size >= len(self._buffer):
+            chunk = self._buffer
+        else:
+            chunk = self._buffer[self._position:self._position + chunk_size]
+        self._position += len(chunk)
+        return chunk
+
+    def close(self):
+        """Cancel the pending range requests."""
+        for part in self._parts:
+            part.cancel()
+        self._parts.clear()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2016 University of Tuebingen, CERN.
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""B2Share remotes configuration."""
+
+B2DROP_MAX_CLIENTS = 100
+"""Maximum number of B2DROP clients kept by each process."""
+
+B2DROP_CLIENT_IDLE_TIMEOUT = 15 * 60
+"""Seconds after which an unused B2DROP client is closed."""
+
+B2DROP_CLIENT_POOL_SIZE = 4
+"""Number of kept-alive HTTP connections of each B2DROP client."""
+
+B2DROP_LISTING_CACHE_TTL = 30
+"""Seconds during which a B2DROP directory listing is cached."""
+
+B2DROP_LISTING_CACHE_SIZE = 1000
+"""Maximum number of B2DROP directory listings cached by each process."""
+
+B2DROP_TRANSFER_JOB_TTL = 24 * 60 * 60
+"""Seconds during which the state of a transfer job is kept."""
+
+B2DROP_TRANSFER_CREDENTIALS_TTL = 60 * 60
+"""Seconds during which the B2DROP credentials of a transfer job are kept.
+
+The files of the job which are not started meanwhile fail.
+"""
+
+B2DROP_TRANSFER_MAX_FILES = 1000
+"""Maximum number of files of a transfer job."""
+
+B2DROP_TRANSFER_PARALLEL_THRESHOLD = 64 * 1024 * 1024
+"""Size from which a file is downloaded with concurrent range requests."""
+
+B2DROP_TRANSFER_PART_SIZE = 16 * 1024 * 1024
+"""Size of the ranges of a file downloaded with concurrent requests."""
+
+B2DROP_TRANSFER_PARALLEL_PARTS = 4
+"""Number of ranges of a file downloaded concurrently."""
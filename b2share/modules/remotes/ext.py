@@ -25,6 +25,9 @@
 """B2share integration with remote services"""
 
 from __future__ import absolute_import, print_function
+
+from . import config
+from .pool import B2DropClientPool
 from .views import blueprint
 
 
@@ -38,8 +41,11 @@ class B2ShareRemotes(object):
         """Flask application initialization."""
         self.init_config(app)
         app.register_blueprint(blueprint)
+        self.b2drop_pool = B2DropClientPool.from_config(app.config)
         app.extensions['b2share-remotes'] = self
 
     def init_config(self, app):
         """Initialize configuration."""
-        pass
+        for k in dir(config):
+            if k.startswith('B2DROP_'):
+                app.config.setdefault(k, getattr(config, k))
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2016 University of Tuebingen, CERN.
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Server side pool of B2DROP clients and cache of directory listings.
+
+The WebDAV clients are kept in the memory of each process, keyed by the user
+and the B2DROP account, instead of being pickled in the Flask session. Their
+HTTP connections are kept alive between requests. The session only holds the
+B2DROP credentials, which are needed to reconnect when a request is served by
+another process or when the client was closed after being idle.
+
+Directory listings are cached for a few seconds in each process. The cache of
+a user is invalidated when a file is transferred, by changing the generation
+of its listings which is kept in the application cache, thus shared by the
+web server processes and the Celery workers.
+
+The number and duration of the B2DROP operations are collected by
+:class:`RemoteMetrics`.
+"""
+
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from invenio_cache import current_cache
+from requests.adapters import HTTPAdapter
+
+from b2share.modules.records.cache import LocalLRUCache
+
+from .b2drop import B2DropClient
+
+
+class RemoteMetrics(object):
+    """Thread safe counters and durations of the remote operations."""
+
+    def __init__(self):
+        """Initialize the metrics."""
+        self._lock = threading.Lock()
+        self._timings = {}
+        self._counters = {}
+
+    def incr(self, name):
+        """Increment a counter."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+
+    def add_timing(self, name, duration):
+        """Add the duration in seconds of an operation."""
+        with self._lock:
+            timing = self._timings.setdefault(
+                name, dict(count=0, total=0.0, max=0.0))
+            timing['count'] += 1
+            timing['total'] += duration
+            timing['max'] = max(timing['max'], duration)
+
+    @contextmanager
+    def timed(self, name):
+        """Measure the duration of the enclosed block."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_timing(name, time.time() - start)
+
+    def to_dict(self):
+        """Return the metrics with durations in milliseconds."""
+        with self._lock:
+            return dict(
+                counters=dict(self._counters),
+                timings={
+                    name: dict(
+                        count=timing['count'],
+                        total_ms=round(1000 * timing['total'], 3),
+                        mean_ms=round(1000 * timing['total'] /
+                                      timing['count'], 3),
+                        max_ms=round(1000 * timing['max'], 3),
+                    ) for name, timing in self._timings.items()
+                },
+            )
+
+
+def connection_key(user_key, username, password):
+    """Identify the B2DROP account used by a user.
+
+    The password is part of the key so that changed credentials are not
+    served with the client or the listings of the previous ones.
+    """
+    digest = hashlib.sha256('{}\0{}'.format(username, password)
+                            .encode('utf-8')).hexdigest()
+    return '{}:{}'.format(user_key, digest)
+
+
+class B2DropClientPool(object):
+    """B2DROP clients and directory listings of a process."""
+
+    generation_prefix = 'b2share_remotes_listings_generation'
+
+    def __init__(self, server_config, max_clients=100, idle_timeout=900,
+                 pool_size=4, listing_ttl=30, listing_cache_size=1000,
+                 generations=None):
+        """Initialize the pool.
+
+        :param server_config: the ``B2DROP_SERVER`` configuration.
+        :param max_clients: number of clients kept, the least recently used
+            being closed first.
+        :param idle_timeout: seconds after which an unused client is closed.
+        :param pool_size: number of kept-alive connections of a client.
+        :param listing_ttl: seconds during which a listing is cached. Listings
+            are not cached if it is 0.
+        :param generations: cache with Flask-Caching's interface, shared by
+            the processes, keeping the generation of the listings of each
+            connection key. Defaults to the application cache.
+        """
+        self.server_config = server_config
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self.pool_size = pool_size
+        self.listing_ttl = listing_ttl
+        self.listings = LocalLRUCache(max_size=listing_cache_size,
+                                      default_timeout=listing_ttl)
+        self.metrics = RemoteMetrics()
+        self.generations = generations if generations is not None \
+            else current_cache
+        # connection key -> (last use time, client)
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Create the pool configured for an application."""
+        return cls(
+            config.get('B2DROP_SERVER'),
+            max_clients=config['B2DROP_MAX_CLIENTS'],
+            idle_timeout=config['B2DROP_CLIENT_IDLE_TIMEOUT'],
+            pool_size=config['B2DROP_CLIENT_POOL_SIZE'],
+            listing_ttl=config['B2DROP_LISTING_CACHE_TTL'],
+            listing_cache_size=config['B2DROP_LISTING_CACHE_SIZE'],
+        )
+
+    def _close(self, client):
+        self.metrics.incr('client_closed')
+        client.client.session.close()
+
+    def get_client(self, key, username, password):
+        """Return the client of a connection key, connecting if needed."""
+        now = time.time()
+        with self._lock:
+            # close the idle clients, the oldest ones being first
+            while self._clients:
+                oldest_key, (last_use, oldest) = next(
+                    iter(self._clients.items()))
+                if last_use > now - self.idle_timeout:
+                    break
+                del self._clients[oldest_key]
+                self._close(oldest)
+            entry = self._clients.pop(key, None)
+            if entry is not None:
+                self._clients[key] = (now, entry[1])
+                self.metrics.incr('client_reused')
+                return entry[1]
+
+        with self.metrics.timed('connect'):
+            client = B2DropClient(username=username, password=password,
+                                  **self.server_config)
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.pool_size)
+        client.client.session.mount('http://', adapter)
+        client.client.session.mount('https://', adapter)
+        with self._lock:
+            previous = self._clients.pop(key, None)
+            if previous is not None:
+                self._close(previous[1])
+            self._clients[key] = (now, client)
+            while len(self._clients) > self.max_clients:
+                self._close(self._clients.popitem(last=False)[1][1])
+        return client
+
+    def remove_client(self, key):
+        """Close the client of a connection key and forget its listings."""
+        with self._lock:
+            entry = self._clients.pop(key, None)
+        if entry is not None:
+            self._close(entry[1])
+        self.invalidate(key)
+
+    def _generation_key(self, key):
+        return '{}:{}'.format(self.generation_prefix, key)
+
+    def _listing_key(self, key, path):
+        generation = self.generations.get(self._generation_key(key)) or 0
+        return '{}:{}:{}'.format(key, generation, path)
+
+    def list(self, key, username, password, path):
+        """List a B2DROP directory, from the cache if possible.
+
+        Returns:
+            tuple: the listing and True if it was cached.
+        """
+        if self.listing_ttl:
+            listing_key = self._listing_key(key, path)
+            listing = self.listings.get(listing_key)
+            if listing is not None:
+                self.metrics.incr('listing_cache_hit')
+                return listing, True
+            self.metrics.incr('listing_cache_miss')
+        client = self.get_client(key, username, password)
+        with self.metrics.timed('list'):
+            listing = client.list(path)
+        if self.listing_ttl:
+            self.listings.set(listing_key, listing)
+        return listing, False
+
+    def invalidate(self, key):
+        """Forget the cached listings of a connection key in all processes.
+
+        The listings are then cached under a new random generation. It
+        outlives the listings cached under the previous ones, which are thus
+        never used again once it expires.
+        """
+        if not self.listing_ttl:
+            return
+        self.generations.set(self._generation_key(key), uuid.uuid4().hex,
+                             timeout=2 * self.listing_ttl)
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of EUDAT B2Share.
+# Copyright (C) 2016 University of Tuebingen, CERN.
+#
+# B2Share is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# B2Share is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with B2Share; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Asynchronous transfers of B2DROP files into buckets.
+
+A transfer job lists B2DROP files and the bucket receiving them. Each file is
+transferred by its own Celery task, thus the files of a job are transferred
+concurrently by the Celery workers and the web workers are not blocked. Large
+files are downloaded with concurrent range requests. The checksum of a file is
+computed by the storage while it is written.
+
+The state of the jobs is kept in the application cache, with the progress of
+each file under its own key so that the tasks never update the same entry.
+The B2DROP credentials needed by the tasks are kept in the cache as well,
+encrypted with the secret key of the application. They expire after
+``B2DROP_TRANSFER_CREDENTIALS_TTL`` and are removed when the last file of the
+job is done.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from urllib.parse import unquote
+
+from cryptography.fernet import Fernet, InvalidToken
+from flask import current_app
+from invenio_cache import current_cache
+from invenio_db import db
+from invenio_files_rest.models import Bucket, ObjectVersion
+
+from b2share.modules.files.storage import store_extra_checksums
+
+PENDING = 'pending'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+PROGRESS_INTERVAL = 1
+"""Minimum number of seconds between two progress updates of a file."""
+
+
+def transfer_key(remote_path):
+    """Return the object key of a transferred B2DROP file."""
+    return unquote(os.path.basename(remote_path.rstrip('/')))
+
+
+class TransferJobs(object):
+    """Transfer jobs saved in the application cache."""
+
+    prefix = 'b2share_remotes_transfer'
+
+    def __init__(self, backend=None, timeout=None, credentials_timeout=None):
+        """Initialize the job store.
+
+        :param backend: cache with Flask-Caching's interface. Defaults to the
+            application cache.
+        :param timeout: lifetime of the jobs in seconds. Defaults to
+            ``B2DROP_TRANSFER_JOB_TTL``.
+        :param credentials_timeout: lifetime of the credentials of the jobs in
+            seconds. Defaults to ``B2DROP_TRANSFER_CREDENTIALS_TTL``.
+        """
+        config = current_app.config
+        self.backend = backend if backend is not None else current_cache
+        self.timeout = timeout if timeout is not None else \
+            config['B2DROP_TRANSFER_JOB_TTL']
+        self.credentials_timeout = credentials_timeout \
+            if credentials_timeout is not None else \
+            config['B2DROP_TRANSFER_CREDENTIALS_TTL']
+        key = hashlib.sha256(
+            (self.prefix + config['SECRET_KEY']).encode('utf-8')).digest()
+        self._fernet = Fernet(base64.urlsafe_b64encode(key))
+
+    def _key(self, job_id, *parts):
+        return ':'.join((self.prefix, job_id) + tuple(str(p) for p in parts))
+
+    def create(self, user_id, bucket_id, remote_paths, credentials):
+        """Save a new job.
+
+        :param credentials: tuple of the B2DROP connection key, username and
+            password.
+        :returns: the id of the job.
+        """
+        job_id = uuid.uuid4().hex
+        self.backend.set(self._key(job_id), dict(
+            id=job_id,
+            user_id=user_id,
+            bucket_id=str(bucket_id),
+            created=datetime.utcnow().isoformat(),
+            files=[dict(path=path, key=transfer_key(path))
+                   for path in remote_paths],
+        ), timeout=self.timeout)
+        self.backend.set(
+            self._key(job_id, 'auth'),
+            self._fernet.encrypt(json.dumps(list(credentials)).encode()),
+            timeout=self.credentials_timeout)
+        self.backend.set(self._key(job_id, 'remaining'), len(remote_paths),
+                         timeout=self.timeout)
+        return job_id
+
+    def get(self, job_id):
+        """Return a job without its progress, or None if it does not exist."""
+        return self.backend.get(self._key(job_id))
+
+    def credentials(self, job_id):
+        """Return the B2DROP credentials of a job, or None if expired."""
+        token = self.backend.get(self._key(job_id, 'auth'))
+        if token is None:
+            return None
+        try:
+            return json.loads(self._fernet.decrypt(
+                token, ttl=self.credentials_timeout).decode())
+        except InvalidToken:
+            self.delete_credentials(job_id)
+            return None
+
+    def delete_credentials(self, job_id):
+        """Remove the B2DROP credentials of a job."""
+        self.backend.delete(self._key(job_id, 'auth'))
+
+    def update_file(self, job_id, index, **progress):
+        """Save the progress of a file."""
+        self.backend.set(self._key(job_id, 'file', index), progress,
+                         timeout=self.timeout)
+
+    def file_done(self, job_id):
+        """Count a transferred or failed file of a job.
+
+        The credentials are removed once every file is done.
+
+        :returns: True if it was the last file of the job.
+        """
+        if self.backend.dec(self._key(job_id, 'remaining')):
+            return False
+        self.delete_credentials(job_id)
+        return True
+
+    def status(self, job_id):
+        """Return a job with the progress of each file, or None."""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        progress = self.backend.get_many(*[
+            self._key(job_id, 'file', index)
+            for index in range(len(job['files']))
+        ])
+        files = []
+        for source, file_progress in zip(job['files'], progress):
+            info = dict(status=PENDING, transferred=0)
+            info.update(source)
+            info.update(file_progress or {})
+            files.append(info)
+        statuses = set(f['status'] for f in files)
+        if statuses & {PENDING, RUNNING}:
+            status = RUNNING
+        elif FAILED in statuses:
+            status = FAILED
+        else:
+            status = COMPLETED
+        return dict(
+            id=job['id'],
+            bucket_id=job['bucket_id'],
+            created=job['created'],
+            status=status,
+            transferred=sum(f['transferred'] for f in files),
+            files=files,
+        )
+
+
+def transfer_file(job_id, index):
+    """Transfer one file of a transfer job into its bucket."""
+    jobs = TransferJobs()
+    job = jobs.get(job_id)
+    if job is None:
+        current_app.logger.warning(
+            'B2DROP transfer job {} expired'.format(job_id))
+        jobs.delete_credentials(job_id)
+        return
+    credentials = jobs.credentials(job_id)
+    if credentials is None:
+        current_app.logger.warning(
+            'B2DROP credentials of transfer job {} expired'.format(job_id))
+        jobs.update_file(job_id, index, status=FAILED, transferred=0,
+                         error='B2DROP credentials expired')
+        jobs.file_done(job_id)
+        return
+    source = job['files'][index]
+    config = current_app.config
+    last_update = [0]
+    size = None
+
+    def progress_callback(total, transferred):
+        now = time.time()
+        if now - last_update[0] >= PROGRESS_INTERVAL:
+            last_update[0] = now
+            jobs.update_file(job_id, index, status=RUNNING,
+                             transferred=transferred, size=size)
+
+    pool = current_app.extensions['b2share-remotes'].b2drop_pool
+    jobs.update_file(job_id, index, status=RUNNING, transferred=0)
+    try:
+        client = pool.get_client(*credentials)
+        with pool.metrics.timed('transfer'):
+            stream = client.make_transfer_stream(
+                source['path'],
+                parallel_threshold=config[
+                    'B2DROP_TRANSFER_PARALLEL_THRESHOLD'],
+                part_size=config['B2DROP_TRANSFER_PART_SIZE'],
+                parts=config['B2DROP_TRANSFER_PARALLEL_PARTS'])
+            size = stream.length()
+            bucket = Bucket.get(job['bucket_id'])
+            with db.session.begin_nested():
+                obj = ObjectVersion.create(bucket, source['key'])
+                obj.set_contents(stream, size=size,
+                                 size_limit=bucket.size_limit,
+                                 progress_callback=progress_callback)
+                store_extra_checksums(obj)
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception(
+            'B2DROP transfer of {} failed'.format(source['path']))
+        jobs.update_file(job_id, index, status=FAILED, transferred=0,
+                         error=str(e))
+    else:
+        jobs.update_file(job_id, index, status=COMPLETED,
+                         transferred=obj.file.size, size=obj.file.size,
+                         checksum=obj.file.checksum,
+                         version_id=str(obj.version_id))
+    finally:
+        if jobs.file_done(job_id):
+            # once per job, not after each of its files
+            pool.invalidate(credentials[0])
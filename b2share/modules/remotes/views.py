@@ -25,15 +25,21 @@
 
 from __future__ import absolute_import
 
+import time
+import uuid
 from urllib.parse import urlparse
 
 from flask import Blueprint, jsonify, abort, session, request, url_for, current_app
+from flask_login import current_user
+from invenio_access.permissions import Permission, superuser_access
 from invenio_rest import ContentNegotiatedMethodView
 
 from invenio_files_rest.serializer import json_serializer
 
 from .errors import UserError
-from .b2drop import B2DropClient
+from .pool import connection_key
+from .tasks import transfer_b2drop_file
+from .transfers import TransferJobs
 
 
 blueprint = Blueprint(
@@ -50,6 +56,29 @@ def dict_to_json_serializer(dictionary, code=200, headers=None):
     return response
 
 
+def b2drop_pool():
+    """Return the :class:`~.pool.B2DropClientPool` of the current process."""
+    return current_app.extensions['b2share-remotes'].b2drop_pool
+
+
+def b2drop_connection():
+    """Return the connection key and credentials of the current session."""
+    auth = session.get('b2drop_auth')
+    if not auth:
+        raise UserError("B2DROP remote not initialized")
+    return auth['key'], auth['username'], auth['password']
+
+
+def b2drop_listing(path):
+    """List a B2DROP directory with a ``Server-Timing`` header."""
+    key, username, password = b2drop_connection()
+    start = time.time()
+    listing, cached = b2drop_pool().list(key, username, password, path)
+    timing = 'b2drop;dur={:.1f};desc="{}"'.format(
+        1000 * (time.time() - start), 'cache hit' if cached else 'webdav')
+    return listing, 200, [('Server-Timing', timing)]
+
+
 class RemoteList(ContentNegotiatedMethodView):
     view_name = 'remotes'
 
@@ -66,12 +95,20 @@ class RemoteList(ContentNegotiatedMethodView):
     def put(self, service):
         if service == 'b2drop':
             auth = request.get_json()
-            config = current_app.config.get('B2DROP_SERVER')
-            b2drop_client = B2DropClient(username=auth.get('username'),
-                                         password=auth.get('password'),
-                                         **config)
-            session['b2drop_client'] = b2drop_client
-            return b2drop_client.list('/')
+            username = auth.get('username')
+            password = auth.get('password')
+            previous = session.get('b2drop_auth')
+            user_key = current_user.get_id() \
+                if current_user.is_authenticated else uuid.uuid4().hex
+            key = connection_key(user_key, username, password)
+            if previous and previous['key'] != key:
+                b2drop_pool().remove_client(previous['key'])
+            # Only the credentials are saved in the session, the client is
+            # kept by the pool.
+            session['b2drop_auth'] = dict(key=key, username=username,
+                                          password=password)
+            b2drop_pool().invalidate(key)
+            return b2drop_listing('/')
         else:
             raise UserError("Remote service unknown")
 
@@ -93,10 +130,38 @@ class B2DropRemote(ContentNegotiatedMethodView):
         )
 
     def get(self, path):
-        b2drop_client = session.get('b2drop_client')
-        if not b2drop_client:
-            raise UserError("B2DROP remote not initialized")
-        return b2drop_client.list(path)
+        return b2drop_listing(path)
+
+
+class RemoteMetrics(ContentNegotiatedMethodView):
+    view_name = 'remotes_metrics'
+
+    def __init__(self, **kwargs):
+        """Constructor."""
+        super(RemoteMetrics, self).__init__(
+            serializers={
+                'application/json': dict_to_json_serializer,
+            },
+            default_media_type='application/json',
+            **kwargs
+        )
+
+    def get(self):
+        """Return the B2DROP metrics of the process serving the request."""
+        if not Permission(superuser_access).can():
+            abort(403)
+        return b2drop_pool().metrics.to_dict()
+
+
+def b2drop_path_from_url(source_remote_url):
+    """Return the B2DROP path of a remote URL."""
+    b2drop_urlbase = url_for('remotes.b2drop', path='', _external=True)
+    b2drop_urlbase_relative = urlparse(b2drop_urlbase).path
+    if source_remote_url.startswith(b2drop_urlbase):
+        return source_remote_url[len(b2drop_urlbase):]
+    elif source_remote_url.startswith(b2drop_urlbase_relative):
+        return source_remote_url[len(b2drop_urlbase_relative):]
+    raise UserError("bad source_remote_url; currently only supporting b2drop remotes")
 
 
 class Jobs(ContentNegotiatedMethodView):
@@ -125,14 +190,7 @@ class Jobs(ContentNegotiatedMethodView):
         if not destination_file_url:
             raise UserError("missing required destination_file_url parameter")
 
-        b2drop_urlbase = url_for('remotes.b2drop', path='', _external=True)
-        b2drop_urlbase_relative = urlparse(b2drop_urlbase).path
-        if source_remote_url.startswith(b2drop_urlbase):
-            b2drop_path = source_remote_url[len(b2drop_urlbase):]
-        elif source_remote_url.startswith(b2drop_urlbase_relative):
-            b2drop_path = source_remote_url[len(b2drop_urlbase_relative):]
-        else:
-            raise UserError("bad source_remote_url; currently only supporting b2drop remotes")
+        b2drop_path = b2drop_path_from_url(source_remote_url)
 
         fileBucket_urlbase = url_for('invenio_files_rest.location_api', _external=True)
         if not destination_file_url.startswith(fileBucket_urlbase):
@@ -144,12 +202,106 @@ class Jobs(ContentNegotiatedMethodView):
             raise UserError("bad destination_file_url; must be a correct URL "
                             "pointing to a file in a file bucket object")
 
-        b2drop_client = session.get('b2drop_client')
-        if not b2drop_client:
-            raise UserError("B2DROP remote not initialized")
+        connection, username, password = b2drop_connection()
+        pool = b2drop_pool()
+        b2drop_client = pool.get_client(connection, username, password)
+        with pool.metrics.timed('transfer'):
+            stream = b2drop_client.make_stream_object(b2drop_path)
+            obj = put_file_into_bucket(bucket_id, key, stream,
+                                       stream.length())
+        pool.invalidate(connection)
+        return obj
 
-        stream = b2drop_client.make_stream_object(b2drop_path)
-        return put_file_into_bucket(bucket_id, key, stream, stream.length())
+
+class TransferJobList(ContentNegotiatedMethodView):
+    view_name = 'remotes_transfers'
+
+    def __init__(self, **kwargs):
+        """Constructor."""
+        super(TransferJobList, self).__init__(
+            serializers={
+                'application/json': dict_to_json_serializer,
+            },
+            default_media_type='application/json',
+            **kwargs
+        )
+
+    def post(self):
+        """Start the asynchronous transfer of B2DROP files into a bucket.
+
+        The request contains the ``source_remote_urls`` of the files and the
+        ``destination_bucket_url``. The progress of the returned job can be
+        polled at its ``self`` link.
+        """
+        from invenio_files_rest.models import Bucket
+        from invenio_files_rest.views import need_bucket_permission
+
+        json = request.get_json() or {}
+        source_remote_urls = json.get('source_remote_urls')
+        destination_bucket_url = json.get('destination_bucket_url')
+        if not source_remote_urls or not isinstance(source_remote_urls, list):
+            raise UserError("missing required source_remote_urls parameter")
+        if not destination_bucket_url:
+            raise UserError("missing required destination_bucket_url parameter")
+        max_files = current_app.config['B2DROP_TRANSFER_MAX_FILES']
+        if len(source_remote_urls) > max_files:
+            raise UserError("too many files; at most {} files can be "
+                            "transferred at once".format(max_files))
+        b2drop_paths = [b2drop_path_from_url(url)
+                        for url in source_remote_urls]
+
+        fileBucket_urlbase = url_for('invenio_files_rest.location_api', _external=True)
+        if not destination_bucket_url.startswith(fileBucket_urlbase):
+            raise UserError("bad destination_bucket_url; must point to a file bucket")
+        bucket_id = destination_bucket_url[len(fileBucket_urlbase):].strip('/')
+        bucket = Bucket.get(bucket_id) if bucket_id else None
+        if bucket is None:
+            abort(404, 'Bucket does not exist.')
+        credentials = b2drop_connection()
+
+        @need_bucket_permission('bucket-update')
+        def create_job(bucket):
+            return TransferJobs().create(current_user.get_id(), bucket.id,
+                                         b2drop_paths, credentials)
+
+        job_id = create_job(bucket=bucket)
+        try:
+            for index in range(len(b2drop_paths)):
+                transfer_b2drop_file.delay(job_id, index)
+        except Exception:
+            # the credentials are not left in the cache of a dead job
+            TransferJobs().delete_credentials(job_id)
+            raise
+        location = url_for('remotes.remotes_transfer', job_id=job_id,
+                           _external=True)
+        status = TransferJobs().status(job_id)
+        status['links'] = dict(self=location)
+        return status, 202, [('Location', location)]
+
+
+class TransferJob(ContentNegotiatedMethodView):
+    view_name = 'remotes_transfer'
+
+    def __init__(self, **kwargs):
+        """Constructor."""
+        super(TransferJob, self).__init__(
+            serializers={
+                'application/json': dict_to_json_serializer,
+            },
+            default_media_type='application/json',
+            **kwargs
+        )
+
+    def get(self, job_id):
+        """Return the progress of a transfer job."""
+        jobs = TransferJobs()
+        job = jobs.get(job_id)
+        if job is None or (job['user_id'] != current_user.get_id() and
+                           not Permission(superuser_access).can()):
+            abort(404)
+        status = jobs.status(job_id)
+        status['links'] = dict(self=request.url)
+        return status
 
 
 def put_file_into_bucket(bucket_id, key, stream, content_length):
@@ -158,6 +310,7 @@ def put_file_into_bucket(bucket_id, key, stream, content_length):
     from invenio_files_rest.models import Bucket, ObjectVersion
     from invenio_files_rest.views import need_bucket_permission
     from invenio_files_rest.errors import FileSizeError
+    from b2share.modules.files.storage import store_extra_checksums
 
     bucket = Bucket.get(bucket_id)
     if bucket is None:
@@ -177,6 +330,7 @@ def put_file_into_bucket(bucket_id, key, stream, content_length):
             obj = ObjectVersion.create(bucket, key)
             obj.set_contents(
                 stream, size=content_length, size_limit=size_limit)
+            store_extra_checksums(obj)
         db.session.commit()
         return obj
 
@@ -186,6 +340,16 @@ def put_file_into_bucket(bucket_id, key, stream, content_length):
 blueprint.add_url_rule('/remotes/jobs',
                        view_func=Jobs.as_view(Jobs.view_name))
 
+blueprint.add_url_rule('/remotes/transfers',
+                       view_func=TransferJobList.as_view(
+                           TransferJobList.view_name))
+
+blueprint.add_url_rule('/remotes/transfers/<job_id>',
+                       view_func=TransferJob.as_view(TransferJob.view_name))
+
+blueprint.add_url_rule('/remotes/metrics',
+                       view_func=RemoteMetrics.as_view(RemoteMetrics.view_name))
+
 blueprint.add_url_rule('/remotes/<service>',
                        view_func=RemoteList.as_view(RemoteList.view_name))
 
@@ -23,7 +23,10 @@
 
 from __future__ import absolute_import
 
+from functools import lru_cache
+
 import jsonschema
+from werkzeug.local import LocalProxy
 
 # metaschema is a restricted definition of the official jsonschema metaschema
 # see https://github.com/json-schema/json-schema/blob/master/draft-04/schema
@@ -113,11 +116,19 @@ restricted_metaschema = {
     },
 }
 
-jsonschema.Draft4Validator.check_schema(restricted_metaschema)
-metaschema_validator = jsonschema.Draft4Validator(restricted_metaschema)
+
+@lru_cache(maxsize=None)
+def get_metaschema_validator():
+    """Build the restricted metaschema validator on first use."""
+    jsonschema.Draft4Validator.check_schema(restricted_metaschema)
+    return jsonschema.Draft4Validator(restricted_metaschema)
+
+
+metaschema_validator = LocalProxy(get_metaschema_validator)
+
 
 def validate_metadata_schema(schema):
     """ The schema param must be a json/dict object.
         The function raises an error if the schema is invalid"""
     jsonschema.Draft4Validator.check_schema(schema)
-    metaschema_validator.validate(schema)
+    get_metaschema_validator().validate(schema)
@@ -0,0 +1,28 @@
+"""Add records_metadata (updated, id) index.
+
+Revision ID: c9a1e4b7d2f3
+Revises: 456bf6bcb1e6
+Create Date: 2026-10-19 10:12:31.512408
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9a1e4b7d2f3'
+down_revision = '456bf6bcb1e6'
+branch_labels = ()
+depends_on = (
+    '07fb52561c5c',  # invenio-records alter column from json to jsonb
+)
+
+
+def upgrade():
+    # Keyset pagination index of the records change feed.
+    op.create_index('ix_records_metadata_updated_id', 'records_metadata',
+                    ['updated', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_records_metadata_updated_id',
+                  table_name='records_metadata')
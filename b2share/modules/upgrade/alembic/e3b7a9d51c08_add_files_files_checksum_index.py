@@ -0,0 +1,27 @@
+"""Add files_files (checksum, size) index.
+
+Revision ID: e3b7a9d51c08
+Revises: c9a1e4b7d2f3
+Create Date: 2026-10-19 20:02:47.208731
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3b7a9d51c08'
+down_revision = 'c9a1e4b7d2f3'
+branch_labels = ()
+depends_on = (
+    '8ae99b034410',  # invenio-files-rest create files_objecttags table
+)
+
+
+def upgrade():
+    # Lookup of the file instances having the same content.
+    op.create_index('ix_files_files_checksum_size', 'files_files',
+                    ['checksum', 'size'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_files_files_checksum_size', table_name='files_files')
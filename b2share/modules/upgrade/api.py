@@ -23,8 +23,11 @@
 
 """B2Share upgrade api."""
 
+import multiprocessing
 import re
+import time
 import traceback
+import uuid
 import warnings
 import click
 
@@ -37,22 +40,28 @@ from flask import current_app
 from invenio_db import db
 
 from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy_utils.types import UUIDType
 from b2share.version import __version__
 
 from .errors import MigrationFromUnknownVersionError
 from .models import Migration
 
 
+def upgrade_request_context(app):
+    """Create the request context in which the upgrades run."""
+    base_url = urlunsplit((
+        app.config.get('PREFERRED_URL_SCHEME', 'http'),
+        app.config['JSONSCHEMAS_HOST'],
+        app.config.get('APPLICATION_ROOT') or '', '', ''
+    ))
+    return app.test_request_context('/', base_url=base_url)
+
+
 def with_request_context(f):
     """Runs the decorated function in a request context."""
     @wraps(f)
     def decorator(*args, **kwargs):
-        base_url = urlunsplit((
-            current_app.config.get('PREFERRED_URL_SCHEME', 'http'),
-            current_app.config['JSONSCHEMAS_HOST'],
-            current_app.config.get('APPLICATION_ROOT') or '', '', ''
-        ))
-        with current_app.test_request_context('/', base_url=base_url):
+        with upgrade_request_context(current_app):
             f(*args, **kwargs)
     return decorator
 
@@ -127,7 +136,9 @@ class UpgradeRecipe(object):
     An upgrade is composed of Steps which are run sequentially.
     Every Step is a function which is replayable if it fails but cannot be
     rollbacked once it succeeds.
-    A failed upgrade can be rerun.
+    A failed upgrade can be rerun. Steps migrating many rows should be
+    registered with :meth:`UpgradeRecipe.batched_step` so that they commit
+    by batch and resume where they stopped.
     """
     # dict of all upgrades. src_version -> dst_version -> upgrade
     upgrades = dict()
@@ -197,26 +208,120 @@ class UpgradeRecipe(object):
         cls.loaded = True
 
 
+    def batched_step(self, key, source=None, batch_size=1000, processes=1,
+                     condition=None):
+        """Function decorator registering a step which transforms rows by batch.
+
+        The rows are paginated on ``key``: each batch selects the next
+        ``batch_size`` keys of the ``source`` query. Each batch is committed
+        separately and the last committed key is saved in the migration data
+        as a checkpoint. A failed upgrade resumes after the checkpoint.
+
+        The decorated function is called with the list of rows of each batch.
+        It must be replayable: with several processes a batch can be committed
+        before the checkpoint of the previous batches. The ``source`` query
+        must not select the rows created by the function.
+
+        Example::
+
+            @upgrade.batched_step(RecordMetadata.id, batch_size=500)
+            def migrate_records(records):
+                '''Migrate the records metadata.'''
+                for record in records:
+                    ...
+
+        Args:
+            key: unique column used to paginate the rows, e.g. the primary
+                key. Its values must be integers, strings or UUIDs.
+            source: callable returning the query which selects the rows.
+                Defaults to all the rows of ``key``'s model.
+            batch_size: number of rows per batch.
+            processes: number of processes transforming the batches.
+            condition: see :meth:`UpgradeRecipe.step`.
+        """
+        if source is None:
+            def source():
+                return key.class_.query
+
+        def decorator(transform):
+            # docstring is mandatory
+            assert transform.__doc__ is not None
+
+            @wraps(transform)
+            def run(alembic, verbose):
+                self._run_batched_step(transform.__name__, transform, key,
+                                       source, batch_size, processes, verbose)
+            self.step(condition)(run)
+            return transform
+        return decorator
+
+    def _run_batched_step(self, step_name, transform, key, source,
+                          batch_size, processes, verbose):
+        """Run a step registered with :meth:`UpgradeRecipe.batched_step`."""
+        step_log = self._step_log
+        resumed = _last_checkpoint(self._failed_migration, self.dst_version,
+                                   step_name)
+        after = None
+        step_log['processed'] = 0
+        if resumed is not None:
+            after = _checkpoint_key(key, resumed['checkpoint'])
+            step_log['checkpoint'] = resumed['checkpoint']
+            step_log['processed'] = resumed.get('processed', 0)
+            if verbose:
+                click.secho('    resuming after {}'.format(after))
+
+        batches = _batch_bounds(key, source, batch_size, after)
+        if processes > 1:
+            results = _map_batches(transform, key, source, list(batches),
+                                   processes)
+        else:
+            results = (
+                (last, _transform_batch(transform, key, source, first, last))
+                for first, last in batches
+            )
+        start = time.time()
+        count = 0
+        for last, batch_count in results:
+            count += batch_count
+            step_log['checkpoint'] = _checkpoint_value(last)
+            step_log['processed'] += batch_count
+            # in a single process this commits the batch with its checkpoint
+            self._save_migration()
+            if verbose:
+                elapsed = time.time() - start
+                click.secho('    {} rows, {:.1f} rows/s'.format(
+                    step_log['processed'], count / elapsed if elapsed else 0
+                ))
+
+    def _save_migration(self):
+        """Save the state of the running migration and commit."""
+        if db.engine.dialect.has_table(db.engine, 'b2share_migrations'):
+            # The attribute is reloaded from the database after each commit,
+            # thus the data kept by the recipe is assigned again.
+            self._migration.data = self._migration_data
+            flag_modified(self._migration, 'data')
+            db.session.add(self._migration)
+        db.session.commit()
+
     @with_request_context
     def run(self, failed_migration=None, verbose=None):
         """Run the upgrade."""
         if not self.loaded:
             self.load()
         alembic = current_app.extensions['invenio-db'].alembic
-        migration = Migration(
-            version = self.dst_version,
-            data = dict(steps=[], error=None, status='start')
-        )
+        data = dict(steps=[], error=None, status='start')
+        self._migration = Migration(version=self.dst_version, data=data)
+        self._migration_data = data
+        self._failed_migration = failed_migration
         # save the migration state
-        if db.engine.dialect.has_table(db.engine, 'b2share_migrations'):
-            db.session.add(migration)
-            db.session.commit()
+        self._save_migration()
         for step in self.steps:
             step_log = dict(
                 name=step.run.__name__,
                 status='start'
             )
-            migration.data['steps'].append(step_log)
+            data['steps'].append(step_log)
+            self._step_log = step_log
             try:
                 alembic.migration_context.bind.close()
                 if step.condition is None or step.condition(alembic,
@@ -229,12 +334,12 @@ class UpgradeRecipe(object):
                     step_log['status'] = 'skip'
             except BaseException as e:
                 db.session.rollback()
-                migration.data['steps'].append(dict(
+                data['steps'].append(dict(
                     name=step.run.__name__,
                     status='error'
                 ))
-                migration.data['error'] = traceback.format_exc()
-                migration.data['status'] = 'error'
+                data['error'] = traceback.format_exc()
+                data['status'] = 'error'
                 if not db.engine.dialect.has_table(db.engine,
                                                    'b2share_migrations'):
                     click.secho(
@@ -246,16 +351,10 @@ class UpgradeRecipe(object):
                 raise e
             finally:
                 # save the migration state
-                if db.engine.dialect.has_table(db.engine,
-                                               'b2share_migrations'):
-                    flag_modified(migration, 'data')
-                    db.session.add(migration)
-                    db.session.commit()
+                self._save_migration()
         # mark the migration as successful and save it
-        migration.data['status'] = 'success'
-        db.session.add(migration)
-        flag_modified(migration, 'data')
-        db.session.commit()
+        data['status'] = 'success'
+        self._save_migration()
 
     @classmethod
     def build_upgrade_path(cls, src_version, dst_version):
@@ -297,6 +396,91 @@ class UpgradeRecipe(object):
                 queue.put(Branch(new_version, upgrades))
 
 
+def _last_checkpoint(failed_migration, target_version, step_name):
+    """Return the log of a batched step of a failed migration, if any."""
+    if not failed_migration or failed_migration.version != target_version:
+        return None
+    logs = [step for step in failed_migration.data['steps']
+            if step['name'] == step_name and 'checkpoint' in step]
+    return logs[-1] if logs else None
+
+
+def _checkpoint_value(key_value):
+    """Convert a key value so that it can be saved as JSON."""
+    if isinstance(key_value, uuid.UUID):
+        return str(key_value)
+    return key_value
+
+
+def _checkpoint_key(key, checkpoint):
+    """Convert a checkpoint read back from JSON to a value of the key."""
+    if isinstance(checkpoint, str) and isinstance(key.type, UUIDType):
+        return uuid.UUID(checkpoint)
+    return checkpoint
+
+
+def _batch_bounds(key, source, batch_size, after=None):
+    """Iterate over the first and last keys of each batch of rows."""
+    while True:
+        query = source().with_entities(key)
+        if after is not None:
+            query = query.filter(key > after)
+        keys = [row[0] for row in query.order_by(key).limit(batch_size)]
+        if not keys:
+            return
+        yield keys[0], keys[-1]
+        after = keys[-1]
+
+
+def _transform_batch(transform, key, source, first, last):
+    """Transform the rows having a key between first and last."""
+    rows = source().filter(key >= first, key <= last).order_by(key).all()
+    transform(rows)
+    return len(rows)
+
+
+_batch_worker = {}
+
+
+def _init_batch_worker(app):
+    """Initialize a process transforming batches."""
+    _batch_worker['context'] = upgrade_request_context(app)
+    _batch_worker['context'].push()
+    # The parent's connections must not be used by the children.
+    db.engine.dispose()
+
+
+def _run_batch_in_worker(bounds):
+    first, last = bounds
+    try:
+        count = _transform_batch(_batch_worker['transform'],
+                                 _batch_worker['key'],
+                                 _batch_worker['source'], first, last)
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+    return last, count
+
+
+def _map_batches(transform, key, source, bounds, processes):
+    """Transform and commit batches in a pool of processes.
+
+    Yields the last key and number of rows of each batch, in order.
+    """
+    app = current_app._get_current_object()
+    # The forked processes inherit the step.
+    _batch_worker.update(transform=transform, key=key, source=source)
+    # The parent's connections must not be used by the children.
+    db.session.commit()
+    db.engine.dispose()
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(processes, initializer=_init_batch_worker,
+                  initargs=(app,)) as pool:
+        for result in pool.imap(_run_batch_in_worker, bounds):
+            yield result
+
+
 def alembic_upgrade(target='heads'):
     """Upgrade the database using alembic.
 
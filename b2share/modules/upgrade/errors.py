@@ -39,3 +39,13 @@ class MigrationFromUnknownVersionError(ClickException):
         )
         self.current_version = current_version
         self.wanted_version = wanted_version
+
+
+class BatchIndexingError(ClickException):
+    """Exception raised when records of a batch could not be indexed."""
+
+    def __init__(self, errors):
+        ClickException.__init__(
+            self, '{0} records could not be indexed'.format(errors)
+        )
+        self.errors = errors
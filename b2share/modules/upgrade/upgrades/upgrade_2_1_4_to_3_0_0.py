@@ -28,11 +28,67 @@ from __future__ import absolute_import, print_function
 
 import pkg_resources
 
-from ..api import UpgradeRecipe
+from flask import current_app
+from invenio_db import db
+from invenio_pidstore.models import PersistentIdentifier, PIDStatus
+from invenio_records.models import RecordMetadata
+from invenio_search import current_search_client
+
+from b2share.modules.records.indexing import bulk_index_actions, send_bulk
+
+from ..api import UpgradeRecipe, alembic_upgrade
+from ..errors import BatchIndexingError
 
 
 migrate_2_1_4_to_3_0_0 = UpgradeRecipe('2.1.4', '3.0.0')
 
-# No changes to Elasticsearch mappings
 
-# There are no changes to the db schema, so no other updates are necessary
+@migrate_2_1_4_to_3_0_0.step()
+def elasticsearch_put_renditions_mapping(alembic, verbose):
+    """Add the OAI-PMH renditions field to the records index mapping.
+
+    It has to be added before any record is indexed with its renditions,
+    otherwise they would be mapped as text.
+    """
+    from b2share.modules.oaiserver.renditions import put_renditions_mapping
+    put_renditions_mapping()
+
+
+@migrate_2_1_4_to_3_0_0.step()
+def alembic_upgrade_database_schema(alembic, verbose):
+    """Add the index used by the records change feed."""
+    with db.session.begin_nested():
+        alembic_upgrade('c9a1e4b7d2f3')  # b2share-upgrade
+    db.session.commit()
+
+
+@migrate_2_1_4_to_3_0_0.step()
+def alembic_upgrade_files_checksum_index(alembic, verbose):
+    """Add the index used by the files deduplication."""
+    with db.session.begin_nested():
+        alembic_upgrade('e3b7a9d51c08')  # b2share-upgrade
+    db.session.commit()
+
+
+def _publications():
+    """Query the metadata of the published records."""
+    return RecordMetadata.query.join(
+        PersistentIdentifier,
+        PersistentIdentifier.object_uuid == RecordMetadata.id,
+    ).filter(
+        PersistentIdentifier.object_type == 'rec',
+        PersistentIdentifier.pid_type == 'b2rec',
+        PersistentIdentifier.status == PIDStatus.REGISTERED,
+    )
+
+
+@migrate_2_1_4_to_3_0_0.batched_step(RecordMetadata.id, source=_publications,
+                                     batch_size=500)
+def elasticsearch_index_renditions(records):
+    """Reindex the publications with their OAI-PMH renditions."""
+    if not current_app.config.get('B2SHARE_OAISERVER_RENDITIONS'):
+        return
+    _, errors = send_bulk(current_search_client,
+                          bulk_index_actions([r.id for r in records]))
+    if errors:
+        raise BatchIndexingError(errors)
@@ -4,5 +4,7 @@
 
 from .factory import create_app as b2share_ui
 
-# B2SHARE UI application.
-ui = b2share_ui()
+# B2SHARE UI application, served by the uwsgi configurations of the UI
+# (docker/uwsgi/uwsgi_ui.ini and b2share/wsgi_ui.ini).
+# The API is only created if the process serves API requests.
+ui = b2share_ui(B2SHARE_LAZY_API_MOUNT=True)
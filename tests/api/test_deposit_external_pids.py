@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2020 EUDAT.
+#
+# B2SHARE is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+"""Test the reconciliation of the external PIDs of a deposit."""
+
+import pytest
+from invenio_db import db
+from invenio_files_rest.models import Bucket, FileInstance, ObjectVersion
+from invenio_records.api import Record
+from invenio_records_files.models import RecordsBuckets
+
+from b2share.modules.deposit.api import create_b2safe_file
+from b2share.modules.deposit.errors import InvalidDepositError
+
+HANDLE = 'http://hdl.handle.net/'
+
+
+def _commit_external_pids(bucket, external_pids):
+    """Apply external PIDs as Deposit.commit does."""
+    create_b2safe_file([dict(key=key, ePIC_PID=pid)
+                        for key, pid in external_pids], bucket, replace=True)
+    db.session.commit()
+
+
+def _heads(bucket):
+    """Return the URI of the head of each key, None for deleted keys."""
+    return {
+        obj.key: obj.file.uri if obj.file_id else None
+        for obj in ObjectVersion.query.filter_by(bucket_id=bucket.id,
+                                                 is_head=True)
+    }
+
+
+@pytest.fixture
+def bucket(app, db, location):
+    """Bucket of a record."""
+    bucket = Bucket.create()
+    RecordsBuckets.create(record=Record.create({}).model, bucket=bucket)
+    db.session.commit()
+    return bucket
+
+
+def test_add_change_remove(bucket):
+    """Test adding, changing and removing external PIDs."""
+    _commit_external_pids(bucket, [('a', '11304/a'), ('b', '11304/b')])
+    assert _heads(bucket) == {'a': HANDLE + '11304/a',
+                              'b': HANDLE + '11304/b'}
+    files = FileInstance.query.filter(FileInstance.uri.in_(
+        [HANDLE + '11304/a', HANDLE + '11304/b'])).all()
+    assert len(files) == 2
+    assert all(f.storage_class == 'B' and f.size == 1 for f in files)
+    assert Bucket.get(bucket.id).size == 2
+    version_a = ObjectVersion.get(bucket, 'a').version_id
+
+    # the same PIDs do not create new versions
+    _commit_external_pids(bucket, [('a', '11304/a'), ('b', '11304/b')])
+    assert ObjectVersion.query.filter_by(bucket_id=bucket.id).count() == 2
+
+    # the file instance of a changed PID is updated in place
+    _commit_external_pids(bucket, [('a', '11304/a2'), ('b', '11304/b')])
+    assert _heads(bucket) == {'a': HANDLE + '11304/a2',
+                              'b': HANDLE + '11304/b'}
+    assert ObjectVersion.get(bucket, 'a').version_id == version_a
+    assert FileInstance.query.filter_by(
+        uri=HANDLE + '11304/a').count() == 0
+    assert Bucket.get(bucket.id).size == 2
+
+    # a removed PID leaves a delete marker
+    _commit_external_pids(bucket, [('b', '11304/b')])
+    assert _heads(bucket) == {'a': None, 'b': HANDLE + '11304/b'}
+    assert ObjectVersion.get(bucket, 'a') is None
+    assert FileInstance.query.filter_by(
+        uri=HANDLE + '11304/a2').count() == 1
+
+    # a removed key can be added again
+    _commit_external_pids(bucket, [('a', '11304/a2'), ('b', '11304/b')])
+    assert _heads(bucket) == {'a': HANDLE + '11304/a2',
+                              'b': HANDLE + '11304/b'}
+    assert Bucket.get(bucket.id).size == 3
+
+
+def test_duplicates(bucket):
+    """Test the errors of duplicate keys and URIs."""
+    with pytest.raises(InvalidDepositError):
+        _commit_external_pids(bucket, [('a', '11304/a'), ('a', '11304/b')])
+
+    # a PID which is the URI of a file stored by B2SHARE
+    FileInstance.create().set_uri(HANDLE + '11304/local', 10, 'md5:0',
+                                  storage_class='S')
+    db.session.commit()
+    with pytest.raises(InvalidDepositError):
+        _commit_external_pids(bucket, [('a', '11304/local')])
+    db.session.rollback()
+    assert _heads(bucket) == {}
+    assert Bucket.get(bucket.id).size == 0
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2020 EUDAT.
+#
+# B2SHARE is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+"""Test the ZIP archives of the files of a bucket."""
+
+import json
+import os
+import zipfile
+
+from invenio_db import db
+from invenio_files_rest.models import Bucket, FileInstance, ObjectVersion
+from six import BytesIO
+
+from b2share.modules.files.archive import B2SAFE_MANIFEST, ZipStream, \
+    bucket_archive_entries
+from b2share.modules.records.cache import LocalLRUCache
+
+DATA = os.urandom(10000)
+B2SAFE_URI = 'http://hdl.handle.net/11304/remote'
+
+
+def _archive(bucket, crc_cache):
+    """Create the archive of a bucket, as a new request would."""
+    return ZipStream(bucket_archive_entries(bucket), crc_cache=crc_cache,
+                     chunk_size=1000)
+
+
+def test_bucket_archive(app, db, location):
+    """Test reading the archive and a resumed range of it with zipfile."""
+    bucket = Bucket.create()
+    ObjectVersion.create(bucket, 'data.bin', stream=BytesIO(DATA))
+    ObjectVersion.create(bucket, 'empty.txt', stream=BytesIO(b''))
+    remote = FileInstance.create()
+    remote.set_uri(B2SAFE_URI, 1, None, storage_class='B')
+    ObjectVersion.create(bucket, 'remote.dat', _file_id=remote.id)
+    db.session.commit()
+
+    crc_cache = LocalLRUCache()
+    archive = _archive(bucket, crc_cache)
+    full = b''.join(archive.iter_bytes())
+    assert len(full) == archive.size
+
+    with zipfile.ZipFile(BytesIO(full)) as zf:
+        assert zf.namelist() == ['data.bin', 'empty.txt', B2SAFE_MANIFEST]
+        # checks the CRC-32 of every file
+        assert zf.testzip() is None
+        assert zf.read('data.bin') == DATA
+        assert zf.read('empty.txt') == b''
+        assert json.loads(zf.read(B2SAFE_MANIFEST).decode('utf-8')) == [
+            dict(key='remote.dat', url=B2SAFE_URI)]
+
+    # a download interrupted in the middle of data.bin
+    split = 5000
+    first = b''.join(_archive(bucket, LocalLRUCache()).iter_bytes(0, split))
+    assert first == full[:split]
+    # resumed with the cached CRC-32, or by reading the file again
+    for cache in (crc_cache, None):
+        resumed = _archive(bucket, cache)
+        assert resumed.size == archive.size
+        rest = b''.join(resumed.iter_bytes(split))
+        with zipfile.ZipFile(BytesIO(first + rest)) as zf:
+            assert zf.testzip() is None
+            assert zf.read('data.bin') == DATA
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2020 EUDAT.
+#
+# B2SHARE is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+"""Test the deduplication of the file instances."""
+
+import os
+
+from invenio_files_rest.models import Bucket, FileInstance, \
+    MultipartObject, ObjectVersion
+from six import BytesIO
+
+from b2share.modules.files import dedup
+
+DATA = b'duplicated content'
+
+
+def _create_file(bucket, key, data=DATA):
+    """Create an object and return its file instance."""
+    return ObjectVersion.create(bucket, key, stream=BytesIO(data)).file
+
+
+def _overwrite(fileinstance, data):
+    """Change the data of a file without changing its checksum."""
+    with open(fileinstance.uri, 'wb') as fp:
+        fp.write(data)
+
+
+def _file_ids(bucket):
+    """Return the file instance of each key of a bucket."""
+    return dict((obj.key, obj.file_id) for obj in
+                ObjectVersion.query.filter_by(bucket_id=bucket.id))
+
+
+def test_merge(app, db, location):
+    """Test that only the data of the merged duplicates is deleted."""
+    bucket, other_bucket = Bucket.create(), Bucket.create()
+    original = _create_file(bucket, 'a.txt')
+    duplicate = _create_file(other_bucket, 'b.txt')
+    different = _create_file(other_bucket, 'c.txt')
+    unique = _create_file(bucket, 'd.txt', b'unique content')
+    db.session.commit()
+    # same checksum and size, but different data
+    _overwrite(different, b'x' * len(DATA))
+    ids = dict(original=original.id, duplicate=duplicate.id,
+               different=different.id)
+    paths = dict(original=original.uri, duplicate=duplicate.uri,
+                 different=different.uri, unique=unique.uri)
+
+    dry_run = [(o.id, d.id, status) for o, d, status in
+               dedup.deduplicate_files(dry_run=True)]
+    assert dry_run == [(ids['original'], ids['duplicate'], dedup.DUPLICATE),
+                       (ids['original'], ids['different'], dedup.DIFFERENT)]
+    assert all(os.path.exists(path) for path in paths.values())
+
+    results = [(o.id, d.id, status) for o, d, status in
+               dedup.deduplicate_files()]
+    assert results == [(ids['original'], ids['duplicate'], dedup.MERGED),
+                       (ids['original'], ids['different'], dedup.DIFFERENT)]
+    assert _file_ids(other_bucket) == {'b.txt': ids['original'],
+                                       'c.txt': ids['different']}
+    assert FileInstance.query.filter_by(id=ids['duplicate']).count() == 0
+    assert dedup.file_references(ids['original']) == 2
+    assert not os.path.exists(paths['duplicate'])
+    assert os.path.exists(paths['original'])
+    assert os.path.exists(paths['different'])
+    assert os.path.exists(paths['unique'])
+
+
+def test_verify_different_content(app, db, location):
+    """Test that files with different data are not merged after upload."""
+    bucket = Bucket.create()
+    original = _create_file(bucket, 'a.txt')
+    different = _create_file(bucket, 'b.txt')
+    db.session.commit()
+    _overwrite(different, b'x' * len(DATA))
+    different_id = different.id
+
+    assert dedup.deduplicate_file(different_id, verify=True) is None
+    assert _file_ids(bucket)['b.txt'] == different_id
+    assert os.path.exists(different.uri)
+
+    # without verification the checksum is trusted
+    assert dedup.deduplicate_file(different_id, verify=False).id == \
+        original.id
+    assert _file_ids(bucket)['b.txt'] == original.id
+
+
+def test_multipart_upload(app, db, location, monkeypatch):
+    """Test that a file of a multipart upload is not merged."""
+    monkeypatch.setitem(app.config, 'FILES_REST_MULTIPART_CHUNKSIZE_MIN', 2)
+    bucket = Bucket.create()
+    original = _create_file(bucket, 'a.txt')
+    duplicate = _create_file(bucket, 'b.txt')
+    multipart = MultipartObject.create(bucket, 'c.txt', size=4, chunk_size=2)
+    multipart.file = duplicate
+    db.session.commit()
+    duplicate_id = duplicate.id
+
+    assert not dedup.merge_file_instance(duplicate, original)
+    results = [(d.id, status) for _, d, status in dedup.deduplicate_files()]
+    assert results == [(duplicate_id, dedup.REFERENCED)]
+    assert _file_ids(bucket)['b.txt'] == duplicate_id
+    assert os.path.exists(duplicate.uri)
+
+
+def test_referenced_in_the_meantime(app, db, location, monkeypatch):
+    """Test that a file referenced during the merge is kept."""
+    bucket, other_bucket = Bucket.create(), Bucket.create()
+    original = _create_file(bucket, 'a.txt')
+    duplicate = _create_file(bucket, 'b.txt')
+    db.session.commit()
+    duplicate_id, duplicate_uri = duplicate.id, duplicate.uri
+
+    delete = FileInstance.delete
+
+    def reference_then_delete(fileinstance):
+        ObjectVersion.create(other_bucket, 'new.txt',
+                             _file_id=fileinstance.id)
+        db.session.flush()
+        delete(fileinstance)
+
+    monkeypatch.setattr(FileInstance, 'delete', reference_then_delete)
+    results = [(d.id, status) for _, d, status in dedup.deduplicate_files()]
+    assert results == [(duplicate_id, dedup.REFERENCED)]
+    # the merge is rolled back
+    assert _file_ids(bucket) == {'a.txt': original.id, 'b.txt': duplicate_id}
+    assert FileInstance.query.filter_by(id=duplicate_id).count() == 1
+    assert os.path.exists(duplicate_uri)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2020 EUDAT.
+#
+# B2SHARE is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+"""Test the garbage collection of the files."""
+
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+from invenio_db import db
+from invenio_files_rest.helpers import make_path
+from invenio_files_rest.models import Bucket, FileInstance, ObjectVersion
+from invenio_records.api import Record
+from invenio_records_files.models import RecordsBuckets
+from six import BytesIO
+
+from b2share.modules.files import gc
+from b2share.modules.files.verification import Throttle
+
+
+def _collect(**kwargs):
+    """Collect the garbage, returning the collected ids by kind."""
+    kwargs.setdefault('grace_period', timedelta(0))
+    collected = {}
+    for kind, id_, _ in gc.collect_garbage(batch_size=10, delete_rate=1000,
+                                           **kwargs):
+        collected.setdefault(kind, set()).add(id_)
+    return collected
+
+
+def _create_file(bucket, key, data=b'data'):
+    """Create an object and return it with the path of its file."""
+    obj = ObjectVersion.create(bucket, key, stream=BytesIO(data))
+    db.session.commit()
+    return obj, obj.file.uri
+
+
+def _storage_path(location, file_id):
+    """Return the path where the storage writes a file instance."""
+    config = current_app.config
+    return make_path(location.uri, str(file_id), 'data',
+                     config['FILES_REST_STORAGE_PATH_DIMENSIONS'],
+                     config['FILES_REST_STORAGE_PATH_SPLIT_LENGTH'])
+
+
+def _write_stray_file(location, file_id=None):
+    """Write a file in the layout of the storage, without file instance."""
+    path = _storage_path(location, file_id or uuid.uuid4())
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as fp:
+        fp.write(b'stray')
+    return path
+
+
+def test_grace_period(app, db, location):
+    """Test that the garbage younger than the grace period is kept."""
+    bucket = Bucket.create()
+    obj, path = _create_file(bucket, 'file.txt')
+    bucket_id, file_uri = str(bucket.id), obj.file.uri
+
+    collected = _collect(grace_period=timedelta(days=1))
+    assert bucket_id not in collected.get(gc.BUCKET, set())
+    assert file_uri not in collected.get(gc.FILE_INSTANCE, set())
+    assert os.path.exists(path)
+
+    collected = _collect()
+    assert bucket_id in collected[gc.BUCKET]
+    assert file_uri in collected[gc.FILE_INSTANCE]
+    assert Bucket.query.filter_by(id=bucket_id).count() == 0
+    assert not os.path.exists(path)
+
+
+def test_referenced_in_the_meantime(app, db, location, monkeypatch):
+    """Test that the file instances referenced during the collection stay."""
+    bucket = Bucket.create()
+    obj, _ = _create_file(bucket, 'file.txt')
+    referenced = obj.file
+    orphan = FileInstance.create()
+    orphan.set_contents(BytesIO(b'orphan'), default_location=location.uri)
+    obj.remove()
+    db.session.commit()
+    referenced_id, orphan_id = referenced.id, orphan.id
+    referenced_uri, orphan_uri = referenced.uri, orphan.uri
+    kept_bucket = Bucket.create()
+    db.session.commit()
+
+    batches = gc._batches
+
+    def reference_during_collection(*args, **kwargs):
+        for batch in batches(*args, **kwargs):
+            if any(f.id == referenced_id for f in batch):
+                ObjectVersion.create(kept_bucket, 'file.txt',
+                                     _file_id=referenced_id)
+                db.session.flush()
+            yield batch
+
+    monkeypatch.setattr(gc, '_batches', reference_during_collection)
+    collected = list(gc.collect_file_instances(
+        datetime.utcnow(), 10, Throttle()))
+    uris = set(uri for _, uri, _ in collected)
+    assert referenced_uri not in uris
+    assert orphan_uri in uris
+    assert FileInstance.query.filter_by(id=referenced_id).count() == 1
+    assert FileInstance.query.filter_by(id=orphan_id).count() == 0
+    assert os.path.exists(referenced_uri)
+    assert not os.path.exists(orphan_uri)
+
+
+def test_disk_files(app, db, location):
+    """Test the matching of the disk files with the file instances."""
+    bucket = Bucket.create()
+    RecordsBuckets.create(record=Record.create({}).model, bucket=bucket)
+    _, path = _create_file(bucket, 'file.txt')
+    # a file instance whose URI is written differently
+    moved = FileInstance.create()
+    moved_path = _write_stray_file(location)
+    moved.set_uri('file://' + moved_path, 5, None)
+    ObjectVersion.create(bucket, 'moved.txt', _file_id=moved.id)
+    db.session.commit()
+    stray = _write_stray_file(location)
+
+    # the disk files are only collected on demand
+    _collect()
+    assert os.path.exists(stray)
+
+    collected = _collect(disk_files=True)
+    assert collected[gc.DISK_FILE] == set([os.path.normpath(stray)])
+    assert not os.path.exists(stray)
+    assert os.path.exists(path)
+    assert os.path.exists(moved_path)
+
+
+def test_disk_files_of_unknown_location(app, db, location):
+    """Test that no file is deleted when no file instance matches."""
+    stray = _write_stray_file(location)
+    collected = _collect(disk_files=True)
+    assert gc.DISK_FILE not in collected
+    assert os.path.exists(stray)
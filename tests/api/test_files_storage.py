@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2020 EUDAT.
+#
+# B2SHARE is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+"""Test the storage of the files."""
+
+import hashlib
+import zlib
+
+from invenio_db import db
+from invenio_files_rest.models import Bucket, FileInstance, ObjectVersion, \
+    ObjectVersionTag
+from six import BytesIO
+
+from b2share.modules.files.storage import CHECKSUM_TAG_PREFIX, \
+    ChecksumFileStorage, b2share_storage_factory, store_extra_checksums
+
+DATA = b'some file content' * 1000
+
+
+def test_upload_checksums(app, db, location, monkeypatch):
+    """Test that an upload computes the MD5 and the additional checksums."""
+    monkeypatch.setitem(app.config, 'B2SHARE_FILES_EXTRA_CHECKSUMS',
+                        ['sha256', 'adler32'])
+    bucket = Bucket.create()
+    fileinstance = FileInstance.create()
+    storage = b2share_storage_factory(
+        fileinstance=fileinstance, default_location=location.uri,
+        default_storage_class='S')
+    assert isinstance(storage, ChecksumFileStorage)
+    uri, size, checksum = storage.save(BytesIO(DATA), chunk_size=1000)
+    fileinstance.set_uri(uri, size, checksum)
+    obj = ObjectVersion.create(bucket, 'file.txt')
+    obj.set_file(fileinstance)
+    assert store_extra_checksums(obj)
+    db.session.commit()
+
+    assert size == len(DATA)
+    assert checksum == 'md5:' + hashlib.md5(DATA).hexdigest()
+    tags = dict((tag.key, tag.value) for tag in ObjectVersionTag.query.filter(
+        ObjectVersionTag.version_id == obj.version_id))
+    assert tags == {
+        CHECKSUM_TAG_PREFIX + 'sha256':
+            'sha256:' + hashlib.sha256(DATA).hexdigest(),
+        CHECKSUM_TAG_PREFIX + 'adler32':
+            'adler32:{:08x}'.format(zlib.adler32(DATA)),
+    }
+    # the checksum was computed from the written data
+    assert fileinstance.last_check is True
+    with open(uri, 'rb') as fp:
+        assert fp.read() == DATA
+
+    # the tags are only stored once
+    assert not store_extra_checksums(obj)
+
+
+def test_linked_file_checksums(app, db, location, monkeypatch):
+    """Test the checksums of a file written outside of the storage."""
+    monkeypatch.setitem(app.config, 'B2SHARE_FILES_EXTRA_CHECKSUMS',
+                        ['sha256'])
+    bucket = Bucket.create()
+    fileinstance = FileInstance.create()
+    storage = b2share_storage_factory(
+        fileinstance=fileinstance, default_location=location.uri,
+        default_storage_class='S')
+    checksum = storage._compute_checksum(BytesIO(DATA))
+    assert checksum == 'md5:' + hashlib.md5(DATA).hexdigest()
+
+    obj = ObjectVersion.create(bucket, 'file.txt')
+    obj.set_file(fileinstance)
+    assert store_extra_checksums(obj)
+    tag = ObjectVersionTag.get(obj, CHECKSUM_TAG_PREFIX + 'sha256')
+    assert tag.value == 'sha256:' + hashlib.sha256(DATA).hexdigest()
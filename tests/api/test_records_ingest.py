@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2020 EUDAT.
+#
+# B2SHARE is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+"""Test the bulk ingestion of records."""
+
+import json
+
+import pytest
+from invenio_accounts.testutils import create_test_user
+from invenio_pidstore.models import PersistentIdentifier
+from invenio_records.api import Record
+from invenio_records.models import RecordMetadata
+from jsonschema.exceptions import ValidationError
+from six import StringIO
+
+from b2share.modules.records import ingest
+from b2share.modules.records.indexing import DeferrableRecordIndexer
+
+
+def _ingest_record(data, id_, files_dir=None, link_mode=None, publish=True):
+    """Create a plain record instead of a deposit."""
+    if data.get('invalid'):
+        raise ValidationError('invalid record')
+    if data.get('broken'):
+        raise RuntimeError('broken record')
+    record = Record.create(dict(data, files=files_dir is not None), id_=id_)
+    DeferrableRecordIndexer().index(record)
+    return record
+
+
+@pytest.fixture
+def records_dir(tmpdir):
+    """Directory of records, the records 2 and 4 failing."""
+    records = [
+        {'title': '0'}, {'title': '1'}, {'title': '2', 'invalid': True},
+        {'title': '3'}, {'title': '4', 'broken': True}, {'title': '5'},
+        {'title': '6'},
+    ]
+    for number, record in enumerate(records):
+        tmpdir.join('record-{}.json'.format(number)).write(json.dumps(record))
+    tmpdir.join('record-7.json').write('not JSON')
+    tmpdir.join('record-8.json').write(json.dumps({'_pid': []}))
+    tmpdir.mkdir('record-0').join('data.txt').write('data')
+    return tmpdir
+
+
+def test_ingest_records(app, db, records_dir, monkeypatch):
+    """Test the batches, the error file and the release of the PIDs."""
+    monkeypatch.setattr(ingest, 'ingest_record', _ingest_record)
+    owner = create_test_user('owner@example.org')
+    error_file = StringIO()
+    errors = ingest.IngestionErrors(error_file)
+    indexed_batches = []
+    progress = []
+
+    def index(record_ids):
+        # the batch is committed
+        db.session.rollback()
+        assert RecordMetadata.query.filter(
+            RecordMetadata.id.in_(record_ids)).count() == len(record_ids)
+        indexed_batches.append(record_ids)
+
+    ingested = ingest.ingest_records(
+        str(records_dir), owner, errors, batch_size=3, index_callback=index,
+        progress_callback=progress.append)
+
+    assert ingested == 5
+    assert progress == [2, 4, 5]
+    titles = dict((str(model.id), model.json['title'])
+                  for model in RecordMetadata.query)
+    assert sorted(titles.values()) == ['0', '1', '3', '5', '6']
+    assert [sorted(titles[id_] for id_ in batch)
+            for batch in indexed_batches] == [['0', '1'], ['3', '5'], ['6']]
+    # the files directory of a record is passed on
+    assert [model.json['title'] for model in RecordMetadata.query
+            if model.json['files']] == ['0']
+
+    failures = [json.loads(line)
+                for line in error_file.getvalue().splitlines()]
+    assert errors.count == 4
+    assert [(f['path'].rsplit('/', 1)[-1], f['stage']) for f in failures] == [
+        ('record-2.json', ingest.VALIDATE),
+        ('record-4.json', ingest.CREATE),
+        ('record-7.json', ingest.PARSE),
+        ('record-8.json', ingest.PARSE),
+    ]
+
+    # only the PIDs of the ingested records are kept
+    pid_values = set(pid.pid_value for pid in PersistentIdentifier.query)
+    assert pid_values == set(uuid_.replace('-', '') for uuid_ in titles)
+    assert PersistentIdentifier.query.count() == 2 * ingested
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2020 EUDAT.
+#
+# B2SHARE is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+"""Test the batched upgrade steps."""
+
+import pytest
+from invenio_records.api import Record
+from invenio_records.models import RecordMetadata
+
+from b2share.modules.upgrade.api import UpgradeRecipe
+from b2share.modules.upgrade.models import Migration
+
+SRC_VERSION = 'test-batched-src'
+DST_VERSION = 'test-batched-dst'
+
+# read by the forked processes
+_failing = {}
+
+
+def _count_records(records):
+    """Count the transformations of each record."""
+    if _failing.get('id') in set(r.id for r in records):
+        raise ValueError('failing batch')
+    for record in records:
+        record.json = dict(record.json, count=record.json['count'] + 1)
+
+
+@pytest.fixture
+def recipe():
+    """Upgrade recipe which is removed after the test."""
+    recipe = UpgradeRecipe(SRC_VERSION, DST_VERSION)
+    yield recipe
+    del UpgradeRecipe.upgrades[SRC_VERSION]
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_resume_after_checkpoint(app, db, recipe, processes):
+    """Test that a failed batched step resumes after its checkpoint."""
+    ids = sorted(Record.create({'count': 0}).id for _ in range(7))
+    db.session.commit()
+
+    recipe.batched_step(RecordMetadata.id, batch_size=2,
+                        processes=processes)(_count_records)
+
+    # the third batch fails
+    _failing['id'] = ids[4]
+    try:
+        with pytest.raises(ValueError):
+            recipe.run()
+    finally:
+        _failing.clear()
+    failed = Migration.query.filter_by(version=DST_VERSION).one()
+    assert failed.data['status'] == 'error'
+    step_log = failed.data['steps'][0]
+    assert step_log['checkpoint'] == str(ids[3])
+    assert step_log['processed'] == 4
+
+    recipe.run(failed_migration=failed)
+    db.session.expire_all()
+    counts = [RecordMetadata.query.get(id_).json['count'] for id_ in ids]
+    # the committed batches are not transformed again
+    assert counts[:6] == [1] * 6
+    if processes == 1:
+        assert counts[6] == 1
+    else:
+        # the last batch may have been committed before the failure
+        assert counts[6] >= 1
+    succeeded = [m for m in Migration.query.filter_by(version=DST_VERSION)
+                 if m.success]
+    assert len(succeeded) == 1
+    assert succeeded[0].data['steps'][0]['processed'] == 7
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2020 EUDAT.
+#
+# B2SHARE is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+"""Test the startup cost of B2SHARE modules."""
+
+from __future__ import absolute_import, print_function
+
+import pytest
+
+from b2share.modules.b2share_main.profiling import parse_import_times, \
+    profile_imports
+
+IMPORT_TIME_BUDGET_US = 5 * 1000 * 1000
+"""Maximum cumulative import time of the application factory."""
+
+
+def test_parse_import_times():
+    """Test parsing of the import time report."""
+    output = '\n'.join([
+        'import time: self [us] | cumulative | imported package',
+        'import time:        12 |         12 |   b',
+        'import time:        30 |         42 | a',
+        'unrelated line',
+    ])
+    times = parse_import_times(output)
+    assert [(t.module, t.self_us, t.cumulative_us) for t in times] == [
+        ('b', 12, 12), ('a', 30, 42)
+    ]
+
+
+def test_serializers_are_lazy():
+    """Test that importing the serializers doesn't build the XML ones."""
+    pytest.importorskip('invenio_records_rest')
+    modules = {t.module for t in profile_imports(
+        'b2share.modules.records.serializers')}
+    assert 'dojson.contrib.to_marc21' not in modules
+    assert 'invenio_marc21.serializers.marcxml' not in modules
+
+
+def test_factory_import_time_budget():
+    """Test that the application factory imports within its budget."""
+    pytest.importorskip('invenio_base')
+    times = profile_imports('b2share.factory')
+    assert max(t.cumulative_us for t in times) < IMPORT_TIME_BUDGET_US
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2020 EUDAT.
+#
+# B2SHARE is free software; you can redistribute it and/or modify it under
+# the terms of the MIT License; see LICENSE file for more details.
+
+"""Test the v1 downloader against a local HTTP server."""
+
+from __future__ import absolute_import, print_function
+
+import hashlib
+import json
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+pytest.importorskip('flask')
+
+from b2share.modules.b2share_demo.downloader import MANIFEST_FILE, \
+    RECORD_FILE, Manifest, V1Downloader  # noqa: E402
+
+FILES = {
+    'a.txt': b'first file content',
+    'b.bin': os.urandom(100000),
+}
+
+
+def _file_dict(recid, name, **kwargs):
+    data = FILES[name]
+    file_dict = dict(
+        name=name, size=len(data),
+        checksum='md5:' + hashlib.md5(data).hexdigest(),
+        url='https://b2share.eudat.eu/record/{}/files/{}'.format(recid, name),
+    )
+    file_dict.update(kwargs)
+    return file_dict
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _V1Handler(BaseHTTPRequestHandler):
+    """Minimal v1 API: record listing and file downloads with ranges."""
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        state = self.server.state
+        url = urlsplit(self.path)
+        if url.path == '/api/records':
+            page = int(parse_qs(url.query)['page_offset'][0])
+            records = state['records'] if page == 0 else []
+            self._send(200, json.dumps(dict(records=records)).encode())
+            return
+        match = re.match(r'^/record/(\d+)/files/(.+)$', url.path)
+        if not match:
+            self._send(404, b'')
+            return
+        state['requests'].append((url.path, self.headers.get('Range')))
+        data = FILES[match.group(2)]
+        range_header = self.headers.get('Range')
+        if range_header:
+            start = int(re.match(r'bytes=(\d+)-', range_header).group(1))
+            if start >= len(data):
+                self._send(416, b'')
+                return
+            self._send(206, data[start:], [(
+                'Content-Range',
+                'bytes {}-{}/{}'.format(start, len(data) - 1, len(data)))])
+            return
+        self._send(200, data)
+
+
+@pytest.fixture
+def v1_server():
+    """Serve a v1 API on a local port."""
+    server = _ThreadingHTTPServer(('127.0.0.1', 0), _V1Handler)
+    server.state = dict(records=[], requests=[])
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:{}/api/'.format(server.server_port), server.state
+    server.shutdown()
+    server.server_close()
+
+
+def _downloader(base_url, target_dir):
+    return V1Downloader(base_url, 'token', str(target_dir), workers=2,
+                        chunk_size=4096, echo=lambda *args: None)
+
+
+def test_download_and_manifest_skip(v1_server, tmpdir):
+    """Test downloading records, then skipping them on a new run."""
+    base_url, state = v1_server
+    state['records'] = [
+        dict(record_id=1, title='one', files=[_file_dict(1, 'a.txt'),
+                                              _file_dict(1, 'b.bin')]),
+        dict(record_id=2, title='two', files=[]),
+    ]
+    assert _downloader(base_url, tmpdir).download() == []
+
+    assert tmpdir.join('1', 'file_0').read_binary() == FILES['a.txt']
+    assert tmpdir.join('1', 'file_1').read_binary() == FILES['b.bin']
+    assert json.loads(tmpdir.join('1', RECORD_FILE).read())['title'] == 'one'
+    manifest = Manifest(str(tmpdir.join(MANIFEST_FILE)))
+    assert manifest.is_complete('1') and manifest.is_complete('2')
+    assert len(state['requests']) == 2
+
+    # a new run only lists the records
+    assert _downloader(base_url, tmpdir).download() == []
+    assert len(state['requests']) == 2
+
+
+def test_resume_with_range(v1_server, tmpdir):
+    """Test resuming an interrupted download with a Range request."""
+    base_url, state = v1_server
+    state['records'] = [dict(record_id=1, files=[_file_dict(1, 'b.bin')])]
+    tmpdir.mkdir('1').join('file_0.part').write_binary(FILES['b.bin'][:1000])
+
+    assert _downloader(base_url, tmpdir).download() == []
+    assert state['requests'] == [('/record/1/files/b.bin', 'bytes=1000-')]
+    assert tmpdir.join('1', 'file_0').read_binary() == FILES['b.bin']
+    assert not tmpdir.join('1', 'file_0.part').exists()
+
+
+def test_resume_complete_part(v1_server, tmpdir):
+    """Test a partial file which was completely downloaded."""
+    base_url, state = v1_server
+    state['records'] = [dict(record_id=1, files=[_file_dict(1, 'a.txt')])]
+    tmpdir.mkdir('1').join('file_0.part').write_binary(FILES['a.txt'])
+
+    assert _downloader(base_url, tmpdir).download() == []
+    assert tmpdir.join('1', 'file_0').read_binary() == FILES['a.txt']
+
+
+def test_size_mismatch(v1_server, tmpdir):
+    """Test that a file with an unexpected size is not accepted."""
+    base_url, state = v1_server
+    state['records'] = [dict(record_id=1, files=[
+        _file_dict(1, 'a.txt', size=len(FILES['a.txt']) - 1)])]
+
+    errors = _downloader(base_url, tmpdir).download()
+    assert len(errors) == 1 and 'size' in errors[0]
+    assert not tmpdir.join('1', 'file_0').exists()
+    # the too large partial file is removed
+    assert not tmpdir.join('1', 'file_0.part').exists()
+    manifest = Manifest(str(tmpdir.join(MANIFEST_FILE)))
+    assert not manifest.is_complete('1')
+
+
+def test_checksum_mismatch(v1_server, tmpdir):
+    """Test that a file with an unexpected checksum is not accepted."""
+    base_url, state = v1_server
+    state['records'] = [dict(record_id=1, files=[
+        _file_dict(1, 'a.txt', checksum='md5:' + '0' * 32)])]
+
+    errors = _downloader(base_url, tmpdir).download()
+    assert len(errors) == 1 and 'checksum' in errors[0]
+    assert not tmpdir.join('1', 'file_0').exists()
+    assert not tmpdir.join('1', 'file_0.part').exists()
+    manifest = Manifest(str(tmpdir.join(MANIFEST_FILE)))
+    assert not manifest.is_complete('1')
+
+    # the next run downloads the file again
+    state['records'] = [dict(record_id=1, files=[_file_dict(1, 'a.txt')])]
+    assert _downloader(base_url, tmpdir).download() == []
+    assert tmpdir.join('1', 'file_0').read_binary() == FILES['a.txt']
+
+
+def test_unknown_checksum_algorithm(v1_server, tmpdir):
+    """Test that a file with an unknown checksum algorithm is downloaded."""
+    base_url, state = v1_server
+    state['records'] = [dict(record_id=1, files=[
+        _file_dict(1, 'a.txt', checksum='unknown:1234')])]
+
+    assert _downloader(base_url, tmpdir).download() == []
+    assert tmpdir.join('1', 'file_0').read_binary() == FILES['a.txt']